@@ -0,0 +1,67 @@
+"""Запись выборки проксируемых запросов в JSONL для воспроизведения (bench/replay.py).
+
+Доля TRAFFIC_CAPTURE_SAMPLE запросов (0 — запись выключена) пишется в
+TRAFFIC_CAPTURE_FILE по строке на запрос: время, метод, маршрут, строка
+запроса, sha256 тела, статусы ответа шлюза и сервиса, длительность. Само
+тело пишется только при TRAFFIC_CAPTURE_BODIES=true (без него replay
+пропускает POST).
+
+Файл ротируется по размеру (TRAFFIC_CAPTURE_MAX_BYTES, TRAFFIC_CAPTURE_BACKUPS
+старых файлов: requests.jsonl.1, .2, ...). Запись в файл идёт в отдельном
+потоке через очередь, запрос ждёт только постановки строки в очередь.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE", "traffic/requests.jsonl")
+CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", 0))
+CAPTURE_BODIES = os.getenv("TRAFFIC_CAPTURE_BODIES", "false").lower() == "true"
+CAPTURE_MAX_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", 10 * 1024 * 1024))
+CAPTURE_BACKUPS = int(os.getenv("TRAFFIC_CAPTURE_BACKUPS", 5))
+
+logger = logging.getLogger("traffic")
+logger.propagate = False
+listener = None
+
+
+def start():
+    global listener
+    if CAPTURE_SAMPLE <= 0 or listener is not None:
+        return
+    os.makedirs(os.path.dirname(CAPTURE_FILE) or ".", exist_ok=True)
+    handler = RotatingFileHandler(CAPTURE_FILE, maxBytes=CAPTURE_MAX_BYTES, backupCount=CAPTURE_BACKUPS,
+                                  encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    records = queue.Queue()
+    logger.addHandler(QueueHandler(records))
+    logger.setLevel(logging.INFO)
+    listener = QueueListener(records, handler)
+    listener.start()
+
+
+def sampled():
+    return listener is not None and random.random() < CAPTURE_SAMPLE
+
+
+def record(started, method, route, query, body, status, upstream_status, duration_ms):
+    entry = {
+        "ts": started,
+        "method": method,
+        "route": route,
+        "query": query,
+        "body_sha256": hashlib.sha256(body).hexdigest() if body else None,
+        "status": status,
+        "upstream_status": upstream_status,
+        "duration_ms": round(duration_ms, 3)
+    }
+    if CAPTURE_BODIES and body:
+        entry["body"] = body.decode("utf-8", errors="replace")
+    logger.info(json.dumps(entry, ensure_ascii=False))
+
+
+start()
@@ -1,13 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import httpx
+import time
+
+import capture
+import metrics
+import tracing
 
 app = FastAPI()
+tracing.install(app, "api-gateway")
+metrics.install(app)
 
 # Конфигурация
 SECRET_KEY = "your-secret-key-here"
@@ -21,6 +30,10 @@ SERVICES = {
     "lab3": "http://lab3-service:8000"
 }
 
+# Заголовки ответа сервиса, которые шлюз передаёт клиенту
+PASSTHROUGH_HEADERS = ("x-profile-id", "x-profile-url", "content-disposition", "etag", "cache-control",
+                       "retry-after", "x-next-cursor")
+
 
 # Модели данных
 class Token(BaseModel):
@@ -93,18 +106,19 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with tracing.span("auth.jwt"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
 
-    user = get_user(username=token_data.username)
-    if user is None:
-        raise credentials_exception
+        user = get_user(username=token_data.username)
+        if user is None:
+            raise credentials_exception
     return user
 
 
@@ -124,11 +138,54 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+async def stream_upstream(url, request, headers):
+    """Ответ сервиса потоком без буферизации (события заданий отчётов /jobs/{id}/events)."""
+    # Поток событий живёт, пока идёт задание: без таймаута чтения
+    client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+    response = await client.send(client.build_request("GET", url, params=request.query_params, headers=headers),
+                                 stream=True)
+
+    async def close():
+        await response.aclose()
+        await client.aclose()
+
+    return StreamingResponse(response.aiter_raw(), status_code=response.status_code,
+                             media_type=response.headers.get("content-type"),
+                             headers={h: response.headers[h] for h in PASSTHROUGH_HEADERS if h in response.headers},
+                             background=BackgroundTask(close))
+
+
+@app.middleware("http")
+async def capture_traffic(request: Request, call_next):
+    """Пишет выборку проксируемых запросов в журнал трафика для bench/replay.py.
+
+    Статус берётся из итогового ответа шлюза, поэтому отказы до обращения к
+    сервису (401, неизвестный сервис 404, 405) записываются со своим статусом.
+    """
+    # Прокси — маршруты вида /{сервис}/{путь}; потоки событий не воспроизводятся
+    if (request.url.path.count("/") < 2 or not capture.sampled()
+            or "text/event-stream" in request.headers.get("accept", "")):
+        return await call_next(request)
+    captured_at = time.time()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Тело и статус сервиса сохраняет proxy_request, если до него дошло
+        capture.record(captured_at, request.method, request.url.path, str(request.query_params),
+                       getattr(request.state, "capture_body", b""), status,
+                       getattr(request.state, "upstream_status", None), (time.perf_counter() - started) * 1000)
+
+
 @app.api_route("/{service_name}/{path:path}", methods=["GET", "POST"])
 async def proxy_request(
         service_name: str,
         path: str,
         request: Request,
+        outgoing: Response,
         current_user: User = Depends(get_current_user)
 ):
     if service_name not in SERVICES:
@@ -137,17 +194,41 @@ async def proxy_request(
     service_url = SERVICES[service_name]
     url = f"{service_url}/{path}"
 
+    if request.method == "GET" and "text/event-stream" in request.headers.get("accept", ""):
+        headers = dict(request.headers)
+        headers.pop("host", None)
+        return await stream_upstream(url, request, headers)
+
     async with httpx.AsyncClient() as client:
         # Формируем запрос к сервису
         headers = dict(request.headers)
         headers.pop("host", None)
 
-        if request.method == "GET":
-            response = await client.get(url, params=request.query_params, headers=headers)
-        elif request.method == "POST":
-            body = await request.json()
-            response = await client.post(url, json=body, headers=headers)
-        else:
-            raise HTTPException(status_code=405, detail="Method not allowed")
-
-        return response.json()
\ No newline at end of file
+        with tracing.span(f"upstream.{service_name}", path=path) as upstream:
+            # Сервис продолжает трассу шлюза от спана upstream
+            headers["traceparent"] = tracing.traceparent()
+            if request.method == "GET":
+                response = await client.get(url, params=request.query_params, headers=headers)
+            elif request.method == "POST":
+                request.state.capture_body = await request.body()
+                body = await request.json()
+                response = await client.post(url, json=body, headers=headers)
+            else:
+                raise HTTPException(status_code=405, detail="Method not allowed")
+            upstream.set_attribute("status", response.status_code)
+        request.state.upstream_status = response.status_code
+        tracing.add_server_timing(response.headers.get("server-timing"), service_name)
+
+        headers = {h: response.headers[h] for h in PASSTHROUGH_HEADERS if h in response.headers}
+        if response.status_code == 304:
+            # Отчёт не изменился с версии из If-None-Match клиента: ответ без тела
+            return Response(status_code=304, headers=headers)
+        if not response.headers.get("content-type", "").startswith("application/json"):
+            # Файлы (например, профили /admin/profiles/{name}) отдаются как есть
+            return Response(content=response.content, status_code=response.status_code,
+                            media_type=response.headers.get("content-type"), headers=headers)
+        outgoing.headers.update(headers)
+        result = response.json()
+        # Статус сервиса (202 задания, 404/409/503) доходит до клиента
+        outgoing.status_code = response.status_code
+        return result
@@ -0,0 +1,264 @@
+"""Нагрузочный прогон отчётов через шлюз и напрямую в lab-сервисы.
+
+Каждый сценарий (маршрут отчёта через api-gateway или напрямую в сервис)
+прогоняется на фиксированных уровнях параллельности: сначала BENCH_WARMUP
+запросов прогрева, затем BENCH_REQUESTS замеряемых. Для каждого уровня
+считаются пропускная способность, p50/p95/p99 задержки, число ошибок и
+среднее число обращений к каждому хранилищу на запрос (по заголовку
+Server-Timing, который отдают сервисы).
+
+Параметры запросов (группа, даты, год и семестр, поисковое слово)
+подбираются из PostgreSQL детерминированно, поэтому на данных одного
+профиля и зерна генератора (см. run.sh) прогоны сравнимы между собой.
+
+    python bench.py [--concurrency 1,8,32] [--requests 200] [--only lab1]
+                    [--baseline baselines/small.json] [--save-baseline baselines/small.json]
+
+Результат пишется в results/<время>-<профиль>.json; с --baseline прогон
+сравнивается с сохранённым, и при ухудшении p95 или пропускной способности
+больше чем на --tolerance процентов скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+
+import httpx
+import psycopg2
+
+GATEWAY_URL = os.getenv("BENCH_GATEWAY_URL", "http://api-gateway:8000")
+SERVICE_URLS = {
+    "lab1": os.getenv("BENCH_LAB1_URL", "http://lab1-service:8000"),
+    "lab2": os.getenv("BENCH_LAB2_URL", "http://lab2-service:8000"),
+    "lab3": os.getenv("BENCH_LAB3_URL", "http://lab3-service:8000"),
+}
+PG_DSN = os.getenv("BENCH_PG_DSN", "host=postgres dbname=university_db user=user password=password")
+PROFILE = os.getenv("GEN_PROFILE", "small")
+CONCURRENCY = os.getenv("BENCH_CONCURRENCY", "1,8,32")
+REQUESTS = int(os.getenv("BENCH_REQUESTS", 200))
+WARMUP = int(os.getenv("BENCH_WARMUP", 20))
+TIMEOUT = float(os.getenv("BENCH_TIMEOUT", 60))
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", "results")
+
+STORES = ("postgres", "neo4j", "mongo", "redis", "elasticsearch")
+SERVER_TIMING_CALLS_RE = re.compile(r'desc="(\d+) calls"')
+
+
+def discover_params():
+    """Параметры отчётов из данных: первые по id группа, материал и неделя посещаемости."""
+    conn = psycopg2.connect(PG_DSN)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT g.name
+                FROM groups g
+                JOIN schedule s ON s.group_id = g.id
+                JOIN lectures l ON l.id = s.lecture_id
+                WHERE l.is_special
+                ORDER BY g.id
+                LIMIT 1
+            """)
+            group_name = cur.fetchone()[0]
+            cur.execute("SELECT MIN(attendance_date)::date, MAX(attendance_date)::date FROM attendance")
+            start_date, end_date = cur.fetchone()
+            cur.execute("SELECT description FROM lecture_materials ORDER BY id LIMIT 1")
+            description = cur.fetchone()[0]
+    finally:
+        conn.close()
+
+    # Самое длинное слово описания — заведомо находится полнотекстовым поиском
+    search_term = max(re.findall(r"\w+", description), key=len)
+    return {
+        "lab1": {"search_term": search_term, "start_date": start_date.isoformat(),
+                 "end_date": end_date.isoformat(), "page_size": 100},
+        "lab2": {"year": start_date.year, "semester": 1 if start_date.month >= 9 else 2},
+        "lab3": {"group_name": group_name},
+    }
+
+
+def scenarios(params):
+    routes = {
+        "lab1": "/reports/low_attendance/",
+        "lab2": "/auditorium-requirements",
+        "lab3": "/group-attendance",
+    }
+    result = []
+    for service, path in routes.items():
+        result.append({"name": f"gateway.{service}", "url": f"{GATEWAY_URL}/{service}{path}",
+                       "params": params[service]})
+        result.append({"name": f"service.{service}", "url": f"{SERVICE_URLS[service]}{path}",
+                       "params": params[service]})
+    return result
+
+
+async def get_token(client):
+    response = await client.post(f"{GATEWAY_URL}/token", data={"username": "admin", "password": "secret"})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def store_calls(header):
+    """Обращения к хранилищам по Server-Timing: "postgres.x", "lab1.redis.y;desc=\"3 calls\"" и т.п."""
+    calls = Counter()
+    for entry in (header or "").split(","):
+        name, _, rest = entry.strip().partition(";")
+        parts = name.split(".")
+        if parts and parts[0] in SERVICE_URLS:
+            parts = parts[1:]
+        if parts and parts[0] in STORES:
+            match = SERVER_TIMING_CALLS_RE.search(rest)
+            calls[parts[0]] += int(match.group(1)) if match else 1
+    return calls
+
+
+async def drive(client, scenario, concurrency, count, latencies=None, calls=None):
+    """count запросов в concurrency параллельных потоков; возвращает число ошибок."""
+    remaining = count
+    errors = 0
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(scenario["url"], params=scenario["params"])
+            except httpx.HTTPError:
+                response = None
+            elapsed = time.perf_counter() - started
+            if response is None or response.status_code != 200:
+                errors += 1
+            elif latencies is not None:
+                latencies.append(elapsed)
+                calls.update(store_calls(response.headers.get("server-timing")))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return errors
+
+
+async def run_level(client, scenario, concurrency, requests, warmup):
+    await drive(client, scenario, concurrency, warmup)
+    latencies = []
+    calls = Counter()
+    started = time.perf_counter()
+    errors = await drive(client, scenario, concurrency, requests, latencies, calls)
+    return summarize(latencies, errors, calls, time.perf_counter() - started)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, calls, elapsed):
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "store_calls_per_request": {store: round(count / len(latencies), 2)
+                                    for store, count in sorted(calls.items())} if latencies else {},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Сравнение с базовым прогоном; возвращает список ухудшений."""
+    regressions = []
+    for name, levels in results["scenarios"].items():
+        for level, current in levels.items():
+            base = baseline.get("scenarios", {}).get(name, {}).get(level)
+            if not base or not base.get("p95_ms") or not current.get("p95_ms"):
+                continue
+            p95_change = (current["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+            # Пропускная способность базового прогона может быть нулевой (все запросы с ошибками)
+            base_rps, current_rps = base.get("throughput_rps"), current.get("throughput_rps")
+            if base_rps and current_rps is not None:
+                rps_change = (current_rps - base_rps) / base_rps * 100
+                rps = f"rps {base_rps:>8.2f} -> {current_rps:>8.2f} ({rps_change:+.1f}%)"
+            else:
+                rps_change = None
+                rps = "rps n/a"
+            print(f"{name:<16} c={level:<4} p95 {base['p95_ms']:>9.2f} -> {current['p95_ms']:>9.2f} ms "
+                  f"({p95_change:+.1f}%)  {rps}")
+            if p95_change > tolerance or (rps_change is not None and rps_change < -tolerance):
+                regressions.append(f"{name} c={level}")
+    return regressions
+
+
+async def run(args):
+    params = discover_params()
+    results = {
+        "profile": PROFILE,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "params": params,
+        "scenarios": {},
+    }
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(concurrency_levels), max_keepalive_connections=max(concurrency_levels))
+    async with httpx.AsyncClient(timeout=TIMEOUT, limits=limits) as client:
+        client.headers["Authorization"] = f"Bearer {await get_token(client)}"
+        for scenario in scenarios(params):
+            if args.only and not any(part in scenario["name"] for part in args.only.split(",")):
+                continue
+            levels = results["scenarios"].setdefault(scenario["name"], {})
+            for concurrency in concurrency_levels:
+                summary = await run_level(client, scenario, concurrency, args.requests, args.warmup)
+                levels[str(concurrency)] = summary
+                print(f"{scenario['name']:<16} c={concurrency:<4} {summary['throughput_rps']} rps  "
+                      f"p50 {summary['p50_ms']} p95 {summary['p95_ms']} p99 {summary['p99_ms']} ms  "
+                      f"errors {summary['errors']}  calls/req {summary['store_calls_per_request']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон отчётов")
+    parser.add_argument("--concurrency", default=CONCURRENCY, help="Уровни параллельности через запятую")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="Замеряемых запросов на уровень")
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--only", help="Только сценарии, содержащие одну из подстрок (lab1,gateway)")
+    parser.add_argument("--baseline", help="Файл базового прогона для сравнения")
+    parser.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="Допустимое ухудшение, %%")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{PROFILE}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {path}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Базовый прогон сохранён: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("profile") != PROFILE:
+            print(f"Внимание: базовый прогон снят на профиле {baseline.get('profile')}, текущий — {PROFILE}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Ухудшение больше {args.tolerance}%: {', '.join(regressions)}")
+            raise SystemExit(1)
+        print("Ухудшений относительно базового прогона нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Воспроизведение записанного шлюзом трафика (api_gateway/capture.py).
+
+Запросы из журнала (вместе с ротированными файлами requests.jsonl.N)
+отправляются в шлюз целевого стенда с исходными интервалами между ними,
+ускоренными в --speed раз. Для каждого маршрута сравниваются p50/p95 и
+доля ошибок записи и воспроизведения, считаются расхождения статусов.
+
+    python replay.py traffic/requests.jsonl [--target http://api-gateway:8000] [--speed 2]
+
+POST без сохранённого тела (TRAFFIC_CAPTURE_BODIES=false) пропускаются.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+
+import httpx
+
+from bench import percentile
+
+TARGET = os.getenv("BENCH_GATEWAY_URL", "http://api-gateway:8000")
+# Наибольшее число одновременных запросов; при превышении запросы отстают от графика
+MAX_IN_FLIGHT = int(os.getenv("REPLAY_MAX_IN_FLIGHT", 256))
+
+
+def load_log(path):
+    """Записи журнала и его ротированных копий по времени."""
+    # requests.jsonl.5 ... requests.jsonl.1 старше requests.jsonl
+    backups = sorted(glob.glob(f"{glob.escape(path)}.[0-9]*"), key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    entries = []
+    for name in backups + [path]:
+        with open(name, encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda e: e["ts"])
+    return entries
+
+
+def is_error(status):
+    return status is None or status >= 400
+
+
+async def replay(entries, target, speed, username, password):
+    results = []
+    skipped = 0
+    limit = asyncio.Semaphore(MAX_IN_FLIGHT)
+    lag = 0.0
+
+    async with httpx.AsyncClient(base_url=target, timeout=60,
+                                 limits=httpx.Limits(max_connections=MAX_IN_FLIGHT)) as client:
+        token = await client.post("/token", data={"username": username, "password": password})
+        token.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {token.json()['access_token']}"
+        origin = entries[0]["ts"] if entries else 0
+        start = time.perf_counter()
+
+        async def send(entry):
+            nonlocal lag
+            async with limit:
+                started = time.perf_counter()
+                # Отставание считается в момент отправки: вместе с ожиданием места в MAX_IN_FLIGHT
+                lag = max(lag, started - start - (entry["ts"] - origin) / speed)
+                try:
+                    if entry["method"] == "POST":
+                        response = await client.post(entry["route"], content=entry["body"].encode(),
+                                                     headers={"Content-Type": "application/json"})
+                    else:
+                        response = await client.get(f"{entry['route']}?{entry['query']}" if entry["query"]
+                                                    else entry["route"])
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = None
+                results.append((entry, status, (time.perf_counter() - started) * 1000))
+
+        tasks = []
+        for entry in entries:
+            if entry["method"] == "POST" and "body" not in entry:
+                skipped += 1
+                continue
+            delay = (entry["ts"] - origin) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(entry)))
+        await asyncio.gather(*tasks)
+    return results, skipped, lag
+
+
+def report(results):
+    routes = defaultdict(lambda: {"recorded": [], "replayed": [], "recorded_errors": 0,
+                                  "replayed_errors": 0, "status_mismatch": 0})
+    for entry, status, duration_ms in results:
+        stats = routes[f"{entry['method']} {entry['route']}"]
+        stats["recorded"].append(entry["duration_ms"])
+        stats["replayed"].append(duration_ms)
+        stats["recorded_errors"] += is_error(entry["status"])
+        stats["replayed_errors"] += is_error(status)
+        stats["status_mismatch"] += status != entry["status"]
+
+    summary = {}
+    for route, stats in sorted(routes.items()):
+        count = len(stats["recorded"])
+        summary[route] = {
+            "requests": count,
+            "recorded_p50_ms": round(percentile(stats["recorded"], 50), 2),
+            "recorded_p95_ms": round(percentile(stats["recorded"], 95), 2),
+            "replayed_p50_ms": round(percentile(stats["replayed"], 50), 2),
+            "replayed_p95_ms": round(percentile(stats["replayed"], 95), 2),
+            "recorded_error_rate": round(stats["recorded_errors"] / count, 4),
+            "replayed_error_rate": round(stats["replayed_errors"] / count, 4),
+            "status_mismatch": stats["status_mismatch"],
+        }
+        s = summary[route]
+        print(f"{route:<45} n={count:<6} p50 {s['recorded_p50_ms']:>8.2f} -> {s['replayed_p50_ms']:>8.2f}  "
+              f"p95 {s['recorded_p95_ms']:>8.2f} -> {s['replayed_p95_ms']:>8.2f} ms  "
+              f"errors {s['recorded_error_rate']:.2%} -> {s['replayed_error_rate']:.2%}  "
+              f"status mismatch {s['status_mismatch']}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика шлюза")
+    parser.add_argument("log", help="Журнал трафика (TRAFFIC_CAPTURE_FILE шлюза)")
+    parser.add_argument("--target", default=TARGET, help="Адрес шлюза целевого стенда")
+    parser.add_argument("--speed", type=float, default=1.0, help="Во сколько раз быстрее исходного темпа")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--output", help="Сохранить сравнение в JSON")
+    args = parser.parse_args()
+
+    entries = load_log(args.log)
+    span = entries[-1]["ts"] - entries[0]["ts"] if entries else 0
+    print(f"Записей: {len(entries)} за {span:.1f} с, воспроизведение x{args.speed} (~{span / args.speed:.1f} с)")
+
+    results, skipped, lag = asyncio.run(replay(entries, args.target, args.speed, args.username, args.password))
+    if skipped:
+        print(f"Пропущено POST без тела: {skipped}")
+    if lag > 1:
+        print(f"Внимание: отправка отставала от графика до {lag:.1f} с")
+    summary = report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"log": args.log, "speed": args.speed, "skipped": skipped, "routes": summary},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#!/bin/bash
+# Воспроизводимый прогон: хранилища и сервисы из compose.yml, данные генератора
+# фиксированного профиля и зерна, затем bench.py внутри сети compose.
+#
+#   bench/run.sh [профиль] [аргументы bench.py...]
+#   bench/run.sh small --save-baseline baselines/small.json
+#   bench/run.sh small --baseline baselines/small.json
+#
+# Генератор продолжает с контрольных точек, поэтому для смены профиля
+# хранилища нужно сначала очистить (rm_db.sh).
+set -e
+
+PROFILE="${1:-small}"
+shift || true
+SEED="${BENCH_SEED:-42}"
+
+cd "$(dirname "$0")/.."
+
+echo "Запуск хранилищ..."
+docker compose up -d --wait postgres mongo neo4j redis elasticsearch
+
+echo "Генерация данных: профиль $PROFILE, зерно $SEED..."
+docker compose run --rm -e GEN_PROFILE="$PROFILE" -e GEN_SEED="$SEED" data-generator python main.py
+
+echo "Запуск сервисов..."
+docker compose up -d --build api-gateway lab1-service lab2-service lab3-service
+
+echo "Прогон..."
+docker compose --profile bench run --rm --build -e GEN_PROFILE="$PROFILE" bench python bench.py "$@"
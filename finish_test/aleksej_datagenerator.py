@@ -8,6 +8,10 @@ from elasticsearch import Elasticsearch
 from neo4j import GraphDatabase
 import json
 import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import InsertOne, UpdateOne
+from bulk_writer import BulkWriter
 
 # Инициализация Faker
 fake = Faker('ru_RU')
@@ -34,6 +38,14 @@ es = Elasticsearch('http://localhost:9200', verify_certs=False)
 # Подключение к Neo4j
 neo4j_driver = GraphDatabase.driver("bolt://localhost:7687")
 
+# Все записи идут через буферы BulkWriter и сбрасываются пачками по BATCH_SIZE
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
+writer = BulkWriter(conn, es, mongo_db, neo4j_driver, r, batch_size=BATCH_SIZE)
+
+# Генерируемые семестры и число процессов, планирующих их параллельно
+SEMESTERS = os.getenv("SEMESTERS", "2024:1,2025:2")
+SEMESTER_WORKERS = int(os.getenv("SEMESTER_WORKERS", os.cpu_count() or 1))
+
 
 def create_tables():
     """Создание таблиц в PostgreSQL"""
@@ -53,18 +65,18 @@ def generate_universities():
     ]
 
     for uni in universities:
-        cursor.execute("INSERT INTO universities (name, address) VALUES (%s, %s) RETURNING id", uni)
-        uni_id = cursor.fetchone()[0]
+        uni_id = writer.allocate_id("universities")
+        writer.insert("universities", ("id", "name", "address"), (uni_id,) + uni)
 
         # Добавляем в MongoDB
-        mongo_db.universities.insert_one({
+        writer.mongo("universities", InsertOne({
             "id": uni_id,
             "name": uni[0],
             "address": uni[1],
             "institutes": []
-        })
+        }))
 
-    conn.commit()
+    writer.flush()
     return len(universities)
 
 
@@ -85,18 +97,17 @@ def generate_institutes(uni_count):
     for uni_id in range(1, uni_count + 1):
         for i in range(random.randint(2, 4)):
             name = f"{random.choice(institutes)} №{i + 1}"
-            cursor.execute("INSERT INTO institutes (name, university_id) VALUES (%s, %s) RETURNING id",
-                           (name, uni_id))
-            inst_id = cursor.fetchone()[0]
+            inst_id = writer.allocate_id("institutes")
+            writer.insert("institutes", ("id", "name", "university_id"), (inst_id, name, uni_id))
             institute_data.append((inst_id, name, uni_id))
 
             # Обновляем MongoDB
-            mongo_db.universities.update_one(
+            writer.mongo("universities", UpdateOne(
                 {"id": uni_id},
                 {"$push": {"institutes": {"id": inst_id, "name": name, "departments": []}}}
-            )
+            ))
 
-    conn.commit()
+    writer.flush()
     return institute_data
 
 
@@ -121,21 +132,19 @@ def generate_kafedras(institute_data):
     for inst_id, inst_name, uni_id in institute_data:
         for i in range(random.randint(3, 6)):
             name = f"Кафедра {random.choice(kafedra_names)} №{i + 1}"
-            cursor.execute("INSERT INTO kafedra (name, institute_id) VALUES (%s, %s) RETURNING id",
-                           (name, inst_id))
-            kaf_id = cursor.fetchone()[0]
+            kaf_id = writer.allocate_id("kafedra")
+            writer.insert("kafedra", ("id", "name", "institute_id"), (kaf_id, name, inst_id))
             kafedra_data.append((kaf_id, name, inst_id))
 
             # Обновляем MongoDB
-            mongo_db.universities.update_one(
+            writer.mongo("universities", UpdateOne(
                 {"institutes.id": inst_id},
                 {"$push": {"institutes.$.departments": {"id": kaf_id, "name": name}}}
-            )
+            ))
             # Добавляем в Neo4j
-            with neo4j_driver.session() as session:
-                session.run("CREATE (k:Kafedra {id: $id, name: $name})",
+            writer.cypher("CREATE (k:Kafedra {id: row.id, name: row.name})",
                           id=kaf_id, name=name)
-    conn.commit()
+    writer.flush()
     return kafedra_data
 
 
@@ -152,15 +161,14 @@ def generate_specialities(kafedra_data):
     speciality_data = []
     for kaf_id, kaf_name, inst_id in kafedra_data:
         for code, name in random.sample(specialities, random.randint(2, 4)):
-            cursor.execute("INSERT INTO specialities (code, name) VALUES (%s, %s) RETURNING id",
-                           (code, name))
-            spec_id = cursor.fetchone()[0]
+            spec_id = writer.allocate_id("specialities")
+            writer.insert("specialities", ("id", "code", "name"), (spec_id, code, name))
             speciality_data.append((spec_id, code, name, kaf_id))
 
             # Связываем специальность с кафедрой через отдельную таблицу (если нужно)
             # В данном случае связь уже есть через lectures_course
 
-    conn.commit()
+    writer.flush()
     return speciality_data
 
 
@@ -197,16 +205,13 @@ def generate_lecture_courses(kafedra_data, speciality_data):
             for i in range(random.randint(4, 8)):
                 course_name = f"{random.choice(courses)} ({name})"
                 hours = random.choice([32, 48, 64, 72, 96])
-                cursor.execute("""
-                               INSERT INTO lectures_course (name, kafedra_id, speciality_id, planned_hours)
-                               VALUES (%s, %s, %s, %s)
-                               RETURNING id
-                               """, (course_name, kaf_id, spec_id, hours))
-                course_id = cursor.fetchone()[0]
+                course_id = writer.allocate_id("lectures_course")
+                writer.insert("lectures_course", ("id", "name", "kafedra_id", "speciality_id", "planned_hours"),
+                              (course_id, course_name, kaf_id, spec_id, hours))
                 course_data.append((course_id, course_name, kaf_id, spec_id, hours))
 
 
-    conn.commit()
+    writer.flush()
     return course_data
 
 
@@ -226,21 +231,17 @@ def generate_groups(kafedra_data, speciality_data):
                 year = random.randint(2019, 2023)
                 group_name = f"{random.choice(group_types)}-{str(i + 1).zfill(2)}-{str(year)[-2:]}"
                 course = min(6, (date.today().year - year) + 1)
-                cursor.execute("""
-                               INSERT INTO groups (name, course, specialities_id)
-                               VALUES (%s, %s, %s)
-                               RETURNING id
-                               """, (group_name, course, spec_id))
-                group_id = cursor.fetchone()[0]
+                group_id = writer.allocate_id("groups")
+                writer.insert("groups", ("id", "name", "course", "specialities_id"),
+                              (group_id, group_name, course, spec_id))
                 group_data.append((group_id, group_name, course, spec_id))
 
 
 
-                with neo4j_driver.session() as session:
-                    session.run("""
-                        CREATE (g:Group {id: $id, name: $name, course: $course})
-                    """, id=group_id, name=group_name, course=course)
-    conn.commit()
+                writer.cypher("""
+                    CREATE (g:Group {id: row.id, name: row.name, course: row.course})
+                """, id=group_id, name=group_name, course=course)
+    writer.flush()
     return group_data
 
 
@@ -271,17 +272,14 @@ def generate_lectures(course_data):
             is_special = random.random() < 0.2
             tech_req = "Проектор, компьютер" if not is_special else "VR оборудование, 3D очки"
 
-            cursor.execute("""
-                           INSERT INTO lectures (topic, course_id, duration_hours, is_special, tech_requirements)
-                           VALUES (%s, %s, %s, %s, %s)
-                           RETURNING id
-                           """, (topic, course_id, duration, is_special, tech_req))
-            lecture_id = cursor.fetchone()[0]
+            lecture_id = writer.allocate_id("lectures")
+            writer.insert("lectures", ("id", "topic", "course_id", "duration_hours", "is_special", "tech_requirements"),
+                          (lecture_id, topic, course_id, duration, is_special, tech_req))
             lecture_data.append((lecture_id, topic, course_id, duration, is_special, tech_req))
 
             # Добавляем в Elasticsearch
             desc = fake.paragraph(nb_sentences=5)
-            es.index(index="lectures", id=lecture_id, body={
+            writer.index("lectures", lecture_id, {
                 "topic": topic,
                 "description": desc,
                 "duration": duration,
@@ -289,17 +287,16 @@ def generate_lectures(course_data):
             })
 
             # Добавляем в Neo4j
-            with neo4j_driver.session() as session:
-                session.run("""
-                    CREATE (l:Lecture {id: $id, topic: $topic, duration_hours: $duration, 
-                            is_special: $is_special, tech_requirements: $tech_req})
-                    WITH l
-                    MATCH (c:Course {id: $course_id})
-                    CREATE (l)-[:ORIGINATES_FROM]->(c)
-                """, id=lecture_id, topic=topic, duration=duration,
-                            is_special=is_special, tech_req=tech_req, course_id=course_id)
-
-    conn.commit()
+            writer.cypher("""
+                CREATE (l:Lecture {id: row.id, topic: row.topic, duration_hours: row.duration, 
+                        is_special: row.is_special, tech_requirements: row.tech_req})
+                WITH l, row
+                MATCH (c:Course {id: row.course_id})
+                CREATE (l)-[:ORIGINATES_FROM]->(c)
+            """, id=lecture_id, topic=topic, duration=duration,
+                          is_special=is_special, tech_req=tech_req, course_id=course_id)
+
+    writer.flush()
     return lecture_data
 
 
@@ -317,13 +314,9 @@ def generate_lecture_materials(lecture_data):
     for lecture_id, topic, course_id, duration, is_special, tech_req in lecture_data:
         mat_type, mat_desc = random.choice(material_types)
         mat_name = f"{mat_type} по '{topic}'"
-        cursor.execute("""
-                       INSERT INTO lecture_materials (name, description, lecture_id)
-                       VALUES (%s, %s, %s)
-                       RETURNING id
-                       """, (mat_name, mat_desc, lecture_id))
-        #mat_id = cursor.fetchone()[0]
-    conn.commit()
+        writer.insert("lecture_materials", ("name", "description", "lecture_id"),
+                      (mat_name, mat_desc, lecture_id))
+    writer.flush()
 
 
 def generate_students(group_data):
@@ -343,16 +336,13 @@ def generate_students(group_data):
 
             existing_records.add(record)  # Добавляем в множество
 
-            cursor.execute("""
-                           INSERT INTO students (full_name, student_record, group_id)
-                           VALUES (%s, %s, %s)
-                           RETURNING id
-                           """, (full_name, record, group_id))
-            student_id = cursor.fetchone()[0]
+            student_id = writer.allocate_id("students")
+            writer.insert("students", ("id", "full_name", "student_record", "group_id"),
+                          (student_id, full_name, record, group_id))
             student_data.append((student_id, full_name, record, group_id))
 
             # Добавляем в Redis
-            r.set(f"student:{student_id}", json.dumps({
+            writer.redis_set(f"student:{student_id}", json.dumps({
                 "id": student_id,
                 "full_name": full_name,
                 "student_record": record,
@@ -360,22 +350,42 @@ def generate_students(group_data):
             }))
 
             # Добавляем в Neo4j
-            with neo4j_driver.session() as session:
-                session.run("""
-                    CREATE (s:Student {id: $id, full_name: $name, student_record: $record})
-                    WITH s
-                    MATCH (g:Group {id: $group_id})
-                    CREATE (s)-[:MEMBER_OF]->(g)
-                """, id=student_id, name=full_name, record=record, group_id=group_id)
-
-    conn.commit()
+            writer.cypher("""
+                CREATE (s:Student {id: row.id, full_name: row.name, student_record: row.record})
+                WITH s, row
+                MATCH (g:Group {id: row.group_id})
+                CREATE (s)-[:MEMBER_OF]->(g)
+            """, id=student_id, name=full_name, record=record, group_id=group_id)
+
+    writer.flush()
     return student_data
 
 
-def generate_schedule_and_attendance(group_data, lecture_data, student_data, course_data,year, semester):
-    """Генерация расписания и посещаемости на учебный год"""
-    schedule_data = []
-    auditoriums = [f"{b}-{r}{n}" for b in ["A", "B", "C"] for r in range(1, 5) for n in range(1, 21)]
+AUDITORIUMS = [f"{b}-{r}{n}" for b in ["A", "B", "C"] for r in range(1, 5) for n in range(1, 21)]
+
+
+def build_indexes(lecture_data, student_data, course_data):
+    """Индексы специальность -> лекции и группа -> студенты вместо полного
+    перебора lecture_data x course_data и student_data на каждое занятие."""
+    course_spec = {c[0]: c[3] for c in course_data}
+    spec_lectures = {}
+    for lecture in lecture_data:
+        spec_lectures.setdefault(course_spec.get(lecture[2]), []).append(lecture)
+    group_students = {}
+    for student in student_data:
+        group_students.setdefault(student[3], []).append(student[0])
+    return spec_lectures, group_students
+
+
+def plan_semester(task):
+    """Выбирает занятия и статусы посещаемости на семестр, ничего не записывая.
+
+    Выполняется в рабочем процессе: случайные решения зависят только от seed,
+    а идентификаторы расписания выдаёт и данные записывает родительский процесс.
+    """
+    group_data, spec_lectures, group_students, year, semester, seed = task
+    rnd = random.Random(seed)
+    plan = []
 
     # Даты семестра
     if semester == 1:
@@ -388,14 +398,14 @@ def generate_schedule_and_attendance(group_data, lecture_data, student_data, cou
     # Создаем расписание для каждой группы
     for group_id, group_name, course, spec_id in group_data:
         # Берем лекции для специальности этой группы
-        group_lectures = [l for l in lecture_data if any(c[3] == spec_id for c in course_data if c[0] == l[2])]
+        group_lectures = list(spec_lectures.get(spec_id, []))
         if not group_lectures:
             continue
 
         # Генерируем 20-30 занятий на семестр
-        num_lectures = random.randint(20, 30)
+        num_lectures = rnd.randint(20, 30)
         lecture_dates = sorted([
-            semester_start + timedelta(days=random.randint(0, (semester_end - semester_start).days))
+            semester_start + timedelta(days=rnd.randint(0, (semester_end - semester_start).days))
             for _ in range(num_lectures)
         ])
 
@@ -408,56 +418,83 @@ def generate_schedule_and_attendance(group_data, lecture_data, student_data, cou
                 continue
 
             # Выбираем случайную лекцию и удаляем ее из списка доступных
-            lecture_idx = random.randint(0, len(group_lectures) - 1)
+            lecture_idx = rnd.randint(0, len(group_lectures) - 1)
             lecture = group_lectures.pop(lecture_idx)
-            lecture_id = lecture[0]
-
-            # Добавляем запись в расписание
-            cursor.execute(
-                "INSERT INTO schedule (auditorium, group_id, lecture_id, seats) VALUES (%s, %s, %s, %s) RETURNING id",
-                (random.choice(auditoriums), group_id, lecture_id, random.randint(20, 30)))
-            schedule_id = cursor.fetchone()[0]
-            schedule_data.append((schedule_id, group_id, lecture_id, lecture_date))
-
-            # Добавляем связь в Neo4j
-            with neo4j_driver.session() as session:
-                session.run("""
-                    MATCH (g:Group {id: $group_id}), (l:Lecture {id: $lecture_id})
-                    CREATE (s:Schedule {id: $schedule_id, date: date($date), auditorium: $auditorium})
-                    CREATE (g)-[:HAS_SCHEDULE]->(s)
-                    CREATE (s)-[:FOR_LECTURE]->(l)
-                """, {
-                    "group_id": group_id,
-                    "lecture_id": lecture_id,
-                    "schedule_id": schedule_id,
-                    "date": lecture_date.isoformat(),
-                    "auditorium": random.choice(auditoriums)
-                })
 
             # Генерация посещаемости
-            group_students = [s for s in student_data if s[3] == group_id]
-            for student in group_students:
-                status = random.choices(
-                    ['present', 'absent', 'late'],
-                    weights=[0.8, 0.15, 0.05]
-                )[0]
-
-                cursor.execute(
-                    "INSERT INTO attendance (student_id, schedule_id, week_start, status) VALUES (%s, %s, %s, %s)",
-                    (student[0], schedule_id, lecture_date - timedelta(days=lecture_date.weekday()), status))
-
-                # Добавляем в Neo4j
-                with neo4j_driver.session() as session:
-                    session.run("""
-                        MATCH (s:Student {id: $student_id}), (sch:Schedule {id: $schedule_id})
-                        CREATE (s)-[:ATTENDED {status: $status}]->(sch)
-                    """, {
-                        "student_id": student[0],
-                        "schedule_id": schedule_id,
-                        "status": status
-                    })
-
-            conn.commit()
+            attendance = [
+                (student_id, rnd.choices(['present', 'absent', 'late'], weights=[0.8, 0.15, 0.05])[0])
+                for student_id in group_students.get(group_id, [])
+            ]
+            plan.append((group_id, lecture[0], lecture_date, rnd.choice(AUDITORIUMS),
+                         rnd.randint(20, 30), rnd.choice(AUDITORIUMS), attendance))
+    return plan
+
+
+def write_semester(plan):
+    """Записывает план семестра через BulkWriter и возвращает строки расписания."""
+    schedule_data = []
+    for group_id, lecture_id, lecture_date, auditorium, seats, neo_auditorium, attendance in plan:
+        # Добавляем запись в расписание
+        schedule_id = writer.allocate_id("schedule")
+        writer.insert("schedule", ("id", "auditorium", "group_id", "lecture_id", "seats"),
+                      (schedule_id, auditorium, group_id, lecture_id, seats))
+        schedule_data.append((schedule_id, group_id, lecture_id, lecture_date))
+
+        # Добавляем связь в Neo4j
+        writer.cypher("""
+            MATCH (g:Group {id: row.group_id}), (l:Lecture {id: row.lecture_id})
+            CREATE (s:Schedule {id: row.schedule_id, date: date(row.date), auditorium: row.auditorium})
+            CREATE (g)-[:HAS_SCHEDULE]->(s)
+            CREATE (s)-[:FOR_LECTURE]->(l)
+        """, **{
+            "group_id": group_id,
+            "lecture_id": lecture_id,
+            "schedule_id": schedule_id,
+            "date": lecture_date.isoformat(),
+            "auditorium": neo_auditorium
+        })
+
+        week_start = lecture_date - timedelta(days=lecture_date.weekday())
+        for student_id, status in attendance:
+            writer.insert("attendance", ("student_id", "schedule_id", "week_start", "status"),
+                          (student_id, schedule_id, week_start, status))
+
+            # Добавляем в Neo4j
+            writer.cypher("""
+                MATCH (s:Student {id: row.student_id}), (sch:Schedule {id: row.schedule_id})
+                CREATE (s)-[:ATTENDED {status: row.status}]->(sch)
+            """, **{
+                "student_id": student_id,
+                "schedule_id": schedule_id,
+                "status": status
+            })
+
+    writer.flush()
+    return schedule_data
+
+
+def generate_schedule_and_attendance(group_data, lecture_data, student_data, course_data,year, semester):
+    """Генерация расписания и посещаемости на учебный год"""
+    spec_lectures, group_students = build_indexes(lecture_data, student_data, course_data)
+    plan = plan_semester((group_data, spec_lectures, group_students, year, semester, random.getrandbits(64)))
+    return write_semester(plan)
+
+
+def generate_semesters(group_data, lecture_data, student_data, course_data, semesters, workers=None):
+    """Генерация нескольких семестров (список пар (год, семестр)) параллельно.
+
+    Планы строятся в рабочих процессах, а записываются в родительском в
+    порядке semesters, поэтому идентификаторы и связи между хранилищами
+    согласованы так же, как при последовательной генерации.
+    """
+    spec_lectures, group_students = build_indexes(lecture_data, student_data, course_data)
+    tasks = [(group_data, spec_lectures, group_students, year, semester, random.getrandbits(64))
+             for year, semester in semesters]
+    schedule_data = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for plan in pool.map(plan_semester, tasks):
+            schedule_data.extend(write_semester(plan))
     return schedule_data
 
 
@@ -480,8 +517,10 @@ def main():
     student_data = generate_students(group_data)
 
 
-    generate_schedule_and_attendance(group_data, lecture_data, student_data,course_data, 2024, 1)  # Осенний семестр
-    #generate_schedule_and_attendance(group_data, lecture_data, student_data, course_data,2025, 2)  # Весенний семестр
+    # Семестры задаются как "год:семестр" через запятую, по умолчанию осень 2024 и весна 2025
+    semesters = [tuple(int(v) for v in item.split(":")) for item in SEMESTERS.split(",")]
+    generate_semesters(group_data, lecture_data, student_data, course_data, semesters, SEMESTER_WORKERS)
+    writer.close()
 
     # Общее количество записей
     cursor.execute("SELECT COUNT(*) FROM universities")
@@ -0,0 +1,108 @@
+"""Пакетная запись сгенерированных данных во все хранилища.
+
+Генератор по-прежнему создаёт сущности по одной, но вместо отдельного запроса
+на каждую строку складывает их в буферы BulkWriter, которые сбрасываются
+пачками: многострочный INSERT в PostgreSQL, helpers.bulk в Elasticsearch,
+bulk_write в MongoDB, UNWIND в Neo4j (в одной переиспользуемой сессии) и
+pipeline в Redis.
+
+Идентификаторы строк выдаются заранее блоками из serial-последовательностей
+таблиц, поэтому сущность получает свой id сразу, без INSERT ... RETURNING.
+"""
+from elasticsearch import helpers
+from psycopg2.extras import execute_values
+
+
+class BulkWriter:
+    def __init__(self, conn, es, mongo_db, neo4j_driver, redis_client, batch_size=1000, id_block=1000):
+        self.conn = conn
+        self.es = es
+        self.mongo_db = mongo_db
+        self.batch_size = batch_size
+        self.id_block = id_block
+        self.neo4j_session = neo4j_driver.session()
+
+        # Буферы в порядке первого использования: родительские таблицы и узлы
+        # регистрируются раньше дочерних, и сброс в этом порядке не нарушает связей
+        self.pg_rows = {}
+        self.es_actions = []
+        self.mongo_ops = {}
+        self.neo4j_rows = {}
+        self.redis_pipe = redis_client.pipeline(transaction=False)
+        self.redis_pending = 0
+
+        self.free_ids = {}
+
+    def allocate_id(self, table):
+        """Следующий id таблицы; последовательность продвигается блоками по id_block."""
+        ids = self.free_ids.setdefault(table, [])
+        if not ids:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    (table, self.id_block))
+                ids.extend(row[0] for row in reversed(cur.fetchall()))
+        return ids.pop()
+
+    def insert(self, table, columns, values):
+        self.pg_rows.setdefault((table, tuple(columns)), []).append(tuple(values))
+        self._maybe_flush(len(self.pg_rows[(table, tuple(columns))]))
+
+    def index(self, index, doc_id, body):
+        self.es_actions.append({"_index": index, "_id": doc_id, "_source": body})
+        self._maybe_flush(len(self.es_actions))
+
+    def mongo(self, collection, operation):
+        """operation: InsertOne/UpdateOne и т.п.; операции коллекции применяются по порядку."""
+        self.mongo_ops.setdefault(collection, []).append(operation)
+        self._maybe_flush(len(self.mongo_ops[collection]))
+
+    def cypher(self, statement, **row):
+        """statement обращается к параметрам через row.<имя>; сброс выполняет его
+        один раз на пачку как UNWIND $rows AS row."""
+        self.neo4j_rows.setdefault(statement, []).append(row)
+        self._maybe_flush(len(self.neo4j_rows[statement]))
+
+    def redis_set(self, key, value):
+        self.redis_pipe.set(key, value)
+        self.redis_pending += 1
+        self._maybe_flush(self.redis_pending)
+
+    def _maybe_flush(self, size):
+        # Сбрасываются все буферы сразу: дочерние строки могут ссылаться на ещё
+        # не записанные родительские из других буферов
+        if size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Записывает все буферы и фиксирует транзакцию PostgreSQL."""
+        with self.conn.cursor() as cur:
+            for (table, columns), rows in self.pg_rows.items():
+                if rows:
+                    execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                                   rows, page_size=self.batch_size)
+                    rows.clear()
+        self.conn.commit()
+
+        if self.es_actions:
+            helpers.bulk(self.es, self.es_actions)
+            self.es_actions = []
+
+        for collection, ops in self.mongo_ops.items():
+            if ops:
+                self.mongo_db[collection].bulk_write(ops, ordered=True)
+                ops.clear()
+
+        for statement, rows in self.neo4j_rows.items():
+            if rows:
+                self.neo4j_session.execute_write(
+                    lambda tx, s=statement, r=rows: tx.run(f"UNWIND $rows AS row {s}", rows=r).consume())
+                rows.clear()
+
+        if self.redis_pending:
+            self.redis_pipe.execute()
+            self.redis_pending = 0
+
+    def close(self):
+        self.flush()
+        self.neo4j_session.close()
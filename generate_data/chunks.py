@@ -0,0 +1,56 @@
+"""Пачечная загрузка этапов генератора в пуле потоков.
+
+Этап продолжается после сбоя с отметки последней записанной пачки, поэтому
+пачки, записанные после неё, при продолжении записываются повторно: запись
+пачки в каждое хранилище должна быть идемпотентной.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from pymongo import ReplaceOne
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def run_chunks(handler, chunks, workers, progress, on_done=None):
+    """Обрабатывает пачки из chunks в пуле из workers потоков.
+
+    handler получает пачку и возвращает число обработанных записей,
+    которое добавляется к индикатору progress. Пачки забираются из chunks
+    по мере освобождения потоков (не больше 2 * workers в работе), так что
+    потоковый источник не вычитывается в память целиком.
+
+    Результаты принимаются в порядке пачек, и on_done(chunk) вызывается только
+    когда все предыдущие пачки тоже записаны — по нему сохраняется отметка,
+    с которой можно продолжить после сбоя. Если пачка упала, уже отправленные
+    следующие пачки дописываются без отметки и при продолжении пишутся снова.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        def complete():
+            chunk, future = pending.popleft()
+            progress.update(future.result())
+            if on_done:
+                on_done(chunk)
+
+        for chunk in chunks:
+            if len(pending) >= 2 * workers:
+                complete()
+            pending.append((chunk, pool.submit(handler, chunk)))
+        while pending:
+            complete()
+
+
+def upsert_by_id(collection, documents):
+    """Записывает документы MongoDB с заменой по полю id; повторная запись не создаёт копий."""
+    collection.bulk_write([ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in documents], ordered=False)
+    return len(documents)
@@ -96,5 +96,65 @@ CREATE TABLE IF NOT EXISTS attendance (
 )
 PARTITION BY RANGE (week_start);
 
+-- Отметки занятия: выборка по расписанию (lab3, пересчёт HAS_SCHEDULE в sync_worker.py)
+CREATE INDEX IF NOT EXISTS attendance_schedule_student ON attendance (schedule_id, student_id);
 
 
+
+-- Отметки этапов генератора: завершённые этапы пропускаются при повторном
+-- запуске, high_water — последний зафиксированный ключ или номер пачки
+CREATE TABLE IF NOT EXISTS generator_checkpoints (
+    stage VARCHAR(50) PRIMARY KEY,
+    status VARCHAR(10) NOT NULL CHECK (status IN ('running','done')),
+    high_water BIGINT,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Журнал изменений для инкрементальной синхронизации вторичных хранилищ
+-- (заполняется триггерами из functions.sql). tx — транзакция изменения:
+-- sync_worker.py читает только записи завершённых транзакций
+CREATE TABLE IF NOT EXISTS sync_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    tx xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    table_name VARCHAR(50) NOT NULL,
+    op CHAR(1) NOT NULL CHECK (op IN ('I','U','D')),
+    row_id INT NOT NULL,
+    row_data JSONB,
+    changed_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS sync_outbox_tx_id ON sync_outbox (tx, id);
+
+-- Позиция каждого хранилища в sync_outbox: последняя применённая запись (tx, id)
+CREATE TABLE IF NOT EXISTS sync_watermarks (
+    store VARCHAR(20) PRIMARY KEY,
+    tx xid8 NOT NULL,
+    outbox_id BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Сводка посещаемости студента по лекции для отчёта lab1 о низкой посещаемости.
+-- Обновляется генератором и sync_worker.py (REFRESH ... CONCURRENTLY требует
+-- уникального индекса), страницы отчёта читаются по индексу в порядке ключа
+-- постраничного вывода (percents, student_id, topic, lecture_id)
+CREATE MATERIALIZED VIEW IF NOT EXISTS student_lecture_attendance AS
+SELECT
+    l.id AS lecture_id,
+    l.topic,
+    s.id AS student_id,
+    s.group_id,
+    g.department_id,
+    COUNT(*) FILTER (WHERE a.status = 'presence') * 100.0 / COUNT(a.id) AS percents
+FROM lectures l
+JOIN schedule sch ON l.id = sch.lecture_id
+JOIN attendance a ON sch.id = a.schedule_id
+JOIN students s ON a.student_id = s.id
+JOIN groups g ON g.id = s.group_id
+GROUP BY l.id, l.topic, s.id, s.group_id, g.department_id
+WITH NO DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS student_lecture_attendance_key
+    ON student_lecture_attendance (lecture_id, student_id);
+
+CREATE INDEX IF NOT EXISTS student_lecture_attendance_page
+    ON student_lecture_attendance (percents, student_id, topic, lecture_id);
@@ -0,0 +1,38 @@
+-- Захват изменений в sync_outbox. Триггеры уровня оператора с таблицами
+-- переходов пишут все строки оператора одним INSERT ... SELECT; row_data
+-- сохраняется только для удалений, остальные строки sync_worker.py читает
+-- из самих таблиц. Сессия с sync.capture = off (генератор) не пишет журнал.
+CREATE OR REPLACE FUNCTION sync_capture() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('sync.capture', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO sync_outbox (table_name, op, row_id, row_data)
+        SELECT TG_TABLE_NAME, 'D', o.id, to_jsonb(o) FROM old_rows o;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO sync_outbox (table_name, op, row_id)
+        SELECT TG_TABLE_NAME, 'U', n.id FROM new_rows n;
+    ELSE
+        INSERT INTO sync_outbox (table_name, op, row_id)
+        SELECT TG_TABLE_NAME, 'I', n.id FROM new_rows n;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+@
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['universities', 'institutes', 'departments', 'lecture_course', 'lectures',
+                             'lecture_materials', 'groups', 'students', 'schedule', 'attendance'] LOOP
+        EXECUTE format('CREATE OR REPLACE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION sync_capture()', t || '_sync_insert', t);
+        EXECUTE format('CREATE OR REPLACE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS new_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION sync_capture()', t || '_sync_update', t);
+        EXECUTE format('CREATE OR REPLACE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION sync_capture()', t || '_sync_delete', t);
+    END LOOP;
+END;
+$$
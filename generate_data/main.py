@@ -1,16 +1,26 @@
 import psycopg2
-from psycopg2.extras import execute_values, RealDictCursor
+from psycopg2.extras import execute_values, NamedTupleCursor
 from psycopg2 import sql
 from faker import Faker
 from faker.providers import BaseProvider
 import random
 import json
+import msgpack
 import redis
 from elasticsearch import Elasticsearch, helpers
 from pymongo import MongoClient
 from neo4j import GraphDatabase
 import os
+import sys
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
+from itertools import count
+from tqdm import tqdm
+import partitions
+from chunks import chunked, run_chunks, upsert_by_id
 fake = Faker('ru_RU')  # Для русскоязычных данных
 
 
@@ -107,191 +117,337 @@ def generate_random_date(start_date, end_date):
 
 start_date_semester = datetime.strptime("2025-01-10", "%Y-%m-%d")
 end_date_semester = datetime.strptime("2025-12-20", "%Y-%m-%d")
+# На сколько недель вперёд создавать партиции attendance
+PARTITION_AHEAD_WEEKS = int(os.getenv("PARTITION_AHEAD_WEEKS", 8))
+
+# Профили масштаба: число сущностей на каждом уровне иерархии.
+# x10/x100 умножают число университетов (а с ним группы, студентов и
+# посещаемость) и специальностей относительно small.
+SCALE_PROFILES = {
+    "small": {
+        "universities": 1,
+        "institutes_per_university": 3,
+        "departments_per_institute": 3,
+        "specialties": 3,
+        "courses_per_department": 3,
+        "lectures_per_course": 5,
+        "materials_per_lecture": 1,
+        "groups_per_department": 3,
+        "students_per_group": 10,
+        "schedules_per_group": 10,
+        "attendance_min": 4,
+        "attendance_max": 50,
+    },
+}
+SCALE_PROFILES["x10"] = dict(SCALE_PROFILES["small"], universities=10, specialties=30)
+SCALE_PROFILES["x100"] = dict(SCALE_PROFILES["small"], universities=100, specialties=300)
+
+# Число записей в одной задаче пула процессов; от него (а не от числа
+# процессов) зависит разбиение на задачи, поэтому результат детерминирован
+SYNTH_TASK_SIZE = int(os.getenv("GEN_TASK_SIZE", 2000))
+
+# Базовое зерно генерации и пул процессов; задаются в main()
+base_seed = None
+synth_pool = None
+
+
+def task_seed(name, index):
+    # Строковое зерно: random.seed хэширует его детерминированно (в отличие от hash())
+    return f"{base_seed}:{name}:{index}"
+
+
+def _synthesize_task(task):
+    factory, seed, count = task
+    random.seed(seed)
+    fake.seed_instance(seed)
+    return [factory() for _ in range(count)]
+
+
+def synthesize(factory, count):
+    """Создаёт count записей factory(), распределяя работу по пулу процессов.
+
+    Каждая задача засевается своим зерном от base_seed, имени фабрики и
+    номера задачи, так что результат не зависит от числа процессов.
+    """
+    tasks = [
+        (factory, task_seed(factory.__name__, i), min(SYNTH_TASK_SIZE, count - start))
+        for i, start in enumerate(range(0, count, SYNTH_TASK_SIZE))
+    ]
+    mapper = synth_pool.imap if synth_pool else map
+    records = []
+    for chunk in mapper(_synthesize_task, tasks):
+        records.extend(chunk)
+    return records
+
 
 def insert_universities(cur, num):
-    universities = [new_university() for _ in range(num)]
+    universities = synthesize(new_university, num)
     values = [(u["name"], u["address"]) for u in universities]
     sql = "INSERT INTO universities (name, address) VALUES (%s, %s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, name FROM universities;")
-    return cur.fetchall()
 
 def insert_institutes(cur, universities, institutes_per_uni):
-    institutes = []
-    for uni in universities:
-        uni_id = uni[0]  
-        for _ in range(institutes_per_uni):
-            inst = new_institute()
-            inst["university_id"] = uni_id
-            institutes.append(inst)
+    institutes = synthesize(new_institute, len(universities) * institutes_per_uni)
+    for i, inst in enumerate(institutes):
+        inst["university_id"] = universities[i // institutes_per_uni][0]
     values = [(inst["name"], inst["university_id"]) for inst in institutes]
     sql = "INSERT INTO institutes (name, university_id) VALUES (%s, %s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, name, university_id FROM institutes;")
-    return cur.fetchall()
 
 def insert_departments(cur, institutes, departments_per_inst):
+    names = synthesize(new_department, len(institutes) * departments_per_inst)
     departments = []
-    for inst in institutes:
-        inst_id = inst[0]
-        for _ in range(departments_per_inst):
-            dept = {
-                "name": new_department(),
-                "institute_id": inst_id
-            }
-            departments.append(dept)
+    for i, name in enumerate(names):
+        dept = {
+            "name": name,
+            "institute_id": institutes[i // departments_per_inst][0]
+        }
+        departments.append(dept)
     values = [(d["name"], d["institute_id"]) for d in departments]
     sql = "INSERT INTO departments (name, institute_id) VALUES (%s, %s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, name, institute_id FROM departments;")
-    return cur.fetchall()
 
 
 def insert_specialties(cur, num):
-    specialties = [new_specialty() for _ in range(num)]
+    specialties = synthesize(new_specialty, num)
     values = [(s["code"], s["name"]) for s in specialties]
     sql = "INSERT INTO specialties (code, name) VALUES (%s, %s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, code FROM specialties;")
-    return cur.fetchall()
 
 def insert_lecture_courses(cur, departments, specialties, courses_per_dept):
-    courses = []
-    for dept in departments:
-        dept_id = dept[0]
-        for _ in range(courses_per_dept):
-            lc = new_lecture_course()
-            lc["department_id"] = dept_id
-            lc["specialty_id"] = random.choice(specialties)[0]
-            courses.append(lc)
+    courses = synthesize(new_lecture_course, len(departments) * courses_per_dept)
+    for i, lc in enumerate(courses):
+        lc["department_id"] = departments[i // courses_per_dept][0]
+        lc["specialty_id"] = random.choice(specialties)[0]
     values = [(c["name"], c["department_id"], c["specialty_id"], c["planned_hours"]) for c in courses]
     sql = "INSERT INTO lecture_course (name, department_id, specialty_id, planned_hours) VALUES (%s,%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, department_id FROM lecture_course;")
-    return cur.fetchall()
 
 def insert_lectures(cur, courses, lectures_per_course):
-    lectures = []
-    for course in courses:
-        course_id = course[0]
-        for _ in range(lectures_per_course):
-            lec = new_lecture()
-            lec["course_id"] = course_id
-            lectures.append(lec)
+    lectures = synthesize(new_lecture, len(courses) * lectures_per_course)
+    for i, lec in enumerate(lectures):
+        lec["course_id"] = courses[i // lectures_per_course][0]
     values = [(l["topic"], l["course_id"], l["is_special"], l["tech_requirements"]) for l in lectures]
     sql = "INSERT INTO lectures (topic, course_id, is_special, tech_requirements) VALUES (%s,%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, course_id FROM lectures;")
-    return cur.fetchall()
 
 def insert_lecture_materials(cur, lectures, materials_per_lecture):
-    materials = []
-    for lec in lectures:
-        lec_id = lec[0]
-        for _ in range(materials_per_lecture):
-            mat = new_lecture_material()
-            mat["lecture_id"] = lec_id
-            materials.append(mat)
+    materials = synthesize(new_lecture_material, len(lectures) * materials_per_lecture)
+    for i, mat in enumerate(materials):
+        mat["lecture_id"] = lectures[i // materials_per_lecture][0]
     values = [(m["name"], m["description"], m["lecture_id"]) for m in materials]
     sql = "INSERT INTO lecture_materials (name, description, lecture_id) VALUES (%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id FROM lecture_materials;")
-    return cur.fetchall()
 
 def insert_groups(cur, departments, groups_per_dept):
-    groups = []
-    for dept in departments:
-        dept_id = dept[0]
-        for _ in range(groups_per_dept):
-            gr = new_group()
-            gr["department_id"] = dept_id
-            groups.append(gr)
+    groups = synthesize(new_group, len(departments) * groups_per_dept)
+    for i, gr in enumerate(groups):
+        gr["department_id"] = departments[i // groups_per_dept][0]
     values = [(g["name"], g["course"], g["department_id"]) for g in groups]
     sql = "INSERT INTO groups (name, course, department_id) VALUES (%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, department_id FROM groups;")
-    return cur.fetchall()
 
 def insert_students(cur, groups, students_per_group):
-    students = []
-    for grp in groups:
-        group_id = grp[0]
-        for _ in range(students_per_group):
-            st = new_student()
-            st["group_id"] = group_id
-            students.append(st)
+    students = synthesize(new_student, len(groups) * students_per_group)
+    for i, st in enumerate(students):
+        st["group_id"] = groups[i // students_per_group][0]
     values = [(s["full_name"], s["student_record"], s["group_id"]) for s in students]
     sql = "INSERT INTO students (full_name, student_record, group_id) VALUES (%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, group_id FROM students;")
-    return cur.fetchall()
 
 def insert_schedule(cur, groups, lectures, schedules_per_group):
-    schedules = []
-    for group in groups:
-        for i in range(schedules_per_group):
-            lec = random.choice(lectures)
-            sch = new_schedule()
-            sch["group_id"] = group[0]
-            sch["lecture_id"] = lec[0]
-            schedules.append(sch)
-    '''
-    for grp in groups:
-        group_id = grp[0]
-        lec = random.choice(lectures)
-        sch = new_schedule()
-        sch["group_id"] = group_id
-        sch["lecture_id"] = lec[0]
-        schedules.append(sch)
-    '''
+    schedules = synthesize(new_schedule, len(groups) * schedules_per_group)
+    for i, sch in enumerate(schedules):
+        sch["group_id"] = groups[i // schedules_per_group][0]
+        sch["lecture_id"] = random.choice(lectures)[0]
     values = [(s["auditorium"], s["group_id"], s["lecture_id"], s["capacity"]) for s in schedules]
     sql = "INSERT INTO schedule (auditorium, group_id, lecture_id, capacity) VALUES (%s,%s,%s,%s);"
     cur.executemany(sql, values)
-    cur.execute("SELECT id, group_id FROM schedule;")
-    return cur.fetchall()
 
-def insert_attendance(cur, students, schedules):
-    attendance = []
+def _attendance_task(task):
+    seed, schedules, records_range = task
+    random.seed(seed)
     possible_status = ['presence', 'absence', 'late']
-    
+    values = []
+    for schedule_id, student_ids in schedules:
+        random_date = generate_random_date(start_date_semester, end_date_semester)
+        week_start_date = convert_to_monday(str(random_date))
+        for st_id in student_ids:
+            # Случайное количество записей посещаемости для данного студента по этому расписанию
+            num_records = random.randint(*records_range)
+            for _ in range(num_records):
+                values.append((st_id, schedule_id, random_date, week_start_date, random.choice(possible_status)))
+    return values
+
+def insert_attendance(cur, students, schedules, records_range, done_tasks=0):
+    """Вставляет посещаемость пачками, фиксируя каждую вместе с отметкой этапа.
+
+    done_tasks — число уже зафиксированных задач из прошлого запуска: задачи
+    детерминированы, поэтому продолжение даёт те же строки, что и полный прогон.
+    """
     # group_id -> список student_id
     group_students = {}
     for st in students:
         st_id, group_id = st
         group_students.setdefault(group_id, []).append(st_id)
-    
-    for sch in schedules:
-        schedule_id, group_id = sch
-        
-        random_date = generate_random_date(start_date_semester, end_date_semester)
-        week_start_date = convert_to_monday(str(random_date))
-        for st_id in group_students.get(group_id, []):
-            # Случайное количество записей посещаемости для данного студента по этому расписанию
-            num_records = random.randint(4,50)
-            for _ in range(num_records):
-                
-                att = {
-                    "student_id": st_id,
-                    "schedule_id": schedule_id,
-                    "attendance_date": random_date,
-                    "week_start": week_start_date,
-                    "status": random.choice(possible_status)
-                }
-                attendance.append(att)
-    
-    values = [(a["student_id"], a["schedule_id"], a["attendance_date"], a["week_start"], a["status"]) for a in attendance]
-    sql = "INSERT INTO attendance (student_id, schedule_id, attendance_date, week_start, status) VALUES (%s, %s, %s, %s, %s);"
-    cur.executemany(sql, values)
 
+    # Расписания делятся на задачи по SYNTH_TASK_SIZE // 100 занятий: каждое даёт
+    # сотни записей, а готовые пачки вставляются по мере поступления
+    per_task = max(1, SYNTH_TASK_SIZE // 100)
+    tasks = [
+        (
+            task_seed("attendance", i),
+            [(schedule_id, group_students.get(group_id, [])) for schedule_id, group_id in schedules[start:start + per_task]],
+            records_range
+        )
+        for i, start in enumerate(range(0, len(schedules), per_task))
+    ]
+    mapper = synth_pool.imap if synth_pool else map
+    sql = "INSERT INTO attendance (student_id, schedule_id, attendance_date, week_start, status) VALUES %s;"
+    for i, values in enumerate(mapper(_attendance_task, tasks[done_tasks:]), start=done_tasks + 1):
+        execute_values(cur, sql, values, page_size=1000)
+        save_checkpoint("attendance", "running", i, cur)
+        cur.connection.commit()
+
+
+def pg_connect():
+    # Изменения генератора не пишутся в sync_outbox: вторичные хранилища
+    # получают их полной загрузкой add_all, а не через sync_worker.py
+    return psycopg2.connect(host="postgres", port="5432", database="university_db", user="user", password="password",
+                            options="-c sync.capture=off")
+
+
+pg_conn = pg_connect()
 
-pg_conn = psycopg2.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+# Отметки этапов из generator_checkpoints: stage -> (status, high_water).
+# Отметки этапов синхронизации пишутся из нескольких потоков через отдельное
+# autocommit-подключение (commit на подключении этапа закрыл бы его серверный курсор)
+checkpoints = {}
+checkpoint_conn = None
+checkpoint_lock = threading.Lock()
+
+
+def load_checkpoints():
+    global checkpoint_conn
+    checkpoint_conn = pg_connect()
+    checkpoint_conn.autocommit = True
+    with checkpoint_conn.cursor() as cur:
+        cur.execute("SELECT stage, status, high_water FROM generator_checkpoints;")
+        checkpoints.update({stage: (status, hw) for stage, status, hw in cur.fetchall()})
+
+
+def stage_done(stage):
+    return checkpoints.get(stage, (None, None))[0] == "done"
+
+
+def high_water(stage):
+    return checkpoints.get(stage, (None, None))[1]
+
+
+def save_checkpoint(stage, status, high_water=None, cur=None):
+    """Сохраняет отметку этапа.
+
+    С cur отметка пишется в транзакции данных этапа и фиксируется вместе с
+    ними; без cur — сразу, через checkpoint_conn.
+    """
+    checkpoints[stage] = (status, high_water)
+    query = """
+        INSERT INTO generator_checkpoints (stage, status, high_water)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (stage) DO UPDATE
+        SET status = EXCLUDED.status, high_water = EXCLUDED.high_water, updated_at = now();
+    """
+    if cur is not None:
+        cur.execute(query, (stage, status, high_water))
+        return
+    with checkpoint_lock, checkpoint_conn.cursor() as c:
+        c.execute(query, (stage, status, high_water))
 
 # Redis
 redis_client = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
 
+# Версии данных для ETag отчётов (dataversion.py lab-сервисов): хэш scope -> номер
+# изменения и канал, в который публикуются сдвинутые версии. Номер берётся из
+# общего счётчика, но не меньше текущего времени в мс, поэтому не повторяется
+# после очистки Redis или восстановления снимка
+DATA_VERSIONS_KEY = "data:versions"
+DATA_VERSIONS_SEQ_KEY = "data:versions:seq"
+DATA_VERSIONS_CHANNEL = "data:versions"
+DATA_VERSION_SCRIPT = """
+local now = redis.call('TIME')
+local floor = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local seq = redis.call('INCR', KEYS[2])
+if seq < floor then
+    seq = floor
+    redis.call('SET', KEYS[2], seq)
+end
+local changed = {}
+for _, scope in ipairs(ARGV) do
+    redis.call('HSET', KEYS[1], scope, seq)
+    changed[scope] = seq
+end
+redis.call('PUBLISH', KEYS[3], cjson.encode(changed))
+return seq
+"""
+
+
+def bump_data_version(scopes):
+    """Сдвигает версии scopes ("epoch", "catalog", "group:<имя>", ...) и оповещает сервисы."""
+    scopes = sorted(scopes)
+    if scopes:
+        redis_client.eval(DATA_VERSION_SCRIPT, 3, DATA_VERSIONS_KEY, DATA_VERSIONS_SEQ_KEY,
+                          DATA_VERSIONS_CHANNEL, *scopes)
+
+
+# Хранилища sync_worker.py (ключи его STORE_TABLES)
+SYNC_STORES = ("redis", "elasticsearch", "mongo", "neo4j", "reports", "versions")
+
+
+def seed_sync_watermarks(conn):
+    """Ставит отметки всех хранилищ sync_worker на последнюю завершённую запись журнала.
+
+    После полной загрузки или восстановления снимка хранилища уже совпадают с
+    PostgreSQL, и более ранние записи журнала применять не нужно.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sync_watermarks (store, tx, outbox_id, updated_at)
+            SELECT store, COALESCE(last.tx, '0'::xid8), COALESCE(last.id, 0), now()
+            FROM unnest(%s::text[]) AS store
+            LEFT JOIN (SELECT tx, id FROM sync_outbox
+                       WHERE tx < pg_snapshot_xmin(pg_current_snapshot())
+                       ORDER BY tx DESC, id DESC
+                       LIMIT 1) AS last ON true
+            ON CONFLICT (store) DO UPDATE
+            SET tx = EXCLUDED.tx, outbox_id = EXCLUDED.outbox_id, updated_at = EXCLUDED.updated_at;
+        """, (list(SYNC_STORES),))
+    conn.commit()
+
+
+def semester_scope(day):
+    """Версия отчёта lab2 по семестру дня: осенний — сентябрь–декабрь, весенний — февраль–июнь."""
+    if day.month >= 9:
+        return f"semester:{day.year}:1"
+    if 2 <= day.month <= 6:
+        return f"semester:{day.year}:2"
+    return None
+
 # Elasticsearch
 es = Elasticsearch(hosts=["http://elasticsearch:9200"])
 ES_INDEX = "lecture_materials" 
+# Явная схема индекса: описание лекций анализируется русским анализатором,
+# scheduled_dates — дни, в которые проводится лекция материала
+ES_MAPPING = {
+    "properties": {
+        "id": {"type": "integer"},
+        "name": {"type": "text", "analyzer": "russian"},
+        "description": {"type": "text", "analyzer": "russian"},
+        "lecture_id": {"type": "integer"},
+        "scheduled_dates": {"type": "date", "format": "yyyy-MM-dd"}
+    }
+}
+# Размер пачки документов в одном bulk-запросе
+ES_BULK_CHUNK_SIZE = int(os.getenv("ES_BULK_CHUNK_SIZE", 500))
 
 # MongoDB
 mongo_client = MongoClient("mongodb://mongo:27017/")
@@ -300,6 +456,55 @@ mongo_db = mongo_client["university"]
 # Neo4j
 neo4j_driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "password"))
 
+# Индексы Neo4j: (метка, свойства)
+NEO4J_INDEXES = [
+    ("Student", ("id",)),
+    ("Group", ("id",)),
+    ("Lecture", ("id",)),
+    ("Department", ("id",)),
+    ("Schedule", ("schedule_id", "date")),
+    ("Schedule", ("date",)),
+]
+
+# Узел Schedule — проведение занятия schedule_id в день date (тип date Neo4j):
+# (Group)-[:HAS_OCCURRENCE]->(Schedule)-[:OF_LECTURE]->(Lecture). lecture_id
+# хранится и в самом узле, чтобы поиск лекций по датам читал только индекс по date
+NEO4J_OCCURRENCES_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (gr:Group {id: row.group_id})
+    MATCH (lec:Lecture {id: row.lecture_id})
+    MERGE (o:Schedule {schedule_id: row.schedule_id, date: row.date})
+    SET o.group_id = row.group_id,
+        o.lecture_id = row.lecture_id
+    MERGE (gr)-[:HAS_OCCURRENCE]->(o)
+    MERGE (o)-[:OF_LECTURE]->(lec)
+"""
+
+# Число потоков, которыми каждое хранилище загружается при синхронизации
+SYNC_WORKERS = {
+    "redis": int(os.getenv("SYNC_WORKERS_REDIS", 4)),
+    "elasticsearch": int(os.getenv("SYNC_WORKERS_ES", 2)),
+    "mongo": int(os.getenv("SYNC_WORKERS_MONGO", 1)),
+    "neo4j": int(os.getenv("SYNC_WORKERS_NEO4J", 4)),
+}
+# Число строк, которые серверный курсор отдаёт за один FETCH; это же размер
+# пачки, которую обрабатывает один поток синхронизации
+PG_ITERSIZE = int(os.getenv("PG_ITERSIZE", 5000))
+cursor_ids = count()
+
+# Сводка посещаемости (студент, лекция) для отчёта lab1, см. create.sql
+REPORT_VIEW = "student_lecture_attendance"
+
+# Число документов университетов в одном insert_many
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", 100))
+
+# Число ключей в одной команде MSET при загрузке студентов в Redis
+REDIS_BATCH_SIZE = int(os.getenv("REDIS_BATCH_SIZE", 500))
+# Формат значений student:{id}: "json" (версия 1) или компактный "msgpack" (версия 2)
+REDIS_STUDENT_ENCODING = os.getenv("REDIS_STUDENT_ENCODING", "json")
+STUDENT_SCHEMA_VERSION = 2
+STUDENT_FIELDS = ("id", "full_name", "student_record", "group_id")
+
 
 def read_sql(filepath):
     if not os.path.exists(filepath):
@@ -319,321 +524,587 @@ def read_sql_by_delimeter(filepath, delim):
 
     return queries
 
-def create_tables():
+def build_schema():
+    """Таблицы, функции, триггеры и партиции attendance; ошибки не перехватываются."""
+    queries = read_sql("create.sql")
+    pg_conn.autocommit = True
     try:
-        queries = read_sql("create.sql")
-        pg_conn.autocommit = True
         cur = pg_conn.cursor()
         for q in queries:
             print(q)
             cur.execute(q)
-        #funcs_trigs = read_sql_by_delimeter("functions.sql", "@")
-        date_start = '2025-01-06'
-        date_current_format = datetime.strptime(date_start, '%Y-%m-%d')
-        date_end = '2025-12-28'
-        date_end_format = datetime.strptime(date_end, '%Y-%m-%d')
-        i = 1
-        while date_current_format < (date_end_format - timedelta(days=7)):
-            
-            print(f"Заполнение партиции {i}:")
-            print(f"Начало: {str(date_current_format.strftime('%Y-%m-%d'))} -> Конец: {str((date_current_format+timedelta(days=7)).strftime('%Y-%m-%d'))}")
-            cur.execute(f"CREATE TABLE attendance_2025_{i} PARTITION OF attendance FOR VALUES FROM ('{str(date_current_format.strftime('%Y-%m-%d'))}') TO ('{str((date_current_format+timedelta(days=6)).strftime('%Y-%m-%d'))}');")
-            date_current_format += timedelta(days=7)
-            i+=1
+        # Функции и триггеры содержат ";" в теле, поэтому разделены "@"
+        funcs_trigs = read_sql_by_delimeter("functions.sql", "@")
+        for q in funcs_trigs:
+            cur.execute(q)
         cur.close()
-        
-        print("Созданы таблицы")
-    except Exception as e:
-        print(e)
+    finally:
+        pg_conn.autocommit = False
+    # Недельные партиции attendance с запасом вперёд от конца генерируемого периода
+    horizon = max(end_date_semester.date(), date.today()) + timedelta(weeks=PARTITION_AHEAD_WEEKS)
+    created = partitions.ensure_partitions(pg_conn, start_date_semester.date(), horizon)
+    print(f"Создано партиций attendance: {len(created)}")
+
+    print("Созданы таблицы")
+
+
+def refresh_report_view(conn):
+    """Пересчитывает сводку посещаемости REPORT_VIEW.
+
+    Заполненное представление обновляется CONCURRENTLY, не блокируя чтение
+    отчётов; первое заполнение выполняется обычным REFRESH.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT relispopulated FROM pg_class WHERE relname = %s;", (REPORT_VIEW,))
+        populated = cur.fetchone()[0]
+        cur.execute(sql.SQL("REFRESH MATERIALIZED VIEW {}{};").format(
+            sql.SQL("CONCURRENTLY ") if populated else sql.SQL(""), sql.Identifier(REPORT_VIEW)))
+
+
+def stream_rows(conn, query, params=None, itersize=None):
+    """Читает результат query именованным (серверным) курсором.
+
+    Отдаёт списки namedtuple длиной до itersize строк; в памяти клиента
+    одновременно держится только одна такая пачка, сколько бы строк ни
+    было в таблице.
+    """
+    itersize = itersize or PG_ITERSIZE
+    with conn.cursor(name=f"export_{next(cursor_ids)}", cursor_factory=NamedTupleCursor) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            yield rows
+
+
+def encode_student(student):
+    """Кодирует студента (namedtuple из stream_rows) для Redis.
+
+    msgpack-формат хранит массив [версия, *значения STUDENT_FIELDS] без имён
+    полей; читатели различают форматы по первому байту (JSON начинается с "{").
+    """
+    if REDIS_STUDENT_ENCODING == "msgpack":
+        return msgpack.packb([STUDENT_SCHEMA_VERSION] + [getattr(student, f) for f in STUDENT_FIELDS])
+    return json.dumps(student._asdict(), ensure_ascii=False)
 
-create_tables()
-
-try:
-    print("Генерация запущена")
-    with pg_conn:
-        with pg_conn.cursor() as cur:
-            universities = insert_universities(cur, 1)
-            #print("Добавленные университеты:", universities)
-            
-            institutes = insert_institutes(cur, universities, 3)
-            #print("Добавленные институты:", institutes)
-            
-            departments = insert_departments(cur, institutes, 3)
-            #print("Добавленные кафедры:", departments)
-            
-            specialties = insert_specialties(cur, 3)
-            #print("Добавленные специальности:", specialties)
-            #
-            courses = insert_lecture_courses(cur, departments, specialties, 3)
-            #print("Добавленные курсы:", courses)
-            
-            lectures = insert_lectures(cur, courses, 5)
-            #print("Добавленные лекции:", lectures)
-            
-            lecture_materials = insert_lecture_materials(cur, lectures, 1)
-            #print("Добавленные материалы лекций:", lecture_materials)
-
-            groups = insert_groups(cur, departments, 3)
-            #print("Добавленные группы:", groups)
-                
-            students = insert_students(cur, groups, 10)
-            #print("Добавленные студенты:", students)
-                
-            schedules = insert_schedule(cur, groups, lectures, 10)
-            #print("Добавленное расписание")
-       
-            insert_attendance(cur, students, schedules)
-            print("Добавлены записи о посещаемости успешно!")
-
-except Exception as e:
-    print(e)
-
-finally:
-    pg_conn.commit()
 
+# Добавление студентов в Redis
+def add_students_to_redis(conn, workers, progress):
+    query = "SELECT id, full_name, student_record, group_id FROM students WHERE id > %s ORDER BY id;"
+
+    def load(chunk):
+        # Один MSET на пачку вместо отдельного SET (и round trip) на каждого студента
+        for batch in chunked(chunk, REDIS_BATCH_SIZE):
+            redis_client.mset({f"student:{student.id}": encode_student(student) for student in batch})
+        return len(chunk)
+
+    run_chunks(load, stream_rows(conn, query, (high_water("redis") or 0,)), workers, progress,
+               on_done=lambda chunk: save_checkpoint("redis", "running", chunk[-1].id))
+    tqdm.write(f"Добавление {progress.n} студентов в Redis.")
+
+
+def prepare_es_index():
+    """Создаёт индекс с явной схемой и отключает refresh и реплики на время загрузки.
+
+    Возвращает исходные значения настроек для restore_es_index; отсутствующее
+    значение (None) возвращает настройку к значению по умолчанию.
+    """
+    if not es.indices.exists(index=ES_INDEX):
+        es.indices.create(index=ES_INDEX, mappings=ES_MAPPING)
+    current = es.indices.get_settings(index=ES_INDEX)[ES_INDEX]["settings"]["index"]
+    original = {
+        "refresh_interval": current.get("refresh_interval"),
+        "number_of_replicas": current.get("number_of_replicas")
+    }
+    es.indices.put_settings(index=ES_INDEX, settings={"refresh_interval": "-1", "number_of_replicas": 0})
+    return original
 
-def fetch_all(query):
-    with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query)
-        results = cur.fetchall()
-    return results
 
+def restore_es_index(original):
+    es.indices.put_settings(index=ES_INDEX, settings=original)
+    es.indices.refresh(index=ES_INDEX)
+    es.indices.forcemerge(index=ES_INDEX, max_num_segments=1)
 
-# Добавление студентов в Redis
-def add_students_to_redis():
-    query = "SELECT id, full_name, student_record, group_id FROM students;"
-    students = fetch_all(query)
-    for student in students:
-        key = f"student:{student['id']}"
-        value = json.dumps(student, ensure_ascii=False)
-        redis_client.set(key, value)
-    print(f"Добавление {len(students)} студентов в Redis.")
 
 #Добавление lecture_materials в Elasticsearch
-def add_lecture_materials_to_es():
-    query = "SELECT id, name, description, lecture_id FROM lecture_materials;"
-    materials = fetch_all(query)
-    
-    actions = [
+def add_lecture_materials_to_es(conn, workers, progress):
+    # Даты лекций агрегируются один раз для всех лекций, а не на каждый материал
+    query = """
+        WITH lecture_dates AS (
+            SELECT s.lecture_id, array_agg(DISTINCT a.attendance_date::date) AS dates
+            FROM schedule s
+            JOIN attendance a ON a.schedule_id = s.id
+            GROUP BY s.lecture_id
+        )
+        SELECT m.id, m.name, m.description, m.lecture_id,
+               COALESCE(ld.dates, '{}') AS scheduled_dates
+        FROM lecture_materials m
+        LEFT JOIN lecture_dates ld ON ld.lecture_id = m.lecture_id
+        WHERE m.id > %s
+        ORDER BY m.id;
+    """
+
+    actions = (
         {
             "_index": ES_INDEX,
-            "_id": material["id"],
-            "_source": material
+            "_id": material.id,
+            "_source": material._asdict()
         }
-        for material in materials
-    ]
-    
-    if actions:
-        helpers.bulk(es, actions)
-    print(f"Добавлено {len(materials)} материалов лекций в Elasticsearch (индекс '{ES_INDEX}').")
+        for chunk in stream_rows(conn, query, (high_water("elasticsearch") or 0,))
+        for material in chunk
+    )
 
+    original_settings = prepare_es_index()
+    try:
+        # parallel_bulk читает actions лениво и отправляет пачки в workers потоков;
+        # результаты приходят в порядке документов, поэтому отметка по последнему
+        # id после каждой пачки означает, что все предыдущие документы записаны
+        for ok, item in helpers.parallel_bulk(es, actions, thread_count=workers,
+                                              chunk_size=ES_BULK_CHUNK_SIZE):
+            progress.update(1)
+            if progress.n % ES_BULK_CHUNK_SIZE == 0:
+                save_checkpoint("elasticsearch", "running", int(item["index"]["_id"]))
+    finally:
+        restore_es_index(original_settings)
+    tqdm.write(f"Добавлено {progress.n} материалов лекций в Elasticsearch (индекс '{ES_INDEX}').")
+
+
+def university_documents(conn, after_id=0, ids=None):
+    """Собирает документы университетов с вложенными институтами и кафедрами.
+
+    Строки иерархии читаются одним потоковым запросом, упорядоченным по
+    университету, поэтому в памяти держится только текущий документ.
+    ids ограничивает выборку перечисленными университетами.
+    """
+    query = """
+        SELECT u.id AS uni_id, u.name AS uni_name, u.address,
+               i.id AS inst_id, i.name AS inst_name,
+               d.id AS dept_id, d.name AS dept_name
+        FROM universities u
+        LEFT JOIN institutes i ON i.university_id = u.id
+        LEFT JOIN departments d ON d.institute_id = i.id
+        WHERE u.id > %s AND (%s::int[] IS NULL OR u.id = ANY(%s::int[]))
+        ORDER BY u.id, i.id, d.id;
+    """
+    uni = None
+    inst = None
+    for chunk in stream_rows(conn, query, (after_id, ids, ids)):
+        for row in chunk:
+            if uni is None or uni["id"] != row.uni_id:
+                if uni is not None:
+                    yield uni
+                uni = {
+                    "id": row.uni_id,
+                    "name": row.uni_name,
+                    "address": row.address,
+                    "institutes": []
+                }
+                inst = None
+            if row.inst_id is None:
+                continue
+            if inst is None or inst["id"] != row.inst_id:
+                inst = {
+                    "id": row.inst_id,
+                    "name": row.inst_name,
+                    "departments": []
+                }
+                uni["institutes"].append(inst)
+            if row.dept_id is not None:
+                inst["departments"].append({
+                    "id": row.dept_id,
+                    "name": row.dept_name
+                })
+    if uni is not None:
+        yield uni
 
-# Добавление данных об университетах, институтах и кафедрах в MongoDB
-def add_universities_to_mongo():
-    universities = fetch_all("SELECT id, name, address FROM universities;")
-    institutes = fetch_all("SELECT id, name, university_id FROM institutes;")
-    departments = fetch_all("SELECT id, name, institute_id FROM departments;")
-    
 
-    uni_dict = {}
-    for uni in universities:
-        uni_dict[uni["id"]] = {
-            "id": uni["id"],
-            "name": uni["name"],
-            "address": uni["address"],
-            "institutes": []
-        }
-    
-    inst_dict = {}
-    for inst in institutes:
-        inst_dict[inst["id"]] = {
-            "id": inst["id"],
-            "name": inst["name"],
-            "departments": []
-        }
-        uni = uni_dict.get(inst["university_id"])
-        if uni:
-            uni["institutes"].append(inst_dict[inst["id"]])
-    
-    for dept in departments:
-
-        inst = inst_dict.get(dept["institute_id"])
-        if inst:
-            inst["departments"].append({
-                "id": dept["id"],
-                "name": dept["name"]
-            })
-    
+# Добавление данных об университетах, институтах и кафедрах в MongoDB
+def add_universities_to_mongo(conn, workers, progress):
     collection = mongo_db["university"]
-    collection.delete_many({})
-    
-    documents = list(uni_dict.values())
-    if documents:
-        collection.insert_many(documents)
-    print(f"Добавлено {len(documents)} университетов с вложенными институтами и кафедрами в MongoDB.")
+    # Коллекция очищается только при загрузке с нуля, а не при продолжении
+    resume_id = high_water("mongo")
+    if resume_id is None:
+        collection.delete_many({})
+    # Пачки, записанные после последней отметки, при продолжении пишутся снова:
+    # замена по id не создаёт копий, а уникальный индекс не пропустит их иначе
+    collection.create_index("id", unique=True)
 
+    def load(chunk):
+        return upsert_by_id(collection, chunk)
 
+    run_chunks(load, chunked(university_documents(conn, resume_id or 0), MONGO_BATCH_SIZE), workers, progress,
+               on_done=lambda chunk: save_checkpoint("mongo", "running", chunk[-1]["id"]))
+    tqdm.write(f"Добавлено {progress.n} университетов с вложенными институтами и кафедрами в MongoDB.")
 
-def add_relationships_to_neo4j():
-    # Получаем все необходимые данные из PostgreSQL
-    students = fetch_all("""
-        SELECT id, full_name, group_id 
-        FROM students;
-    """)
-    
-    groups = fetch_all("""
-        SELECT id, name, course, department_id 
-        FROM groups;
-    """)
-    
-    schedules = fetch_all("""
-        SELECT s.id, s.group_id, s.lecture_id, s.capacity
-        FROM schedule s;
-    """)
-    
-    lectures = fetch_all("""
+
+
+def create_neo4j_indexes():
+    # Индексы для MERGE/MATCH по ключам и для поиска занятий по диапазону дат
+    with neo4j_driver.session() as session:
+        for label, props in NEO4J_INDEXES:
+            name = f"{label.lower()}_{'_'.join(props)}"
+            fields = ", ".join(f"n.{p}" for p in props)
+            session.run(f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON ({fields})").consume()
+        session.run("CALL db.awaitIndexes()").consume()
+
+
+def add_relationships_to_neo4j(conn, workers, progress):
+    def run_tx(tx, cypher, rows):
+        tx.run(cypher, rows=rows)
+
+    def load_phase(phase, query, key, cypher):
+        # Каждая пачка из PostgreSQL уходит одной транзакцией через UNWIND $rows;
+        # каждый поток работает в собственной сессии: сессии Neo4j не потокобезопасны.
+        # Фаза отмечается как этап neo4j:<phase> с отметкой по ключу key, и query
+        # должен выбирать строки с key > %s в порядке key
+        stage = f"neo4j:{phase}"
+        if stage_done(stage):
+            return
+
+        def load(chunk):
+            with neo4j_driver.session() as session:
+                session.execute_write(run_tx, cypher, [row._asdict() for row in chunk])
+            return len(chunk)
+        run_chunks(load, stream_rows(conn, query, (high_water(stage) or 0,)), workers, progress,
+                   on_done=lambda chunk: save_checkpoint(stage, "running", getattr(chunk[-1], key)))
+        save_checkpoint(stage, "done", high_water(stage))
+
+    create_neo4j_indexes()
+
+    # Узлы создаются раньше связей, поэтому фазы идут друг за другом,
+    # а параллельно обрабатываются пачки внутри одной фазы
+
+    # Создаем узлы Student
+    load_phase(
+        "students",
+        "SELECT id, full_name, group_id FROM students WHERE id > %s ORDER BY id;",
+        "id",
+        """
+        UNWIND $rows AS row
+        MERGE (st:Student {
+            id: row.id, 
+            full_name: row.full_name, 
+            group_id: row.group_id
+        })
+        """
+    )
+
+    # Создаем узлы Group
+    load_phase(
+        "groups",
+        "SELECT id, name, course, department_id FROM groups WHERE id > %s ORDER BY id;",
+        "id",
+        """
+        UNWIND $rows AS row
+        MERGE (gr:Group {
+            id: row.id,
+            name: row.name,
+            course: row.course,
+            department_id: row.department_id
+        })
+        """
+    )
+
+    # Создаем узлы Lecture
+    load_phase(
+        "lectures",
+        """
         SELECT l.id, l.course_id, l.topic, l.tech_requirements, l.is_special,
                lc.department_id, lc.name as course_name
         FROM lectures l 
-        JOIN lecture_course lc ON l.course_id = lc.id;
-    """)
-    
-    departments = fetch_all("""
-        SELECT id, name 
-        FROM departments;
-    """)
+        JOIN lecture_course lc ON l.course_id = lc.id
+        WHERE l.id > %s
+        ORDER BY l.id;
+        """,
+        "id",
+        """
+        UNWIND $rows AS row
+        MERGE (lec:Lecture {
+            id: row.id,
+            course_id: row.course_id,
+            topic: row.topic,
+            tech_requirements: row.tech_requirements,
+            is_special: row.is_special,
+            department_id: row.department_id,
+            course_name: row.course_name
+        })
+        """
+    )
+
+    # Создаем узлы Department
+    load_phase(
+        "departments",
+        "SELECT id, name FROM departments WHERE id > %s ORDER BY id;",
+        "id",
+        """
+        UNWIND $rows AS row
+        MERGE (dep:Department {
+            id: row.id,
+            name: row.name
+        })
+        """
+    )
+
+    # Создаем связи (Student)-[:BELONGS_TO]->(Group)
+    load_phase(
+        "belongs_to",
+        "SELECT id AS student_id, group_id FROM students WHERE id > %s ORDER BY id;",
+        "student_id",
+        """
+        UNWIND $rows AS row
+        MATCH (st:Student {id: row.student_id})
+        MATCH (gr:Group {id: row.group_id})
+        MERGE (st)-[:BELONGS_TO]->(gr)
+        """
+    )
+
+    # Создаем связи (Group)-[:HAS_SCHEDULE]->(Lecture) по строкам расписания
+    load_phase(
+        "has_schedule",
+        "SELECT id AS schedule_id, group_id, lecture_id, capacity FROM schedule WHERE id > %s ORDER BY id;",
+        "schedule_id",
+        """
+        UNWIND $rows AS row
+        MATCH (gr:Group {id: row.group_id})
+        MATCH (lec:Lecture {id: row.lecture_id})
+        MERGE (gr)-[h:HAS_SCHEDULE]->(lec)
+        SET h.schedule_id = row.schedule_id,
+            h.capacity = row.capacity
+        """
+    )
+
+    # Создаем узлы Schedule — по одному на каждый день проведения занятия.
+    # Даты одного занятия могут попасть в разные пачки, поэтому после
+    # перезапуска последнее занятие загружается заново (>=), MERGE это допускает
+    load_phase(
+        "occurrences",
+        """
+        SELECT s.id AS schedule_id, s.group_id, s.lecture_id, d.date
+        FROM schedule s
+        CROSS JOIN LATERAL (
+            SELECT DISTINCT a.attendance_date::date AS date
+            FROM attendance a
+            WHERE a.schedule_id = s.id
+        ) d
+        WHERE s.id >= %s
+        ORDER BY s.id, d.date;
+        """,
+        "schedule_id",
+        NEO4J_OCCURRENCES_CYPHER
+    )
+
+    # Создаем связи (Lecture)-[:ORIGINATES_FROM]->(Department)
+    load_phase(
+        "originates_from",
+        """
+        SELECT l.id AS lecture_id, lc.department_id
+        FROM lectures l
+        JOIN lecture_course lc ON l.course_id = lc.id
+        WHERE l.id > %s
+        ORDER BY l.id;
+        """,
+        "lecture_id",
+        """
+        UNWIND $rows AS row
+        MATCH (lec:Lecture {id: row.lecture_id})
+        MATCH (dep:Department {id: row.department_id})
+        MERGE (lec)-[:ORIGINATES_FROM]->(dep)
+        """
+    )
     
-    # Получаем данные о посещаемости
-    attendance = fetch_all("""
-        SELECT a.schedule_id, a.student_id, a.attendance_date, a.status
-        FROM attendance a;
-    """)
-
-    def run_tx(tx, cypher, params=None):
-        tx.run(cypher, params or {})
-    
-    with neo4j_driver.session() as session:
-        # Создаем узлы Student
-        for s in students:
-            session.execute_write(run_tx,
-                """
-                MERGE (st:Student {
-                    id: $id, 
-                    full_name: $full_name, 
-                    group_id: $group_id
-                })
-                """,
-                {"id": s["id"], "full_name": s["full_name"], "group_id": s["group_id"]}
-            )
-
-        # Создаем узлы Group
-        for g in groups:
-            session.execute_write(run_tx,
-                """
-                MERGE (gr:Group {
-                    id: $id,
-                    name: $name,
-                    course: $course,
-                    department_id: $department_id
-                })
-                """,
-                {"id": g["id"], "name": g["name"], "course": g["course"], 
-                 "department_id": g["department_id"]}
-            )
-
-        # Создаем узлы Lecture
-        for l in lectures:
-            session.execute_write(run_tx,
-                """
-                MERGE (lec:Lecture {
-                    id: $id,
-                    course_id: $course_id,
-                    topic: $topic,
-                    tech_requirements: $tech_requirements,
-                    is_special: $is_special,
-                    department_id: $department_id,
-                    course_name: $course_name
-                })
-                """,
-                {"id": l["id"], "course_id": l["course_id"], "topic": l["topic"],
-                 "tech_requirements": l["tech_requirements"], "is_special": l["is_special"],
-                 "department_id": l["department_id"], "course_name": l["course_name"]}
-            )
-
-        # Создаем узлы Department
-        for d in departments:
-            session.execute_write(run_tx,
-                """
-                MERGE (dep:Department {
-                    id: $id,
-                    name: $name
-                })
-                """,
-                {"id": d["id"], "name": d["name"]}
-            )
-
-        # Создаем связи (Student)-[:BELONGS_TO]->(Group)
-        for s in students:
-            session.execute_write(run_tx,
-                """
-                MATCH (st:Student {id: $student_id})
-                MATCH (gr:Group {id: $group_id})
-                MERGE (st)-[:BELONGS_TO]->(gr)
-                """,
-                {"student_id": s["id"], "group_id": s["group_id"]}
-            )
-        
-        # Создаем связи (Group)-[:HAS_SCHEDULE]->(Lecture) с данными из attendance
-        for sch in schedules:
-            # Находим все записи посещаемости для данного расписания
-            schedule_attendance = [a for a in attendance if a["schedule_id"] == sch["id"]]
-            
-            for att in schedule_attendance:
-                session.execute_write(run_tx,
-                    """
-                    MATCH (gr:Group {id: $group_id})
-                    MATCH (lec:Lecture {id: $lecture_id})
-                    MERGE (gr)-[h:HAS_SCHEDULE]->(lec)
-                    SET h.schedule_id = $schedule_id,
-                        h.attendance_date = $attendance_date,
-                        h.status = $status,
-                        h.capacity = $capacity
-                    """,
-                    {
-                        "group_id": sch["group_id"],
-                        "lecture_id": sch["lecture_id"],
-                        "schedule_id": sch["id"],
-                        "attendance_date": att["attendance_date"],
-                        "status": att["status"],
-                        "capacity": sch["capacity"]
-                    }
-                )
-        
-        # Создаем связи (Lecture)-[:ORIGINATES_FROM]->(Department)
-        for l in lectures:
-            session.execute_write(run_tx,
-                """
-                MATCH (lec:Lecture {id: $lecture_id})
-                MATCH (dep:Department {id: $department_id})
-                MERGE (lec)-[:ORIGINATES_FROM]->(dep)
-                """,
-                {"lecture_id": l["id"], "department_id": l["department_id"]}
-            )
-    
-    print("Добавление связей и узлов выполнено в Neo4j.")
-def add_all():
-    add_students_to_redis()
-    add_lecture_materials_to_es()
-    add_universities_to_mongo()
-    add_relationships_to_neo4j()
+    tqdm.write("Добавление связей и узлов выполнено в Neo4j.")
+
 
+# Этапы синхронизации вторичных хранилищ; они независимы друг от друга
+SYNC_STAGES = {
+    "redis": add_students_to_redis,
+    "elasticsearch": add_lecture_materials_to_es,
+    "mongo": add_universities_to_mongo,
+    "neo4j": add_relationships_to_neo4j,
+}
 
-add_all()
-pg_conn.close()
+
+def run_sync_stage(name, position):
+    # У каждого этапа своё подключение к PostgreSQL и свой индикатор прогресса
+    if stage_done(name):
+        tqdm.write(f"Этап {name} уже выполнен, пропускаем.")
+        return
+    conn = pg_connect()
+    try:
+        with tqdm(desc=name, position=position, unit="rec") as progress:
+            SYNC_STAGES[name](conn, SYNC_WORKERS[name], progress)
+        save_checkpoint(name, "done", high_water(name))
+    finally:
+        conn.close()
 
 
+def add_all():
+    """Параллельно загружает данные из PostgreSQL во все вторичные хранилища.
+
+    Ошибка одного этапа не прерывает остальные: уже загруженные в другие
+    хранилища данные сохраняются, а упавшие этапы перечисляются в конце.
+    """
+    failed = {}
+    with ThreadPoolExecutor(max_workers=len(SYNC_STAGES)) as pool:
+        futures = {
+            pool.submit(run_sync_stage, name, position): name
+            for position, name in enumerate(SYNC_STAGES)
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed[name] = e
+                tqdm.write(f"Ошибка синхронизации {name}: {e}")
+    if failed:
+        print(f"Синхронизация завершилась с ошибками в хранилищах: {', '.join(failed)}")
+    else:
+        print("Синхронизация всех хранилищ завершена.")
+    return failed
+
+
+def parse_args():
+    """Профиль масштаба, зерно и число процессов; каждое значение профиля
+    можно переопределить флагом --<ключ> или переменной окружения GEN_<КЛЮЧ>."""
+    parser = argparse.ArgumentParser(description="Генерация данных университета")
+    parser.add_argument("--profile", choices=sorted(SCALE_PROFILES), default=os.getenv("GEN_PROFILE", "small"))
+    parser.add_argument("--seed", type=int, default=os.getenv("GEN_SEED"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("GEN_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--from-stage", choices=ALL_STAGES, default=os.getenv("GEN_FROM_STAGE"),
+                        help="перезапустить с этого этапа, сбросив его и все последующие")
+    for key in SCALE_PROFILES["small"]:
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=int, default=os.getenv(f"GEN_{key.upper()}"))
+    args = parser.parse_args()
+    scale = dict(SCALE_PROFILES[args.profile])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = int(getattr(args, key))
+    return args, scale
+
+
+# Этапы генерации в PostgreSQL по порядку: имя этапа совпадает с таблицей,
+# запрос читает идентификаторы, нужные следующим этапам
+PG_STAGES = [
+    ("universities", "SELECT id, name FROM universities ORDER BY id;"),
+    ("institutes", "SELECT id, name, university_id FROM institutes ORDER BY id;"),
+    ("departments", "SELECT id, name, institute_id FROM departments ORDER BY id;"),
+    ("specialties", "SELECT id, code FROM specialties ORDER BY id;"),
+    ("lecture_course", "SELECT id, department_id FROM lecture_course ORDER BY id;"),
+    ("lectures", "SELECT id, course_id FROM lectures ORDER BY id;"),
+    ("lecture_materials", None),
+    ("groups", "SELECT id, department_id FROM groups ORDER BY id;"),
+    ("students", "SELECT id, group_id FROM students ORDER BY id;"),
+    ("schedule", "SELECT id, group_id FROM schedule ORDER BY id;"),
+    ("attendance", None),
+]
+ALL_STAGES = [name for name, _ in PG_STAGES] + list(SYNC_STAGES)
+
+
+def reset_stages(from_stage):
+    """Сбрасывает from_stage и все последующие этапы: очищает их таблицы и отметки."""
+    names = ALL_STAGES[ALL_STAGES.index(from_stage):]
+    with pg_conn:
+        with pg_conn.cursor() as cur:
+            for name in names:
+                if name in dict(PG_STAGES):
+                    cur.execute(sql.SQL("TRUNCATE {} RESTART IDENTITY CASCADE;").format(sql.Identifier(name)))
+                cur.execute("DELETE FROM generator_checkpoints WHERE stage = %s OR stage LIKE %s;",
+                            (name, f"{name}:%"))
+    for stage in list(checkpoints):
+        if stage.split(":")[0] in names:
+            del checkpoints[stage]
+
+
+def generate(scale):
+    """Выполняет этапы генерации, пропуская уже завершённые.
+
+    Каждый этап фиксируется вместе со своей отметкой в generator_checkpoints,
+    посещаемость — пачками. Перед этапом random засевается от base_seed и
+    имени этапа, так что пропуск предыдущих этапов не меняет его данных.
+    """
+    print("Генерация запущена")
+    ids = {}
+    loaders = {
+        "universities": lambda cur: insert_universities(cur, scale["universities"]),
+        "institutes": lambda cur: insert_institutes(cur, ids["universities"], scale["institutes_per_university"]),
+        "departments": lambda cur: insert_departments(cur, ids["institutes"], scale["departments_per_institute"]),
+        "specialties": lambda cur: insert_specialties(cur, scale["specialties"]),
+        "lecture_course": lambda cur: insert_lecture_courses(cur, ids["departments"], ids["specialties"],
+                                                             scale["courses_per_department"]),
+        "lectures": lambda cur: insert_lectures(cur, ids["lecture_course"], scale["lectures_per_course"]),
+        "lecture_materials": lambda cur: insert_lecture_materials(cur, ids["lectures"], scale["materials_per_lecture"]),
+        "groups": lambda cur: insert_groups(cur, ids["departments"], scale["groups_per_department"]),
+        "students": lambda cur: insert_students(cur, ids["groups"], scale["students_per_group"]),
+        "schedule": lambda cur: insert_schedule(cur, ids["groups"], ids["lectures"], scale["schedules_per_group"]),
+        "attendance": lambda cur: insert_attendance(cur, ids["students"], ids["schedule"],
+                                                    (scale["attendance_min"], scale["attendance_max"]),
+                                                    high_water("attendance") or 0),
+    }
+    with pg_conn.cursor() as cur:
+        for stage, ids_query in PG_STAGES:
+            if stage_done(stage):
+                print(f"Этап {stage} уже выполнен, пропускаем.")
+            else:
+                print(f"Этап {stage}")
+                random.seed(task_seed(stage, "parent"))
+                loaders[stage](cur)
+                save_checkpoint(stage, "done", high_water(stage), cur)
+                pg_conn.commit()
+            if ids_query:
+                cur.execute(ids_query)
+                ids[stage] = cur.fetchall()
+    print("Добавлены записи о посещаемости успешно!")
+    refresh_report_view(pg_conn)
+    pg_conn.commit()
 
 
+def main():
+    global base_seed, synth_pool
+    args, scale = parse_args()
 
+    # Ошибка схемы, функций или партиций должна остановить генератор, а не
+    # всплыть позже посторонней ошибкой или строками в партиции по умолчанию
+    build_schema()
+    load_checkpoints()
+    if args.from_stage:
+        reset_stages(args.from_stage)
 
+    # Без явного зерна берём сохранённое прошлым запуском (иначе продолжение дало бы
+    # другие данные) или выбираем случайное; зерно печатается, чтобы прогон можно было повторить
+    if args.seed is not None:
+        base_seed = int(args.seed)
+    elif high_water("seed") is not None:
+        base_seed = high_water("seed")
+    else:
+        base_seed = random.SystemRandom().randrange(2 ** 32)
+    save_checkpoint("seed", "done", base_seed)
+    random.seed(base_seed)
+    fake.seed_instance(base_seed)
+    print(f"Профиль: {args.profile}, зерно: {base_seed}, процессов: {args.workers}, масштаб: {scale}")
 
+    try:
+        with multiprocessing.Pool(args.workers) as synth_pool:
+            generate(scale)
+    except Exception as e:
+        pg_conn.rollback()
+        print(f"Генерация прервана: {e}. Повторный запуск продолжит с незавершённого этапа.")
+        sys.exit(1)
+    synth_pool = None
+
+    failed = add_all()
+    if not failed:
+        # Набор данных загружен заново: sync_worker продолжает с конца журнала,
+        # сервисы сбрасывают все ETag
+        seed_sync_watermarks(pg_conn)
+        bump_data_version(["epoch"])
+    pg_conn.close()
+    checkpoint_conn.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
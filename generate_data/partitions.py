@@ -0,0 +1,190 @@
+"""Управление недельными партициями таблицы attendance.
+
+attendance разбита по RANGE (week_start). Партиции создаются заранее на
+скользящем горизонте без разрывов между диапазонами (каждая покрывает
+[понедельник, следующий понедельник)), строки вне известных недель попадают
+в attendance_default, а старые партиции можно отсоединить и перенести в
+архивную схему или удалить.
+
+Запуск по расписанию:
+    python partitions.py --ahead-weeks 8 --retain-weeks 104 --archive-schema archive
+"""
+import argparse
+import re
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+
+PARENT = "attendance"
+DEFAULT_PARTITION = "attendance_default"
+BOUND_RE = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def week_monday(day):
+    if isinstance(day, datetime):
+        day = day.date()
+    return day - timedelta(days=day.weekday())
+
+
+def week_range(monday):
+    """Границы партиции недели: [понедельник, следующий понедельник)."""
+    return monday, monday + timedelta(days=7)
+
+
+def missing_weeks(covered, start, end):
+    """Понедельники недель от недели start до end, не покрытых диапазонами covered [(начало, конец)]."""
+    mondays = []
+    monday = week_monday(start)
+    while monday <= end:
+        if not any(p_start <= monday < p_end for p_start, p_end in covered):
+            mondays.append(monday)
+        monday += timedelta(days=7)
+    return mondays
+
+
+def retire_cutoff(today, retain_weeks):
+    """Граница вывода: хранятся текущая неделя и retain_weeks недель до неё."""
+    return week_monday(today) - timedelta(weeks=retain_weeks)
+
+
+def expired(partitions, before):
+    """Имена партиций [(имя, начало, конец)], целиком лежащих раньше before."""
+    return [name for name, _, end in partitions if end <= before]
+
+
+def partition_name(monday):
+    iso_year, iso_week, _ = monday.isocalendar()
+    return f"{PARENT}_{iso_year}_w{iso_week:02d}"
+
+
+def list_partitions(cur):
+    """Возвращает [(имя, начало, конец)] диапазонных партиций attendance."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (PARENT,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = BOUND_RE.search(bound or "")
+        if match:
+            start, end = (date.fromisoformat(v) for v in match.groups())
+            partitions.append((name, start, end))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def ensure_default_partition(cur):
+    cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(
+        sql.Identifier(DEFAULT_PARTITION), sql.Identifier(PARENT)))
+
+
+def ensure_brin_index(cur):
+    # Индекс на родительской таблице создаётся в каждой партиции, включая будущие
+    cur.execute(sql.SQL(
+        "CREATE INDEX IF NOT EXISTS attendance_date_brin ON {} USING brin (attendance_date)"
+    ).format(sql.Identifier(PARENT)))
+
+
+def create_partition(cur, monday):
+    """Создаёт партицию на неделю [monday, monday + 7 дней).
+
+    Если строки этой недели уже лежат в attendance_default, они переносятся в
+    новую таблицу до ATTACH, иначе PostgreSQL отказался бы создавать партицию.
+    """
+    name = partition_name(monday)
+    monday, until = week_range(monday)
+    cur.execute(
+        sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE week_start >= %s AND week_start < %s)").format(
+            sql.Identifier(DEFAULT_PARTITION)),
+        (monday, until))
+    if not cur.fetchone()[0]:
+        cur.execute(
+            sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+                sql.Identifier(name), sql.Identifier(PARENT)),
+            (monday, until))
+        return name
+
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+        sql.Identifier(name), sql.Identifier(PARENT)))
+    cur.execute(
+        sql.SQL("""
+            WITH moved AS (
+                DELETE FROM {} WHERE week_start >= %s AND week_start < %s RETURNING *
+            )
+            INSERT INTO {} SELECT * FROM moved
+        """).format(sql.Identifier(DEFAULT_PARTITION), sql.Identifier(name)),
+        (monday, until))
+    cur.execute(
+        sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+            sql.Identifier(PARENT), sql.Identifier(name)),
+        (monday, until))
+    return name
+
+
+def ensure_partitions(conn, start, end):
+    """Создаёт недостающие недельные партиции, покрывающие [start, end]."""
+    created = []
+    with conn.cursor() as cur:
+        ensure_default_partition(cur)
+        ensure_brin_index(cur)
+        covered = [(p_start, p_end) for _, p_start, p_end in list_partitions(cur)]
+        for monday in missing_weeks(covered, start, end):
+            created.append(create_partition(cur, monday))
+    conn.commit()
+    return created
+
+
+def retire_partitions(conn, before, archive_schema=None, drop=False):
+    """Отсоединяет партиции, целиком лежащие раньше before.
+
+    Отсоединённая таблица переносится в archive_schema, удаляется при drop
+    или остаётся отдельной таблицей в текущей схеме.
+    """
+    retired = []
+    with conn.cursor() as cur:
+        if archive_schema:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(archive_schema)))
+        for name in expired(list_partitions(cur), before):
+            cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                sql.Identifier(PARENT), sql.Identifier(name)))
+            if drop:
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+            elif archive_schema:
+                cur.execute(sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(
+                    sql.Identifier(name), sql.Identifier(archive_schema)))
+            retired.append(name)
+    conn.commit()
+    return retired
+
+
+def maintain(conn, ahead_weeks, retain_weeks=None, archive_schema=None, drop=False, start=None):
+    """Держит партиции от start (или текущей недели) до ahead_weeks недель вперёд
+    и, если задано retain_weeks, выводит из таблицы более старые недели."""
+    today = date.today()
+    created = ensure_partitions(conn, start or today, today + timedelta(weeks=ahead_weeks))
+    retired = []
+    if retain_weeks is not None:
+        retired = retire_partitions(conn, retire_cutoff(today, retain_weeks), archive_schema, drop)
+    return created, retired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание партиций attendance")
+    parser.add_argument("--ahead-weeks", type=int, default=8)
+    parser.add_argument("--retain-weeks", type=int, default=None)
+    parser.add_argument("--archive-schema", default=None)
+    parser.add_argument("--drop", action="store_true", help="удалять, а не архивировать старые партиции")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+    try:
+        created, retired = maintain(conn, args.ahead_weeks, args.retain_weeks, args.archive_schema, args.drop)
+    finally:
+        conn.close()
+    print(f"Создано партиций: {len(created)}, выведено из таблицы: {len(retired)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Снимок сгенерированного набора данных и восстановление из него.
+
+Вместо повторной генерации Faker и синхронизации четырёх хранилищ набор
+данных сохраняется в сжатые (gzip) файлы в родных форматах массовой загрузки:
+
+    postgres/<таблица>.copy.gz   COPY ... WITH (FORMAT binary)
+    redis.jsonl.gz               строки {key, ttl, dump}: DUMP карточек student:*
+                                 в base64 для RESTORE
+    mongo/<коллекция>.bson.gz    документы BSON подряд, как у mongodump
+    elasticsearch.ndjson.gz      документы в формате bulk API
+    neo4j/nodes.jsonl.gz,        узлы и связи по строке JSON; восстанавливаются
+    neo4j/relationships.jsonl.gz пачками через UNWIND (neo4j-admin недоступен по Bolt)
+
+Снимки переносятся между окружениями, поэтому в них только данные: pickle
+не используется, и файлы читаются любыми инструментами (zcat | jq).
+
+Таблицы PostgreSQL выгружаются параллельно, но из одного снимка базы
+(pg_export_snapshot): внешние ключи между файлами согласованы, даже если
+данные меняются во время выгрузки.
+
+Восстановление загружает все хранилища параллельно, а таблицы PostgreSQL —
+параллельно друг другу с отключёнными на время загрузки триггерами внешних ключей.
+
+    python snapshot.py snapshot [--dir snapshot]
+    python snapshot.py restore [--dir snapshot]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time
+
+import bson
+import redis
+from elasticsearch import helpers
+from psycopg2 import sql
+
+import main as generator
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+# Таблицы в порядке зависимостей; generator_checkpoints сохраняется, чтобы
+# генератор после восстановления считал все этапы выполненными
+TABLES = [name for name, _ in generator.PG_STAGES] + ["generator_checkpoints"]
+BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", 5000))
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", 8))
+# В снимок Redis попадают только данные генератора. Версии данных, кэши,
+# блокировки singleflight, поток приёма отметок и sync:lag — состояние
+# работающих сервисов; старые счётчики версий вернули бы устаревшие ETag
+REDIS_DATA_PATTERN = "student:*"
+
+# DUMP возвращает бинарные данные, поэтому нужен клиент без decode_responses
+redis_raw = redis.Redis(host='redis', port=6379, db=0)
+
+
+# Теги временных типов в JSON; datetime проверяется раньше date, потому что является его подклассом
+TEMPORAL_TYPES = [("$datetime", datetime), ("$date", date), ("$time", dt_time)]
+
+
+def encode_value(value):
+    """Значение свойства Neo4j в JSON: временные типы — объектом {тег: ISO-строка}."""
+    if hasattr(value, "to_native"):
+        value = value.to_native()
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    for tag, cls in TEMPORAL_TYPES:
+        if isinstance(value, cls):
+            return {tag: value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    # datetime/date драйвер запишет обратно теми же временными типами Neo4j
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        for tag, cls in TEMPORAL_TYPES:
+            if tag in value:
+                return cls.fromisoformat(value[tag])
+    return value
+
+
+def write_rows(path, rows):
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=1) as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def read_batches(path):
+    """Читает JSONL-файл снимка пачками по BATCH_SIZE строк."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        batch = []
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# ----- PostgreSQL -----
+
+def snapshot_table(directory, table, pg_snapshot):
+    conn = generator.pg_connect()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cur, gzip.open(os.path.join(directory, "postgres", f"{table}.copy.gz"), "wb",
+                                             compresslevel=1) as f:
+            # Транзакция видит те же данные, что и транзакция, экспортировавшая снимок
+            cur.execute("SET TRANSACTION SNAPSHOT %s;", (pg_snapshot,))
+            # Партиционированную таблицу нельзя выгрузить через COPY table TO, только через запрос
+            cur.copy_expert(sql.SQL("COPY (SELECT * FROM {}) TO STDOUT WITH (FORMAT binary)").format(
+                sql.Identifier(table)).as_string(conn), f)
+    finally:
+        conn.close()
+
+
+def restore_table(directory, table):
+    conn = generator.pg_connect()
+    try:
+        with conn.cursor() as cur, gzip.open(os.path.join(directory, "postgres", f"{table}.copy.gz"), "rb") as f:
+            # Строки ссылаются на таблицы, которые загружаются параллельно; проверки
+            # внешних ключей выключаются только для этой сессии
+            cur.execute("SET session_replication_role = replica;")
+            cur.copy_expert(sql.SQL("COPY {} FROM STDIN WITH (FORMAT binary)").format(
+                sql.Identifier(table)).as_string(conn), f)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def restore_postgres(directory, pool):
+    # Без схемы COPY упал бы с посторонней ошибкой или загрузил бы часть таблиц
+    generator.build_schema()
+    with generator.pg_conn:
+        with generator.pg_conn.cursor() as cur:
+            cur.execute(sql.SQL("TRUNCATE {} RESTART IDENTITY CASCADE;").format(
+                sql.SQL(", ").join(sql.Identifier(t) for t in TABLES)))
+    for future in [pool.submit(restore_table, directory, table) for table in TABLES]:
+        future.result()
+    with generator.pg_conn:
+        with generator.pg_conn.cursor() as cur:
+            for table in TABLES:
+                if table == "generator_checkpoints":
+                    continue
+                cur.execute(sql.SQL(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {};"
+                ).format(sql.Identifier(table)), (table,))
+            generator.refresh_report_view(generator.pg_conn)
+
+
+# ----- Redis -----
+
+def snapshot_redis(directory):
+    def rows():
+        keys = []
+        for key in redis_raw.scan_iter(match=REDIS_DATA_PATTERN, count=BATCH_SIZE):
+            keys.append(key)
+            if len(keys) >= BATCH_SIZE:
+                yield from dump_keys(keys)
+                keys = []
+        if keys:
+            yield from dump_keys(keys)
+
+    def dump_keys(keys):
+        pipe = redis_raw.pipeline(transaction=False)
+        for key in keys:
+            pipe.pttl(key)
+            pipe.dump(key)
+        values = pipe.execute()
+        return [{"key": key.decode(), "ttl": max(values[2 * i], 0),
+                 "dump": base64.b64encode(values[2 * i + 1]).decode("ascii")}
+                for i, key in enumerate(keys)]
+
+    write_rows(os.path.join(directory, "redis.jsonl.gz"), rows())
+
+
+def restore_redis(directory):
+    # Карточки, которых нет в снимке, не должны пережить восстановление
+    keys = []
+    for key in redis_raw.scan_iter(match=REDIS_DATA_PATTERN, count=BATCH_SIZE):
+        keys.append(key)
+        if len(keys) >= BATCH_SIZE:
+            redis_raw.delete(*keys)
+            keys = []
+    if keys:
+        redis_raw.delete(*keys)
+    for batch in read_batches(os.path.join(directory, "redis.jsonl.gz")):
+        pipe = redis_raw.pipeline(transaction=False)
+        for row in batch:
+            pipe.restore(row["key"], row["ttl"], base64.b64decode(row["dump"]), replace=True)
+        pipe.execute()
+
+
+# ----- MongoDB -----
+
+def snapshot_mongo(directory):
+    for name in generator.mongo_db.list_collection_names():
+        with gzip.open(os.path.join(directory, "mongo", f"{name}.bson.gz"), "wb", compresslevel=1) as f:
+            for doc in generator.mongo_db[name].find({}, batch_size=BATCH_SIZE):
+                f.write(bson.encode(doc))
+
+
+def restore_mongo(directory):
+    for filename in os.listdir(os.path.join(directory, "mongo")):
+        collection = generator.mongo_db[filename[:-len(".bson.gz")]]
+        collection.delete_many({})
+        with gzip.open(os.path.join(directory, "mongo", filename), "rb") as f:
+            batch = []
+            for doc in bson.decode_file_iter(f):
+                batch.append(doc)
+                if len(batch) >= BATCH_SIZE:
+                    collection.insert_many(batch)
+                    batch = []
+            if batch:
+                collection.insert_many(batch)
+
+
+# ----- Elasticsearch -----
+
+def snapshot_es(directory):
+    with gzip.open(os.path.join(directory, "elasticsearch.ndjson.gz"), "wt", encoding="utf-8", compresslevel=1) as f:
+        for hit in helpers.scan(generator.es, index=generator.ES_INDEX, size=BATCH_SIZE):
+            f.write(json.dumps({"index": {"_id": hit["_id"]}}) + "\n")
+            f.write(json.dumps(hit["_source"], ensure_ascii=False, default=str) + "\n")
+
+
+def restore_es(directory):
+    def actions():
+        with gzip.open(os.path.join(directory, "elasticsearch.ndjson.gz"), "rt", encoding="utf-8") as f:
+            for meta in f:
+                source = next(f)
+                yield {"_index": generator.ES_INDEX, "_id": json.loads(meta)["index"]["_id"],
+                       "_source": json.loads(source)}
+
+    generator.es.indices.delete(index=generator.ES_INDEX, ignore_unavailable=True)
+    original_settings = generator.prepare_es_index()
+    try:
+        for _ in helpers.parallel_bulk(generator.es, actions(), thread_count=generator.SYNC_WORKERS["elasticsearch"],
+                                       chunk_size=generator.ES_BULK_CHUNK_SIZE):
+            pass
+    finally:
+        generator.restore_es_index(original_settings)
+
+
+# ----- Neo4j -----
+
+def snapshot_neo4j(directory):
+    def records(query):
+        with generator.neo4j_driver.session() as session:
+            for record in session.run(query):
+                row = record.data()
+                row["props"] = {k: encode_value(v) for k, v in row["props"].items()}
+                yield row
+
+    write_rows(os.path.join(directory, "neo4j", "nodes.jsonl.gz"),
+               records("MATCH (n) RETURN elementId(n) AS sid, labels(n) AS labels, properties(n) AS props"))
+    write_rows(os.path.join(directory, "neo4j", "relationships.jsonl.gz"),
+               records("MATCH (a)-[r]->(b) RETURN elementId(a) AS start, elementId(b) AS end, "
+                       "type(r) AS type, properties(r) AS props"))
+
+
+def quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+def restore_neo4j(directory):
+    with generator.neo4j_driver.session() as session:
+        session.run("MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS").consume()
+        # Временная метка _Restore с индексом по исходному id нужна, чтобы связать узлы
+        session.run("CREATE INDEX restore_sid IF NOT EXISTS FOR (n:_Restore) ON (n._sid)").consume()
+        session.run("CALL db.awaitIndexes()").consume()
+
+        for batch in read_batches(os.path.join(directory, "neo4j", "nodes.jsonl.gz")):
+            by_labels = {}
+            for row in batch:
+                by_labels.setdefault(tuple(sorted(row["labels"])), []).append(
+                    {"sid": row["sid"], "props": {k: decode_value(v) for k, v in row["props"].items()}})
+            for labels, rows in by_labels.items():
+                label_expr = "".join(f":{quote(label)}" for label in labels + ("_Restore",))
+                session.run(f"UNWIND $rows AS row CREATE (n{label_expr}) SET n = row.props, n._sid = row.sid",
+                            rows=rows).consume()
+
+        for batch in read_batches(os.path.join(directory, "neo4j", "relationships.jsonl.gz")):
+            by_type = {}
+            for row in batch:
+                by_type.setdefault(row["type"], []).append(
+                    {"start": row["start"], "end": row["end"],
+                     "props": {k: decode_value(v) for k, v in row["props"].items()}})
+            for rel_type, rows in by_type.items():
+                session.run(f"""
+                    UNWIND $rows AS row
+                    MATCH (a:_Restore {{_sid: row.start}})
+                    MATCH (b:_Restore {{_sid: row.end}})
+                    CREATE (a)-[r:{quote(rel_type)}]->(b)
+                    SET r = row.props
+                """, rows=rows).consume()
+
+        session.run("""
+            MATCH (n:_Restore)
+            CALL { WITH n REMOVE n:_Restore, n._sid } IN TRANSACTIONS OF 10000 ROWS
+        """).consume()
+        session.run("DROP INDEX restore_sid IF EXISTS").consume()
+    # Снимок содержит только данные: индексы генератора создаются заново, уже по загруженным узлам
+    generator.create_neo4j_indexes()
+
+
+# ----- Команды -----
+
+def run_parallel(jobs):
+    """Выполняет {имя: функция} параллельно и печатает время каждого задания."""
+    def timed(name, func):
+        started = time.time()
+        func()
+        print(f"{name}: {time.time() - started:.1f} с")
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(timed, name, func) for name, func in jobs.items()]
+        for future in futures:
+            future.result()
+
+
+def snapshot(directory):
+    for sub in ("postgres", "mongo", "neo4j"):
+        os.makedirs(os.path.join(directory, sub), exist_ok=True)
+    # Снимок PostgreSQL действует, пока открыта экспортировавшая его транзакция
+    conn = generator.pg_connect()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot();")
+            pg_snapshot = cur.fetchone()[0]
+        jobs = {f"postgres.{table}": (lambda t=table: snapshot_table(directory, t, pg_snapshot)) for table in TABLES}
+        jobs.update({
+            "redis": lambda: snapshot_redis(directory),
+            "mongo": lambda: snapshot_mongo(directory),
+            "elasticsearch": lambda: snapshot_es(directory),
+            "neo4j": lambda: snapshot_neo4j(directory),
+        })
+        run_parallel(jobs)
+    finally:
+        conn.close()
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "tables": TABLES}, f)
+
+
+def restore(directory):
+    if not os.path.exists(os.path.join(directory, "manifest.json")):
+        raise FileNotFoundError(f"Снимок не найден в {directory}")
+    with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as table_pool:
+        run_parallel({
+            "postgres": lambda: restore_postgres(directory, table_pool),
+            "redis": lambda: restore_redis(directory),
+            "mongo": lambda: restore_mongo(directory),
+            "elasticsearch": lambda: restore_es(directory),
+            "neo4j": lambda: restore_neo4j(directory),
+        })
+    # Хранилища восстановлены из одного снимка: журнал до этого момента применять
+    # не нужно, а восстановленный набор данных не совпадает с тем, на который выданы ETag
+    generator.seed_sync_watermarks(generator.pg_conn)
+    generator.bump_data_version(["epoch"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок и восстановление набора данных")
+    parser.add_argument("command", choices=["snapshot", "restore"])
+    parser.add_argument("--dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.command == "snapshot":
+        snapshot(args.dir)
+    else:
+        restore(args.dir)
+    print(f"Готово за {time.time() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
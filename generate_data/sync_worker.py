@@ -0,0 +1,528 @@
+"""Инкрементальная синхронизация PostgreSQL с Redis, Elasticsearch, MongoDB и Neo4j.
+
+Триггеры из functions.sql пишут каждое изменение отслеживаемых таблиц в
+sync_outbox. Для каждого хранилища здесь работает свой цикл: он читает
+пачку новых записей журнала, перечитывает затронутые строки из PostgreSQL
+и применяет к хранилищу только эти изменения, после чего сдвигает свою
+отметку в sync_watermarks. Строка, которой больше нет в таблице, удаляется
+из хранилища, поэтому порядок событий внутри пачки не важен.
+
+Отдельный цикл reports раз в SYNC_REPORTS_INTERVAL секунд пересчитывает
+сводку посещаемости для отчёта lab1, если в журнале появились изменения.
+
+Цикл versions сдвигает версии данных, по которым lab-сервисы выдают ETag
+(generator.bump_data_version): "catalog" — при изменении любой таблицы, кроме
+attendance, "attendance", "group:<имя>" и "semester:<год>:<n>" — при изменении
+отметок (всех, группы и семестра). Он идёт не дальше самого отстающего из хранилищ
+VERSIONED_STORES, чтобы новая версия не появилась раньше самих данных.
+
+Журнал читается в порядке (tx, id) и только до pg_snapshot_xmin: записи
+транзакций, которые ещё могут зафиксироваться, не пропускаются отметкой.
+Отметка хранилища сдвигается на конец просмотренной пачки, даже если в ней
+нет событий его таблиц: иначе хранилище с редко меняющимися таблицами
+держало бы на месте очистку журнала и цикл versions. После полной загрузки
+и восстановления снимка отметки ставит на конец журнала генератор
+(generator.seed_sync_watermarks).
+
+    python sync_worker.py            # непрерывная синхронизация
+    python sync_worker.py --once     # одна пачка для каждого хранилища
+    python sync_worker.py --lag      # текущее отставание хранилищ
+"""
+import argparse
+import os
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import helpers
+from psycopg2.extras import NamedTupleCursor
+from pymongo import DeleteMany, ReplaceOne
+
+import main as generator
+
+POLL_INTERVAL = float(os.getenv("SYNC_POLL_INTERVAL", 1))
+OUTBOX_BATCH_SIZE = int(os.getenv("SYNC_OUTBOX_BATCH_SIZE", 5000))
+# Каждые столько циклов записи журнала, применённые всеми хранилищами, удаляются
+OUTBOX_PRUNE_EVERY = int(os.getenv("SYNC_OUTBOX_PRUNE_EVERY", 60))
+# Хэш Redis с отставанием хранилищ: <store>:events и <store>:seconds
+LAG_KEY = "sync:lag"
+
+# Таблицы, изменения которых затрагивают хранилище
+STORE_TABLES = {
+    "redis": ["students"],
+    "elasticsearch": ["lecture_materials", "schedule", "attendance"],
+    "mongo": ["universities", "institutes", "departments"],
+    "neo4j": ["students", "groups", "lectures", "lecture_course", "departments", "schedule", "attendance"],
+    "reports": ["students", "groups", "lectures", "schedule", "attendance"],
+    "versions": ["universities", "institutes", "departments", "lecture_course", "lectures",
+                 "lecture_materials", "groups", "students", "schedule", "attendance"],
+}
+# Хранилища, из которых lab-сервисы читают отчёты; версии ждут их применения
+VERSIONED_STORES = ["redis", "elasticsearch", "mongo", "neo4j"]
+# Сводка для отчётов пересчитывается целиком, поэтому не чаще раза в интервал и
+# сразу за все накопившиеся события, а не пачками по OUTBOX_BATCH_SIZE
+REPORTS_INTERVAL = float(os.getenv("SYNC_REPORTS_INTERVAL", 60))
+
+
+class Changes:
+    """Пачка событий журнала, сгруппированная по таблицам.
+
+    ids[table] — все затронутые id, deleted[table] — сохранённые триггером
+    строки удалений (по ним находятся родители удалённых строк).
+    """
+
+    def __init__(self, events):
+        self.ids = {}
+        self.deleted = {}
+        for event in events:
+            self.ids.setdefault(event.table_name, set()).add(event.row_id)
+            if event.op == "D":
+                self.deleted.setdefault(event.table_name, []).append(event.row_data)
+
+    def of(self, table):
+        return sorted(self.ids.get(table, ()))
+
+
+def fetch_rows(cur, query, ids):
+    """Текущие строки для ids; query выбирает строки по id = ANY(%s)."""
+    if not ids:
+        return []
+    cur.execute(query, (list(ids),))
+    return cur.fetchall()
+
+
+def changed_schedule_ids(cur, changes):
+    """Занятия, чьи строки schedule или отметки посещаемости изменились."""
+    schedule_ids = set(changes.of("schedule"))
+    schedule_ids.update(row.schedule_id for row in fetch_rows(
+        cur, "SELECT schedule_id FROM attendance WHERE id = ANY(%s);", changes.of("attendance")))
+    schedule_ids.update(row["schedule_id"] for row in changes.deleted.get("attendance", []))
+    return schedule_ids
+
+
+# ----- Применение изменений -----
+
+def apply_redis(cur, changes):
+    ids = changes.of("students")
+    rows = fetch_rows(cur, "SELECT id, full_name, student_record, group_id FROM students WHERE id = ANY(%s);", ids)
+    existing = {row.id for row in rows}
+    pipe = generator.redis_client.pipeline(transaction=False)
+    for batch in generator.chunked(rows, generator.REDIS_BATCH_SIZE):
+        pipe.mset({f"student:{student.id}": generator.encode_student(student) for student in batch})
+    removed = [f"student:{student_id}" for student_id in ids if student_id not in existing]
+    if removed:
+        pipe.delete(*removed)
+    pipe.execute()
+
+
+def apply_elasticsearch(cur, changes):
+    ids = changes.of("lecture_materials")
+    # Изменения расписания и посещаемости меняют scheduled_dates всех материалов лекции
+    lecture_ids = {row.lecture_id for row in fetch_rows(
+        cur, "SELECT lecture_id FROM schedule WHERE id = ANY(%s);", changed_schedule_ids(cur, changes))}
+    lecture_ids.update(row["lecture_id"] for row in changes.deleted.get("schedule", []))
+    if not ids and not lecture_ids:
+        return
+
+    cur.execute("""
+        SELECT m.id, m.name, m.description, m.lecture_id,
+               ARRAY(
+                   SELECT DISTINCT a.attendance_date::date
+                   FROM schedule s
+                   JOIN attendance a ON a.schedule_id = s.id
+                   WHERE s.lecture_id = m.lecture_id
+               ) AS scheduled_dates
+        FROM lecture_materials m
+        WHERE m.id = ANY(%s) OR m.lecture_id = ANY(%s);
+    """, (ids, list(lecture_ids)))
+    rows = cur.fetchall()
+    existing = {row.id for row in rows}
+    actions = [{"_index": generator.ES_INDEX, "_id": row.id, "_source": row._asdict()} for row in rows]
+    actions += [{"_op_type": "delete", "_index": generator.ES_INDEX, "_id": material_id}
+                for material_id in ids if material_id not in existing]
+    # Удаление документа, которого уже нет в индексе, не считается ошибкой
+    helpers.bulk(generator.es, actions, ignore_status=(404,))
+
+
+def apply_mongo(cur, changes):
+    # Документ университета содержит институты и кафедры, поэтому любое их
+    # изменение пересобирает документ университета целиком
+    university_ids = set(changes.of("universities"))
+    university_ids.update(row.university_id for row in fetch_rows(
+        cur, "SELECT university_id FROM institutes WHERE id = ANY(%s);", changes.of("institutes")))
+    university_ids.update(row["university_id"] for row in changes.deleted.get("institutes", []))
+    university_ids.update(row.university_id for row in fetch_rows(cur, """
+        SELECT i.university_id FROM departments d JOIN institutes i ON i.id = d.institute_id
+        WHERE d.id = ANY(%s);
+    """, changes.of("departments")))
+    university_ids.update(row.university_id for row in fetch_rows(
+        cur, "SELECT university_id FROM institutes WHERE id = ANY(%s);",
+        {row["institute_id"] for row in changes.deleted.get("departments", [])}))
+    if not university_ids:
+        return
+
+    documents = list(generator.university_documents(cur.connection, ids=sorted(university_ids)))
+    rebuilt = {doc["id"] for doc in documents}
+    operations = [ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in documents]
+    operations += [DeleteMany({"id": uni_id}) for uni_id in university_ids if uni_id not in rebuilt]
+    generator.mongo_db["university"].bulk_write(operations, ordered=False)
+
+
+def apply_neo4j(cur, changes):
+    students = fetch_rows(cur, "SELECT id, full_name, group_id FROM students WHERE id = ANY(%s);",
+                          changes.of("students"))
+    groups = fetch_rows(cur, "SELECT id, name, course, department_id FROM groups WHERE id = ANY(%s);",
+                        changes.of("groups"))
+    departments = fetch_rows(cur, "SELECT id, name FROM departments WHERE id = ANY(%s);",
+                             changes.of("departments"))
+    lecture_ids = set(changes.of("lectures"))
+    lecture_ids.update(row.id for row in fetch_rows(
+        cur, "SELECT id FROM lectures WHERE course_id = ANY(%s);", changes.of("lecture_course")))
+    lectures = fetch_rows(cur, """
+        SELECT l.id, l.course_id, l.topic, l.tech_requirements, l.is_special,
+               lc.department_id, lc.name AS course_name
+        FROM lectures l
+        JOIN lecture_course lc ON l.course_id = lc.id
+        WHERE l.id = ANY(%s);
+    """, lecture_ids)
+
+    # Связь HAS_SCHEDULE одна на пару (группа, лекция) и, как при полной загрузке,
+    # несёт свойства последней строки schedule этой пары. Пары изменённых строк —
+    # прежние (удалённые строки и связи, которые несут их id) и текущие —
+    # пересобираются по текущим строкам; пара без строк теряет связь
+    schedule_rows = changes.of("schedule")
+    pairs = {(row["group_id"], row["lecture_id"]) for row in changes.deleted.get("schedule", [])}
+    pairs.update((row.group_id, row.lecture_id) for row in fetch_rows(
+        cur, "SELECT group_id, lecture_id FROM schedule WHERE id = ANY(%s);", schedule_rows))
+    if schedule_rows:
+        with generator.neo4j_driver.session() as session:
+            pairs.update((record["group_id"], record["lecture_id"]) for record in session.run("""
+                MATCH (gr:Group)-[h:HAS_SCHEDULE]->(lec:Lecture)
+                WHERE h.schedule_id IN $ids
+                RETURN gr.id AS group_id, lec.id AS lecture_id
+            """, ids=schedule_rows))
+    schedules = []
+    if pairs:
+        group_ids, lecture_ids_of_pairs = (list(column) for column in zip(*pairs))
+        cur.execute("""
+            SELECT DISTINCT ON (s.group_id, s.lecture_id) s.id AS schedule_id, s.group_id, s.lecture_id, s.capacity
+            FROM schedule s
+            JOIN unnest(%s::int[], %s::int[]) AS p(group_id, lecture_id)
+              ON p.group_id = s.group_id AND p.lecture_id = s.lecture_id
+            ORDER BY s.group_id, s.lecture_id, s.id DESC;
+        """, (group_ids, lecture_ids_of_pairs))
+        schedules = cur.fetchall()
+    present_pairs = {(row.group_id, row.lecture_id) for row in schedules}
+    removed_pairs = [{"group_id": group_id, "lecture_id": lecture_id}
+                     for group_id, lecture_id in pairs if (group_id, lecture_id) not in present_pairs]
+
+    # Узлы Schedule затронутых занятий пересчитываются по текущим датам
+    # посещаемости; занятие без дат (или удалённое) теряет все свои узлы
+    schedule_ids = changed_schedule_ids(cur, changes)
+    occurrences = {row.schedule_id: row._asdict() for row in fetch_rows(cur, """
+        SELECT s.id AS schedule_id, s.group_id, s.lecture_id,
+               COALESCE(array_agg(DISTINCT a.attendance_date::date) FILTER (WHERE a.id IS NOT NULL), '{}') AS dates
+        FROM schedule s
+        LEFT JOIN attendance a ON a.schedule_id = s.id
+        WHERE s.id = ANY(%s)
+        GROUP BY s.id;
+    """, schedule_ids)}
+    for schedule_id in schedule_ids:
+        occurrences.setdefault(schedule_id, {"schedule_id": schedule_id, "dates": []})
+    occurrence_rows = [{**row, "date": day} for row in occurrences.values() for day in row["dates"]]
+
+    statements = [
+        ("""
+            UNWIND $rows AS row
+            MERGE (dep:Department {id: row.id})
+            SET dep.name = row.name
+        """, [row._asdict() for row in departments]),
+        ("""
+            UNWIND $rows AS row
+            MERGE (gr:Group {id: row.id})
+            SET gr.name = row.name, gr.course = row.course, gr.department_id = row.department_id
+        """, [row._asdict() for row in groups]),
+        ("""
+            UNWIND $rows AS row
+            MERGE (lec:Lecture {id: row.id})
+            SET lec.course_id = row.course_id, lec.topic = row.topic,
+                lec.tech_requirements = row.tech_requirements, lec.is_special = row.is_special,
+                lec.department_id = row.department_id, lec.course_name = row.course_name
+            WITH lec, row
+            OPTIONAL MATCH (lec)-[old:ORIGINATES_FROM]->()
+            DELETE old
+            WITH DISTINCT lec, row
+            MATCH (dep:Department {id: row.department_id})
+            MERGE (lec)-[:ORIGINATES_FROM]->(dep)
+        """, [row._asdict() for row in lectures]),
+        ("""
+            UNWIND $rows AS row
+            MERGE (st:Student {id: row.id})
+            SET st.full_name = row.full_name, st.group_id = row.group_id
+            WITH st, row
+            OPTIONAL MATCH (st)-[old:BELONGS_TO]->()
+            DELETE old
+            WITH DISTINCT st, row
+            MATCH (gr:Group {id: row.group_id})
+            MERGE (st)-[:BELONGS_TO]->(gr)
+        """, [row._asdict() for row in students]),
+        ("""
+            UNWIND $rows AS row
+            MATCH (:Group {id: row.group_id})-[h:HAS_SCHEDULE]->(:Lecture {id: row.lecture_id})
+            DELETE h
+        """, removed_pairs),
+        ("""
+            UNWIND $rows AS row
+            MATCH (gr:Group {id: row.group_id})
+            MATCH (lec:Lecture {id: row.lecture_id})
+            MERGE (gr)-[h:HAS_SCHEDULE]->(lec)
+            SET h.schedule_id = row.schedule_id,
+                h.capacity = row.capacity
+        """, [row._asdict() for row in schedules]),
+        ("""
+            UNWIND $rows AS row
+            MATCH (o:Schedule {schedule_id: row.schedule_id})
+            WHERE NOT o.date IN row.dates
+            DETACH DELETE o
+        """, list(occurrences.values())),
+        (generator.NEO4J_OCCURRENCES_CYPHER, occurrence_rows),
+    ]
+    # Узлы строк, которых больше нет в PostgreSQL, удаляются вместе со связями
+    for label, table, rows in (("Student", "students", students), ("Group", "groups", groups),
+                               ("Lecture", "lectures", lectures), ("Department", "departments", departments)):
+        present = {row.id for row in rows}
+        statements.append((f"""
+            UNWIND $rows AS id
+            MATCH (n:{label} {{id: id}})
+            DETACH DELETE n
+        """, [row_id for row_id in changes.of(table) if row_id not in present]))
+
+    def run(tx):
+        for cypher, rows in statements:
+            if rows:
+                tx.run(cypher, rows=rows).consume()
+
+    with generator.neo4j_driver.session() as session:
+        session.execute_write(run)
+
+
+def apply_versions(cur, changes):
+    scopes = set()
+    if any(table != "attendance" for table in changes.ids):
+        scopes.add("catalog")
+
+    marks = [(row.group_name, row.day) for row in fetch_rows(cur, """
+        SELECT g.name AS group_name, a.attendance_date::date AS day
+        FROM attendance a
+        JOIN schedule s ON s.id = a.schedule_id
+        JOIN groups g ON g.id = s.group_id
+        WHERE a.id = ANY(%s);
+    """, changes.of("attendance"))]
+    if changes.of("attendance"):
+        scopes.add("attendance")
+    deleted = changes.deleted.get("attendance", [])
+    group_names = {row.id: row.name for row in fetch_rows(cur, """
+        SELECT s.id, g.name FROM schedule s JOIN groups g ON g.id = s.group_id WHERE s.id = ANY(%s);
+    """, {row["schedule_id"] for row in deleted})}
+    marks += [(group_names.get(row["schedule_id"]), date.fromisoformat(row["attendance_date"][:10]))
+              for row in deleted]
+
+    for group_name, day in marks:
+        if group_name is not None:
+            scopes.add(f"group:{group_name}")
+        semester = generator.semester_scope(day)
+        if semester is not None:
+            scopes.add(semester)
+    generator.bump_data_version(scopes)
+
+
+APPLY = {
+    "redis": apply_redis,
+    "elasticsearch": apply_elasticsearch,
+    "mongo": apply_mongo,
+    "neo4j": apply_neo4j,
+    "versions": apply_versions,
+}
+
+
+def refresh_reports(conn):
+    """Пересчитывает сводку посещаемости, если с прошлого пересчёта были изменения."""
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+        watermark = load_watermark(cur, "reports")
+        cur.execute("""
+            SELECT id, tx::text AS tx
+            FROM sync_outbox
+            WHERE (tx, id) > (%s::xid8, %s)
+              AND tx < pg_snapshot_xmin(pg_current_snapshot())
+              AND table_name = ANY(%s)
+            ORDER BY tx DESC, id DESC
+            LIMIT 1;
+        """, (watermark[0], watermark[1], STORE_TABLES["reports"]))
+        latest = cur.fetchone()
+        if latest:
+            # Снимок REFRESH видит все транзакции до pg_snapshot_xmin, то есть и latest
+            generator.refresh_report_view(conn)
+        # Отметка сдвигается и без изменений сводки: до последней завершённой записи журнала
+        cur.execute("""
+            SELECT id, tx::text AS tx
+            FROM sync_outbox
+            WHERE (tx, id) > (%s::xid8, %s)
+              AND tx < pg_snapshot_xmin(pg_current_snapshot())
+            ORDER BY tx DESC, id DESC
+            LIMIT 1;
+        """, (watermark[0], watermark[1]))
+        scanned = cur.fetchone()
+        if scanned:
+            save_watermark(cur, "reports", (scanned.tx, scanned.id))
+    conn.commit()
+    if latest:
+        generator.bump_data_version(["reports"])
+    return 1 if latest else 0
+
+
+# ----- Журнал и отметки -----
+
+def load_watermark(cur, store):
+    cur.execute("SELECT tx::text, outbox_id FROM sync_watermarks WHERE store = %s;", (store,))
+    row = cur.fetchone()
+    return (row.tx, row.outbox_id) if row else ("0", 0)
+
+
+def fetch_events(cur, watermark, until=None):
+    """Пачка событий всех таблиц после watermark; until — необязательная верхняя граница (включительно).
+
+    row_data нужен только удалениям, поэтому читается только для них.
+    """
+    until_tx, until_id = until or (None, None)
+    cur.execute("""
+        SELECT id, tx::text AS tx, table_name, op, row_id, CASE WHEN op = 'D' THEN row_data END AS row_data
+        FROM sync_outbox
+        WHERE (tx, id) > (%s::xid8, %s)
+          AND tx < pg_snapshot_xmin(pg_current_snapshot())
+          AND (%s::xid8 IS NULL OR (tx, id) <= (%s::xid8, %s))
+        ORDER BY tx, id
+        LIMIT %s;
+    """, (watermark[0], watermark[1], until_tx, until_tx, until_id, OUTBOX_BATCH_SIZE))
+    return cur.fetchall()
+
+
+def save_watermark(cur, store, watermark):
+    cur.execute("""
+        INSERT INTO sync_watermarks (store, tx, outbox_id, updated_at)
+        VALUES (%s, %s::xid8, %s, now())
+        ON CONFLICT (store) DO UPDATE
+        SET tx = EXCLUDED.tx, outbox_id = EXCLUDED.outbox_id, updated_at = EXCLUDED.updated_at;
+    """, (store, watermark[0], watermark[1]))
+
+
+def replication_lag(cur, store):
+    """(число неприменённых событий, возраст самого старого из них в секундах)."""
+    tx, outbox_id = load_watermark(cur, store)
+    cur.execute("""
+        SELECT count(*) AS events,
+               COALESCE(EXTRACT(EPOCH FROM clock_timestamp() - min(changed_at)), 0) AS seconds
+        FROM sync_outbox
+        WHERE (tx, id) > (%s::xid8, %s) AND table_name = ANY(%s);
+    """, (tx, outbox_id, STORE_TABLES[store]))
+    row = cur.fetchone()
+    return row.events, float(row.seconds)
+
+
+def report_lag(cur, store):
+    events, seconds = replication_lag(cur, store)
+    generator.redis_client.hset(LAG_KEY, mapping={f"{store}:events": events, f"{store}:seconds": round(seconds, 3)})
+    return events, seconds
+
+
+def prune_outbox(cur):
+    # Удаляются записи, которые применили все хранилища
+    cur.execute("SELECT count(*) AS stores FROM sync_watermarks WHERE store = ANY(%s);", (list(STORE_TABLES),))
+    if cur.fetchone().stores < len(STORE_TABLES):
+        return
+    cur.execute("""
+        DELETE FROM sync_outbox
+        WHERE (tx, id) <= (SELECT tx, outbox_id FROM sync_watermarks
+                           WHERE store = ANY(%s) ORDER BY tx, outbox_id LIMIT 1);
+    """, (list(STORE_TABLES),))
+
+
+def sync_batch(conn, store):
+    """Применяет к хранилищу одну пачку журнала; возвращает число просмотренных событий."""
+    if store == "reports":
+        return refresh_reports(conn)
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+        watermark = load_watermark(cur, store)
+        until = None
+        if store == "versions":
+            until = min((load_watermark(cur, s) for s in VERSIONED_STORES), key=lambda w: (int(w[0]), w[1]))
+        events = fetch_events(cur, watermark, until)
+        relevant = [event for event in events if event.table_name in STORE_TABLES[store]]
+        if relevant:
+            APPLY[store](cur, Changes(relevant))
+        if events:
+            save_watermark(cur, store, (events[-1].tx, events[-1].id))
+    conn.commit()
+    return len(events)
+
+
+def run_store(store, once=False):
+    """Цикл синхронизации одного хранилища в собственном подключении.
+
+    Ошибка хранилища не сдвигает его отметку: пачка будет применена повторно
+    на следующем цикле, остальные хранилища продолжают работу.
+    """
+    conn = generator.pg_connect()
+    rounds = 0
+    try:
+        while True:
+            try:
+                applied = sync_batch(conn, store)
+                rounds += 1
+                with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+                    events, seconds = report_lag(cur, store)
+                    # Журнал общий для всех хранилищ, чистит его цикл первого из них
+                    if store == next(iter(STORE_TABLES)) and rounds % OUTBOX_PRUNE_EVERY == 0:
+                        prune_outbox(cur)
+                conn.commit()
+                if applied:
+                    print(f"{store}: просмотрено {applied} событий, отставание {events} событий / {seconds:.1f} с")
+            except Exception as e:
+                conn.rollback()
+                print(f"{store}: ошибка синхронизации: {e}")
+                applied = 0
+            if once:
+                return
+            # Полная пачка означает, что журнал ещё не дочитан
+            if store == "reports":
+                time.sleep(REPORTS_INTERVAL)
+            elif applied < OUTBOX_BATCH_SIZE:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальная синхронизация вторичных хранилищ")
+    parser.add_argument("--once", action="store_true", help="применить одну пачку и выйти")
+    parser.add_argument("--lag", action="store_true", help="показать отставание хранилищ и выйти")
+    parser.add_argument("--stores", nargs="+", choices=list(STORE_TABLES), default=list(STORE_TABLES))
+    args = parser.parse_args()
+
+    if args.lag:
+        conn = generator.pg_connect()
+        try:
+            with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+                for store in args.stores:
+                    events, seconds = replication_lag(cur, store)
+                    print(f"{store}: {events} событий, {seconds:.1f} с")
+        finally:
+            conn.close()
+        return
+
+    with ThreadPoolExecutor(max_workers=len(args.stores)) as pool:
+        for future in [pool.submit(run_store, store, args.once) for store in args.stores]:
+            future.result()
+
+
+if __name__ == "__main__":
+    main()
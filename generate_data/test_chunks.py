@@ -0,0 +1,78 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import chunks
+
+
+class FakeCollection:
+    """Коллекция MongoDB в памяти: bulk_write применяет ReplaceOne по фильтру, insert_many дописывает."""
+
+    def __init__(self):
+        self.docs = []
+        self.lock = threading.Lock()
+
+    def bulk_write(self, operations, ordered=True):
+        with self.lock:
+            for op in operations:
+                matches = [i for i, doc in enumerate(self.docs)
+                           if all(doc.get(k) == v for k, v in op._filter.items())]
+                if matches:
+                    self.docs[matches[0]] = op._doc
+                elif op._upsert:
+                    self.docs.append(op._doc)
+
+    def insert_many(self, documents):
+        with self.lock:
+            self.docs.extend(documents)
+
+    def ids(self):
+        return sorted(doc["id"] for doc in self.docs)
+
+
+DOCUMENTS = [{"id": i, "name": f"Университет {i}"} for i in range(1, 21)]
+PROGRESS = SimpleNamespace(update=lambda n: None)
+
+
+def load_stage(write, fail_on=None):
+    """Прогон этапа как в add_universities_to_mongo: продолжение с сохранённой отметки."""
+    checkpoint = {"high_water": 0}
+
+    def run(fail_on):
+        def handler(chunk):
+            if fail_on in (doc["id"] for doc in chunk):
+                raise RuntimeError("сбой пачки")
+            return write(chunk)
+
+        def save(chunk):
+            checkpoint["high_water"] = chunk[-1]["id"]
+
+        rows = (doc for doc in DOCUMENTS if doc["id"] > checkpoint["high_water"])
+        chunks.run_chunks(handler, chunks.chunked(rows, 2), 2, PROGRESS, on_done=save)
+
+    with pytest.raises(RuntimeError):
+        run(fail_on)
+    return checkpoint, lambda: run(None)
+
+
+def test_failed_chunk_leaves_later_chunks_written_but_not_checkpointed():
+    collection = FakeCollection()
+    checkpoint, _ = load_stage(lambda chunk: collection.insert_many(chunk) or len(chunk), fail_on=5)
+    # Пачки после упавшей (ids 5-6) уже отправлены в пул и дописываются без отметки
+    assert checkpoint["high_water"] == 4
+    assert max(collection.ids()) > 6
+
+
+def test_replay_after_partial_load_does_not_duplicate_documents():
+    collection = FakeCollection()
+    _, resume = load_stage(lambda chunk: chunks.upsert_by_id(collection, chunk), fail_on=5)
+    resume()
+    assert collection.ids() == [doc["id"] for doc in DOCUMENTS]
+
+
+def test_upsert_by_id_replaces_existing_document():
+    collection = FakeCollection()
+    chunks.upsert_by_id(collection, [{"id": 1, "name": "старое"}])
+    assert chunks.upsert_by_id(collection, [{"id": 1, "name": "новое"}]) == 1
+    assert collection.docs == [{"id": 1, "name": "новое"}]
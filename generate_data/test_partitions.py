@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import partitions
+
+
+def test_week_monday_of_any_day():
+    assert partitions.week_monday(date(2024, 9, 1)) == date(2024, 8, 26)  # воскресенье
+    assert partitions.week_monday(date(2024, 9, 2)) == date(2024, 9, 2)
+    assert partitions.week_monday(datetime(2024, 9, 4, 23, 59)) == date(2024, 9, 2)
+
+
+def test_missing_weeks_are_gap_free_and_monday_aligned():
+    start, end = date(2024, 9, 4), date(2024, 12, 31)
+    mondays = partitions.missing_weeks([], start, end)
+    ranges = [partitions.week_range(monday) for monday in mondays]
+    assert all(monday.weekday() == 0 for monday in mondays)
+    assert ranges[0][0] <= start and ranges[-1][1] > end
+    # Конец каждой недели — начало следующей
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(ranges, ranges[1:]))
+    assert all(until - monday == timedelta(days=7) for monday, until in ranges)
+
+
+def test_missing_weeks_skip_covered_ranges():
+    covered = [(date(2024, 9, 9), date(2024, 9, 16)), (date(2024, 9, 23), date(2024, 9, 30))]
+    assert partitions.missing_weeks(covered, date(2024, 9, 2), date(2024, 9, 30)) == [
+        date(2024, 9, 2), date(2024, 9, 16), date(2024, 9, 30)]
+
+
+def test_missing_weeks_include_the_week_of_end():
+    assert partitions.missing_weeks([], date(2024, 9, 2), date(2024, 9, 9)) == [date(2024, 9, 2), date(2024, 9, 9)]
+    assert partitions.missing_weeks([], date(2024, 9, 9), date(2024, 9, 2)) == []
+
+
+def test_partition_names_are_unique_across_iso_years():
+    mondays = partitions.missing_weeks([], date(2024, 12, 1), date(2026, 1, 31))
+    names = [partitions.partition_name(monday) for monday in mondays]
+    assert len(set(names)) == len(names)
+    # Неделя с 30.12.2024 — первая неделя 2025 года по ISO
+    assert partitions.partition_name(date(2024, 12, 30)) == "attendance_2025_w01"
+
+
+@pytest.mark.parametrize("today", [date(2024, 9, 2), date(2024, 9, 5), date(2024, 9, 8)])
+def test_retire_cutoff_keeps_current_week_and_retained_weeks(today):
+    assert partitions.retire_cutoff(today, 0) == date(2024, 9, 2)
+    assert partitions.retire_cutoff(today, 4) == date(2024, 8, 5)
+
+
+def test_expired_only_partitions_entirely_before_cutoff():
+    weeks = [(partitions.partition_name(monday), *partitions.week_range(monday))
+             for monday in partitions.missing_weeks([], date(2024, 7, 29), date(2024, 8, 19))]
+    cutoff = partitions.retire_cutoff(date(2024, 8, 21), 1)  # 12.08.2024
+    assert partitions.expired(weeks, cutoff) == [partitions.partition_name(date(2024, 7, 29)),
+                                                 partitions.partition_name(date(2024, 8, 5))]
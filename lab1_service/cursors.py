@@ -0,0 +1,37 @@
+"""Курсоры постраничного отчёта о низкой посещаемости.
+
+Курсор — ключ сортировки последней строки страницы (percents, student_id,
+topic, lecture_id) в JSON и base64; следующая страница начинается строго
+после него.
+"""
+import base64
+import json
+from decimal import Decimal
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(percents, student_id, topic, lecture_id):
+    """Непрозрачный курсор страницы: ключ сортировки строки отчёта в base64.
+
+    lecture_id различает лекции с одинаковой темой; percents хранится строкой,
+    чтобы Decimal вернулся в запрос без потери точности.
+    """
+    raw = json.dumps([str(percents), student_id, topic, lecture_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Строка из четырёх символов тоже распаковалась бы в четыре поля
+        if not isinstance(key, list):
+            raise ValueError(key)
+        percents, student_id, topic, lecture_id = key
+        percents = Decimal(percents)
+        # NaN и бесконечность не сравниваются с процентами сводки как числа
+        if not percents.is_finite():
+            raise ValueError(percents)
+        return percents, int(student_id), str(topic), int(lecture_id)
+    except (ValueError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
-from typing import List, Optional
-import psycopg2
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
 import logging
+import os
 from datetime import date
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from neo4j import GraphDatabase
 import redis
 import json
+import msgpack
+
+import cursors
+import dataversion
+import jobs
+import metrics
+import querylog
+import resultcache
+import tracing
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -18,6 +27,10 @@ logging.basicConfig(
 )
 
 app = FastAPI()
+tracing.install(app, "lab1")
+metrics.install(app)
+app.include_router(querylog.router)
+app.include_router(resultcache.router)
 
 # Модели данных
 class User(BaseModel):
@@ -33,114 +46,252 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return User(username="testuser")
 
 
+app.include_router(jobs.router, dependencies=[Depends(get_current_user)])
+
 # Подключение к Elasticsearch
 es = Elasticsearch('http://elasticsearch:9200')
 
 #Postgres
-pg_conn = psycopg2.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+pg_conn = querylog.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+
+# Redis (без decode_responses: значения студентов могут быть бинарными msgpack)
+redis_client = redis.Redis(host='redis', port=6379, db=0)
+
+STUDENT_FIELDS = ("id", "full_name", "student_record", "group_id")
+
+
+def decode_student(raw):
+    """Декодирует student:{id} из JSON (версия 1) или msgpack-массива (версия 2)."""
+    if raw[:1] == b"{":
+        return json.loads(raw)
+    version, *values = msgpack.unpackb(raw, raw=False)
+    if version != 2:
+        raise ValueError(f"Unsupported student schema version: {version}")
+    return dict(zip(STUDENT_FIELDS, values))
 
-# Redis
-redis_client = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
 
 # NEO4j
 neo4j_driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "password"))
 
-@app.get("/reports/low_attendance/", response_model=List)
-async def get_low_attendance_report(
-    search_term: str,
-    start_date: str,
-    end_date: str,
-    current_user: User = Depends(get_current_user)
-):
+# Откуда берутся даты лекций: "elasticsearch" — поле scheduled_dates документов
+# материалов (один запрос), "neo4j" — отдельный поиск по узлам Schedule
+LECTURE_DATES_SOURCE = os.getenv("LECTURE_DATES_SOURCE", "elasticsearch")
 
-    try:
-        query = {
-            "query": {
-                "match": {
-                    "description": search_term
+# Размер страницы отчёта по умолчанию и наибольший допустимый
+REPORT_PAGE_SIZE = 10
+REPORT_MAX_PAGE_SIZE = 1000
+
+
+# Найденные лекции зависят от текста материалов и (через scheduled_dates) от отметок;
+# источник дат входит в имя кэша, так как меняет запрос
+@resultcache.cached(f"material_lectures.{LECTURE_DATES_SOURCE}",
+                    lambda search_term, start_date, end_date, complete=False: ["epoch", "catalog", "attendance"])
+def search_lecture_ids(search_term: str, start_date: str, end_date: str, complete: bool = False) -> List[int]:
+    """id лекций, материалы которых находятся по search_term: первая страница поиска
+    в порядке релевантности или, при complete, все найденные."""
+    # Текст ищется в контексте запроса, диапазон дат — в контексте фильтра:
+    # фильтр не влияет на оценку и кэшируется Elasticsearch
+    query = {
+        "query": {
+            "bool": {
+                "must": {
+                    "match": {
+                        "description": search_term
+                    }
                 }
             }
+        },
+        "_source": ["lecture_id"]
+    }
+    if LECTURE_DATES_SOURCE == "elasticsearch":
+        query["query"]["bool"]["filter"] = {
+            "range": {"scheduled_dates": {"gte": start_date, "lte": end_date}}
         }
-        # Выполнение запроса
-        response = es.search(index="lecture_materials",body=query)
-        # Сбор id из результатов
-        ids = [int(hit["_id"]) for hit in response["hits"]["hits"]]
-        #######################################################################
-        query = """
-            MATCH (gr:Group)-[h:HAS_SCHEDULE]->(lec:Lecture)
-            WHERE date(h.attendance_date) >= date($start_date) 
-              AND date(h.attendance_date) <= date($end_date)
-            RETURN lec.id
-            ORDER BY h.attendance_date
-            """
-
-        with neo4j_driver.session() as session:
-            result = session.run(query, start_date=start_date, end_date=end_date)
-            neo_ids=[int(x[0]) for x in result]
-        #########################################################################
-        common_elements = [value for value in ids if value in neo_ids]
-        if len(common_elements)<1:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-            return 'no lections'
-        # SQL-запрос для получения данных
-        query = f"""
-            SELECT 
-                l.topic,
-                s.id AS student_id,
-                COUNT(CASE WHEN a.status = 'presence' THEN 1 END) * 100.0 / COUNT(a.id) AS percents
-            FROM 
-                lectures l
-            JOIN 
-                schedule sch ON l.id = sch.lecture_id
-            JOIN 
-                attendance a ON sch.id = a.schedule_id
-            JOIN 
-                students s ON a.student_id = s.id
-            WHERE 
-                l.id IN ({ ', '.join(map(str, common_elements))})
-            GROUP BY 
-                l.topic, s.id
-            ORDER BY 
-                percents ASC
-            LIMIT 10;
-            """
-
-        # Создание курсора и выполнение запроса
-        cursor = pg_conn.cursor()
-        cursor.execute(query)
-
-        # Получение всех строк результата
-        rows = cursor.fetchall()
-
-        # Формирование ответа в формате JSON
-        response = []
-        for row in rows:
-            topic = row[0]
-            student_id = row[1]
-            percents = row[2]
-
-            # Получение информации о студенте из Redis
+    # Выполнение запроса
+    with tracing.span("elasticsearch.search", complete=complete) as s:
+        if complete:
+            # Выгрузке нужны все материалы, а не первые 10 попаданий
+            hits = list(helpers.scan(es, index="lecture_materials", query=query))
+        else:
+            hits = es.search(index="lecture_materials",body=query)["hits"]["hits"]
+        s.set_attribute("rows", len(hits))
+    # Сбор id лекций из найденных материалов
+    return list(dict.fromkeys(hit["_source"]["lecture_id"] for hit in hits))
+
+
+@resultcache.cached("lectures_between", lambda start_date, end_date: ["epoch", "attendance"])
+def lecture_ids_between(start_date: str, end_date: str) -> List[int]:
+    """id лекций, проводившихся между датами, по узлам Schedule в Neo4j."""
+    # Поиск по индексу Schedule(date): диапазон дат читается из индекса,
+    # каждая лекция возвращается один раз
+    query = """
+        MATCH (o:Schedule)
+        WHERE o.date >= date($start_date) AND o.date <= date($end_date)
+        RETURN DISTINCT o.lecture_id
+        """
+
+    with tracing.span("neo4j.lecture_dates") as s, neo4j_driver.session() as session:
+        result = session.run(query, start_date=start_date, end_date=end_date)
+        neo_ids = sorted({int(x[0]) for x in result})
+        s.set_attribute("rows", len(neo_ids))
+    return neo_ids
+
+
+def build_low_attendance_page(conn, search_term: str, start_date: str, end_date: str,
+                              threshold: Optional[float], group_id: Optional[int], department_id: Optional[int],
+                              page_size: int, cursor: Optional[str],
+                              complete: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница отчёта и курсор следующей страницы (None на последней); complete — по всем найденным материалам."""
+    # Промежуточные списки лекций общие для всех реплик (resultcache)
+    common_elements = search_lecture_ids(search_term, start_date, end_date, complete)
+    #######################################################################
+    if LECTURE_DATES_SOURCE == "neo4j":
+        neo_ids = set(lecture_ids_between(start_date, end_date))
+        common_elements = [value for value in common_elements if value in neo_ids]
+    #########################################################################
+    if len(common_elements)<1:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+        return 'no lections'
+    # Фильтры и страница считаются в PostgreSQL по заранее посчитанной сводке
+    # student_lecture_attendance: следующая страница — это диапазон индекса
+    # (percents, student_id, topic, lecture_id) после курсора, без повторной агрегации
+    conditions = ["lecture_id = ANY(%s)"]
+    params = [common_elements]
+    if threshold is not None:
+        conditions.append("percents <= %s")
+        params.append(threshold)
+    if group_id is not None:
+        conditions.append("group_id = %s")
+        params.append(group_id)
+    if department_id is not None:
+        conditions.append("department_id = %s")
+        params.append(department_id)
+    if cursor:
+        conditions.append("(percents, student_id, topic, lecture_id) > (%s, %s, %s, %s)")
+        params.extend(cursors.decode_cursor(cursor))
+    query = f"""
+        SELECT topic, student_id, percents, lecture_id
+        FROM student_lecture_attendance
+        WHERE {' AND '.join(conditions)}
+        ORDER BY percents, student_id, topic, lecture_id
+        LIMIT %s;
+        """
+    params.append(page_size)
+
+    with tracing.span("postgres.low_attendance") as s, conn.cursor() as pg_cursor:
+        pg_cursor.execute(query, params)
+        rows = pg_cursor.fetchall()
+        s.set_attribute("rows", len(rows))
+
+    # Формирование ответа в формате JSON
+    response = []
+    for row in rows:
+        topic = row[0]
+        student_id = row[1]
+        percents = row[2]
+        lecture_id = row[3]
+
+        # Получение информации о студенте из Redis
+        with tracing.span("redis.student") as s:
             student_info = redis_client.get(
                 f'student:{student_id}')  # Предполагается, что данные хранятся по ключу 'student:{id}'
+            s.set_attribute("rows", 1 if student_info else 0)
+        # Redis хранит копию карточек студентов из PostgreSQL
+        metrics.cache_result("redis_student", student_info is not None)
+
+        # Если информация о студенте найдена, добавляем её в ответ
+        if student_info:
+            student_info = decode_student(student_info)  # JSON или msgpack -> словарь
+            response.append({
+                'topic': topic,
+                'student_id': student_id,
+                'percents': percents,
+                'student_info': student_info,
+                'start_date': start_date,
+                'end_date': end_date,
+                'termin':search_term,
+                'cursor': cursors.encode_cursor(percents, student_id, topic, lecture_id)
+            })
 
-            # Если информация о студенте найдена, добавляем её в ответ
-            if student_info:
-                student_info = json.loads(student_info)  # Преобразуем строку JSON в словарь
-                response.append({
-                    'topic': topic,
-                    'student_id': student_id,
-                    'percents': percents,
-                    'student_info': student_info,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'termin':search_term
-                })
+    # Строки без карточки студента пропускаются, поэтому курсор берётся по последней строке сводки
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = cursors.encode_cursor(rows[-1][2], rows[-1][1], rows[-1][0], rows[-1][3])
+    return response, next_cursor
 
-        return response
+
+def export_low_attendance(search_term: str, start_date: str, end_date: str, threshold: Optional[float] = None,
+                          group_id: Optional[int] = None, department_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Весь отчёт по страницам REPORT_MAX_PAGE_SIZE для задания jobs, в собственном подключении."""
+    conn = querylog.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+    conn.autocommit = True
+    try:
+        report, cursor = [], None
+        while True:
+            page, cursor = build_low_attendance_page(conn, search_term, start_date, end_date, threshold,
+                                                     group_id, department_id, REPORT_MAX_PAGE_SIZE, cursor,
+                                                     complete=True)
+            report.extend(page)
+            jobs.progress(len(report))
+            if cursor is None:
+                return report
+    finally:
+        conn.close()
 
 
+class LowAttendanceJob(BaseModel):
+    search_term: str
+    start_date: str
+    end_date: str
+    threshold: Optional[float] = Field(None, ge=0, le=100)
+    group_id: Optional[int] = None
+    department_id: Optional[int] = None
+
+
+@app.post("/jobs/low-attendance", status_code=202)
+def submit_low_attendance(params: LowAttendanceJob, current_user: User = Depends(get_current_user)):
+    # Широкий диапазон дат выгружается целиком в пуле заданий, а не постранично
+    # в обработчике запроса; клиент следит за /jobs/{id} и забирает результат
+    return jobs.submit("low-attendance", export_low_attendance, ["epoch", "catalog", "attendance", "reports"],
+                       search_term=params.search_term, start_date=params.start_date, end_date=params.end_date,
+                       threshold=params.threshold, group_id=params.group_id,
+                       department_id=params.department_id).status()
+
+
+@app.get("/reports/low_attendance/", response_model=List)
+async def get_low_attendance_report(
+    request: Request,
+    outgoing: Response,
+    search_term: str,
+    start_date: str,
+    end_date: str,
+    threshold: Optional[float] = Query(None, ge=0, le=100, description="Только строки с percents не выше порога"),
+    group_id: Optional[int] = None,
+    department_id: Optional[int] = None,
+    page_size: int = Query(REPORT_PAGE_SIZE, ge=1, le=REPORT_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Заголовок X-Next-Cursor предыдущей страницы"),
+    current_user: User = Depends(get_current_user)
+):
+    # Отчёт строится по сводке посещаемости, каталогу и датам лекций из отметок,
+    # 304 отдаётся без запросов к хранилищам
+    tag = dataversion.etag(["epoch", "catalog", "attendance", "reports"])
+    cached = dataversion.not_modified(request, tag)
+    if cached is not None:
+        return cached
+    dataversion.set_headers(outgoing, tag)
+
+    try:
+        report, next_cursor = build_low_attendance_page(pg_conn, search_term, start_date, end_date, threshold,
+                                                        group_id, department_id, page_size, cursor)
+        # Страница может быть пустой (строки без карточек студентов), а отчёт — не закончиться:
+        # конец отчёта — отсутствие X-Next-Cursor, а не пустой список
+        if next_cursor is not None:
+            outgoing.headers["X-Next-Cursor"] = next_cursor
+        return report
+
+    except HTTPException:
+        raise
     except Exception as e:
+        pg_conn.rollback()
         logger.error(f"Error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Service error")
-    finally:
-        cursor.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Service error")
\ No newline at end of file
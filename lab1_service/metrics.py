@@ -0,0 +1,224 @@
+"""Метрики сервиса в текстовом формате Prometheus (GET /metrics).
+
+install(app) подключает middleware и маршрут /metrics:
+
+  * http_requests_total, http_request_duration_seconds — по шаблону маршрута
+    (а не по фактическому пути, чтобы число рядов не росло), методу и статусу;
+  * http_requests_in_flight — запросы, обрабатываемые сейчас;
+  * datastore_call_duration_seconds, datastore_errors_total — по хранилищу и
+    операции; берутся из спанов tracing вида "postgres.courses";
+  * upstream_request_duration_seconds — вызовы lab-сервисов из шлюза (спаны "upstream.lab1");
+  * cache_requests_total — попадания и промахи кэшей (cache_result);
+  * db_pool_connections, db_pool_connections_in_use — пулы соединений
+    (MongoPoolListener для pymongo).
+
+Обновление метрики — словарь под отдельной блокировкой метрики, без
+форматирования строк: текст собирается только при чтении /metrics.
+
+Модуль одинаков во всех сервисах (у каждого сервиса свой Docker-контекст).
+"""
+import bisect
+import threading
+import time
+
+from fastapi.responses import PlainTextResponse
+
+import tracing
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    monitoring = None
+
+# Границы корзин гистограмм длительности, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DATASTORES = ("postgres", "neo4j", "mongo", "redis", "elasticsearch")
+
+REGISTRY = []
+# Функции, вызываемые перед выдачей /metrics (для значений, которые дешевле
+# прочитать при сборе, чем отслеживать на каждом запросе)
+collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        # Счётчики хранятся по корзинам; накопленные суммы считаются при выдаче
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(labels, (list(counts), total)) for labels, (counts, total) in self._values.items()]
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP-запросы по маршруту, методу и статусу",
+                        ("route", "method", "status"))
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                          ("route", "method"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP-запросы в обработке")
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "Время ответа lab-сервиса шлюзу",
+                              ("service", "status"))
+DATASTORE_DURATION = Histogram("datastore_call_duration_seconds", "Время обращения к хранилищу",
+                               ("store", "operation"))
+DATASTORE_ERRORS = Counter("datastore_errors_total", "Обращения к хранилищу, завершившиеся ошибкой",
+                           ("store", "operation"))
+CACHE_REQUESTS = Counter("cache_requests_total", "Обращения к кэшу: result=hit|miss",
+                         ("cache", "result"))
+POOL_CONNECTIONS = Gauge("db_pool_connections", "Открытые соединения пула", ("store",))
+POOL_IN_USE = Gauge("db_pool_connections_in_use", "Выданные из пула соединения", ("store",))
+
+
+def cache_result(cache, hit):
+    CACHE_REQUESTS.inc((cache, "hit" if hit else "miss"))
+
+
+def on_span(span):
+    store, _, operation = span.name.partition(".")
+    if store in DATASTORES:
+        DATASTORE_DURATION.observe((store, operation), span.duration_ms / 1000)
+        if span.error is not None:
+            DATASTORE_ERRORS.inc((store, operation))
+    elif store == "upstream":
+        UPSTREAM_DURATION.observe((operation, span.attributes.get("status", "error")), span.duration_ms / 1000)
+
+
+tracing.span_listeners.append(on_span)
+
+
+if monitoring is not None:
+    class MongoPoolListener(monitoring.ConnectionPoolListener):
+        """Заполняет db_pool_connections{store="mongo"}: MongoClient(event_listeners=[MongoPoolListener()])."""
+
+        labels = ("mongo",)
+
+        def connection_created(self, event):
+            POOL_CONNECTIONS.inc(self.labels)
+
+        def connection_closed(self, event):
+            POOL_CONNECTIONS.dec(self.labels)
+
+        def connection_checked_out(self, event):
+            POOL_IN_USE.inc(self.labels)
+
+        def connection_checked_in(self, event):
+            POOL_IN_USE.dec(self.labels)
+
+        def pool_created(self, event):
+            pass
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            pass
+
+
+def render():
+    for collect in collectors:
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def middleware(request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # Шаблон маршрута FastAPI кладёт в scope при сопоставлении
+        route = request.scope.get("route")
+        route = getattr(route, "path", "unmatched")
+        HTTP_DURATION.observe((route, request.method), time.perf_counter() - start)
+        HTTP_REQUESTS.inc((route, request.method, status))
+
+
+def install(app):
+    def metrics_endpoint():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    app.middleware("http")(middleware)
@@ -0,0 +1,149 @@
+"""Журнал медленных запросов PostgreSQL с планами EXPLAIN.
+
+connect(...) — psycopg2.connect, курсоры которого (LoggedCursor, для словарей
+LoggedRealDictCursor) замеряют каждый execute и copy_expert. Каждый запрос с
+длительностью и параметрами пишется в журнал querylog на уровне DEBUG.
+Запросы дольше SLOW_QUERY_MS попадают в кольцевой буфер slow_queries
+(последние SLOW_QUERY_BUFFER записей), который отдаёт GET /admin/slow-queries.
+
+Для доли SLOW_QUERY_EXPLAIN_SAMPLE медленных SELECT фоновый поток выполняет
+EXPLAIN (ANALYZE, BUFFERS) на отдельном подключении в READ ONLY транзакции
+с statement_timeout и дописывает план в запись буфера. Запрос пользователя
+план не ждёт; если очередь планов занята, план пропускается.
+
+Модуль одинаков во всех lab-сервисах (у каждого сервиса свой Docker-контекст).
+"""
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+from fastapi import APIRouter, Depends, Query
+from psycopg2.extras import RealDictCursor
+
+import admin
+import tracing
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+# Доля медленных запросов, для которых снимается план (0 — не снимать)
+EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", 0.25))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", 100))
+EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 30000))
+PARAMS_MAX_CHARS = 1000
+
+# EXPLAIN ANALYZE выполняет запрос, поэтому план снимается только для чтения
+EXPLAINABLE_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+logger = logging.getLogger("querylog")
+
+slow_queries = deque(maxlen=SLOW_QUERY_BUFFER)
+explain_queue = queue.Queue(maxsize=8)
+_connect_kwargs = {}
+_worker_lock = threading.Lock()
+_worker_started = False
+
+
+def _format_params(params):
+    text = repr(params)
+    return text if len(text) <= PARAMS_MAX_CHARS else text[:PARAMS_MAX_CHARS] + "..."
+
+
+def record(query, params, duration_ms):
+    """Учитывает выполненный запрос; медленный — в буфер и, по выборке, на EXPLAIN."""
+    raw = query if isinstance(query, str) else str(query)
+    # Для журнала запрос в одну строку; в EXPLAIN уходит исходный текст (в нём могут быть комментарии --)
+    query = " ".join(raw.split())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%.1f ms: %s %s", duration_ms, query, _format_params(params))
+    if duration_ms < SLOW_QUERY_MS:
+        return
+
+    entry = {
+        "time": time.time(),
+        "duration_ms": round(duration_ms, 3),
+        "query": query,
+        "params": _format_params(params),
+        "traceparent": tracing.traceparent(),
+        "explain": "not_sampled",
+        "plan": None
+    }
+    logger.warning("Slow query %.1f ms: %s %s", duration_ms, query, entry["params"])
+    if not EXPLAINABLE_RE.match(query):
+        entry["explain"] = "not_select"
+    elif random.random() < EXPLAIN_SAMPLE:
+        try:
+            explain_queue.put_nowait((entry, raw, params))
+            entry["explain"] = "pending"
+        except queue.Full:
+            entry["explain"] = "dropped"
+    slow_queries.append(entry)
+
+
+class LoggedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        result = super().execute(query, vars)
+        record(query, vars, (time.perf_counter() - start) * 1000)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        result = super().copy_expert(sql, file, size)
+        record(sql, None, (time.perf_counter() - start) * 1000)
+        return result
+
+
+class LoggedCursor(LoggedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class LoggedRealDictCursor(LoggedCursorMixin, RealDictCursor):
+    pass
+
+
+def _explain_loop():
+    conn = None
+    while True:
+        entry, query, params = explain_queue.get()
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(**_connect_kwargs)
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION READ ONLY")
+                cur.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+                entry["plan"] = cur.fetchone()[0]
+            entry["explain"] = "done"
+        except Exception as e:
+            entry["explain"] = f"error: {str(e).strip()}"
+        finally:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+
+
+def connect(**kwargs):
+    """psycopg2.connect с замеряющими курсорами; параметры запоминаются для подключения EXPLAIN."""
+    global _worker_started
+    _connect_kwargs.update(kwargs)
+    with _worker_lock:
+        if not _worker_started:
+            threading.Thread(target=_explain_loop, name="slow-query-explain", daemon=True).start()
+            _worker_started = True
+    return psycopg2.connect(cursor_factory=LoggedCursor, **kwargs)
+
+
+router = APIRouter()
+
+
+@router.get("/admin/slow-queries", dependencies=[Depends(admin.require_admin)])
+def get_slow_queries(limit: int = Query(SLOW_QUERY_BUFFER, ge=1, le=SLOW_QUERY_BUFFER)):
+    """Последние медленные запросы, новые первыми."""
+    entries = list(slow_queries)
+    entries.reverse()
+    return {"threshold_ms": SLOW_QUERY_MS, "queries": entries[:limit]}
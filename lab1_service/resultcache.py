@@ -0,0 +1,103 @@
+"""Общий для реплик кэш промежуточных результатов в Redis (второй уровень).
+
+    @resultcache.cached("courses", lambda group_name: ["epoch", "catalog"])
+    def get_courses(group_name): ...
+
+Результат функции хранится в rcache:<имя>:<хэш аргументов> вместе с версиями
+его тегов на момент вычисления. Теги — области версий данных (dataversion):
+"epoch", "catalog", "attendance", "group:<имя>", "semester:<год>:<n>".
+Запись, у которой хотя бы одна версия тега устарела, считается промахом, поэтому
+sync_worker и потребитель ingest инвалидируют кэш сами. Сбросить всё под тегом
+вручную можно одной операцией — invalidate (POST /admin/result-cache/invalidate).
+
+Версии берутся из копии в памяти, поэтому попадание стоит одного GET. Версии
+снимаются до вычисления: результат, посчитанный во время изменения данных,
+записывается со старыми версиями и не будет выдан. Пока версии не загружены или
+Redis недоступен, функции вызываются напрямую. Попадания и промахи считаются
+в cache_requests_total{cache="result.<имя>"}.
+
+Redis общий для всех сервисов, поэтому имя кэша должно быть уникально среди
+них. Значения сериализуются в JSON: кортежи возвращаются списками, ключи словарей —
+строками, поэтому кэшируются функции, результат которых это переживает.
+
+Модуль одинаков в lab1, lab2 и lab3 (у каждого сервиса свой Docker-контекст).
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+from typing import List
+
+import redis
+from fastapi import APIRouter, Depends, Query
+
+import admin
+import dataversion
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL_S = int(os.getenv("RESULT_CACHE_TTL_S", 600))
+
+redis_conn = redis.Redis(host="redis", port=6379, db=0, decode_responses=True)
+
+
+def _key(name, args):
+    digest = hashlib.sha1(json.dumps(args, default=str).encode()).hexdigest()
+    return f"rcache:{name}:{digest}"
+
+
+def get_or_compute(name, tags, fn, args):
+    """Результат fn(*args) из кэша или вычисленный и сохранённый под тегами tags."""
+    stamp = dataversion.current(tags) if RESULT_CACHE_ENABLED else None
+    if stamp is None:
+        return fn(*args)
+
+    key = _key(name, args)
+    raw = None
+    try:
+        with tracing.span("redis.result_cache", cache=name) as s:
+            raw = redis_conn.get(key)
+            s.set_attribute("rows", 1 if raw is not None else 0)
+    except redis.RedisError as e:
+        logger.warning(f"Кэш результатов недоступен: {e}")
+    if raw is not None:
+        entry = json.loads(raw)
+        if entry["tags"] == stamp:
+            metrics.cache_result(f"result.{name}", True)
+            return entry["value"]
+    metrics.cache_result(f"result.{name}", False)
+
+    raw = json.dumps({"tags": stamp, "value": fn(*args)}, ensure_ascii=False, default=str)
+    try:
+        redis_conn.set(key, raw, ex=RESULT_CACHE_TTL_S)
+    except redis.RedisError as e:
+        logger.warning(f"Кэш результатов недоступен: {e}")
+    # Промах возвращает то же, что вернёт попадание: значение после JSON
+    return json.loads(raw)["value"]
+
+
+def cached(name, tags):
+    """Декоратор: tags(*args) — теги, от которых зависит результат вызова."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            return get_or_compute(name, tags(*args), fn, args)
+        return wrapper
+    return decorate
+
+
+def invalidate(tags):
+    """Делает устаревшими все записи под tags (и ETag зависящих от них отчётов)."""
+    return dataversion.bump(tags)
+
+
+router = APIRouter()
+
+
+@router.post("/admin/result-cache/invalidate", dependencies=[Depends(admin.require_admin)])
+def invalidate_tags(tag: List[str] = Query(..., description="Тег, например group:SRSE-767")):
+    return {"tags": sorted(set(tag)), "version": invalidate(tag)}
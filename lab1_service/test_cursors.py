@@ -0,0 +1,47 @@
+import base64
+import json
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+import cursors
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def test_round_trip_keeps_sort_key():
+    cursor = cursors.encode_cursor(Decimal("33.33"), 17, "Базы данных", 5)
+    assert cursors.decode_cursor(cursor) == (Decimal("33.33"), 17, "Базы данных", 5)
+
+
+def test_round_trip_keeps_decimal_precision():
+    percents = Decimal("66.666666666666666667")
+    assert cursors.decode_cursor(cursors.encode_cursor(percents, 1, "t", 2))[0] == percents
+
+
+def test_cursor_is_url_safe():
+    cursor = cursors.encode_cursor(Decimal("0"), 1, "???>>>", 2)
+    assert not set(cursor) & {"+", "/"}
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    raw_cursor("12.5"),
+    raw_cursor(["12.5", 1, "t"]),
+    raw_cursor(["12.5", 1, "t", 2, 3]),
+    raw_cursor(["abc", 1, "t", 2]),
+    raw_cursor(["NaN", 1, "t", 2]),
+    raw_cursor(["Infinity", 1, "t", 2]),
+    raw_cursor(["12.5", None, "t", 2]),
+    raw_cursor(["12.5", "x", "t", 2]),
+    raw_cursor(["12.5", 1, "t", [2]]),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        cursors.decode_cursor(cursor)
+    assert error.value.status_code == 400
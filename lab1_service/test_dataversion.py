@@ -0,0 +1,69 @@
+import pytest
+from fastapi import Request, Response
+
+import dataversion
+
+TAG = 'W/"0123456789abcdef"'
+
+
+def request(if_none_match=None):
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+@pytest.mark.parametrize("header", [
+    TAG,
+    '"0123456789abcdef"',                          # сильная форма того же тега
+    'W/"other", W/"0123456789abcdef"',
+    ' W/"other" ,W/"0123456789abcdef" ',
+    '"other","0123456789abcdef"',
+    "*",
+])
+def test_matching_if_none_match_gives_304(header):
+    response = dataversion.not_modified(request(header), TAG)
+    assert response.status_code == 304
+    assert response.headers["etag"] == TAG
+    assert response.headers["cache-control"] == "no-cache"
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    'W/"other"',
+    'W/"0123456789abcde"',                         # префикс тега
+    'W/"0123456789abcdef0"',
+    '0123456789abcdef',                            # без кавычек
+])
+def test_other_if_none_match_gives_full_response(header):
+    assert dataversion.not_modified(request(header), TAG) is None
+
+
+def test_no_tag_never_gives_304():
+    assert dataversion.not_modified(request("*"), None) is None
+
+
+def test_etag_is_weak_and_follows_versions(monkeypatch):
+    versions = {"epoch": "1", "group:A": "5"}
+    monkeypatch.setattr(dataversion, "current", lambda scopes: {scope: versions.get(scope, "0") for scope in scopes})
+    tag = dataversion.etag(["epoch", "group:A"])
+    assert tag.startswith('W/"') and tag.endswith('"')
+    assert dataversion.etag(["epoch", "group:A"]) == tag
+    versions["group:A"] = "6"
+    bumped = dataversion.etag(["epoch", "group:A"])
+    assert bumped != tag
+    # Версии других областей на ETag не влияют
+    versions["group:B"] = "9"
+    assert dataversion.etag(["epoch", "group:A"]) == bumped
+
+
+def test_etag_is_absent_until_versions_load(monkeypatch):
+    monkeypatch.setattr(dataversion, "current", lambda scopes: None)
+    assert dataversion.etag(["epoch"]) is None
+
+
+def test_set_headers_skips_missing_tag():
+    response = Response()
+    dataversion.set_headers(response, None)
+    assert "etag" not in response.headers
+    dataversion.set_headers(response, TAG)
+    assert response.headers["etag"] == TAG and response.headers["cache-control"] == "no-cache"
@@ -0,0 +1,239 @@
+"""Трассировка запросов: контекст W3C traceparent, спаны и заголовок Server-Timing.
+
+install(app, service) подключает middleware: оно продолжает трассу из
+входящего traceparent (или начинает новую), открывает корневой спан запроса,
+а в ответ добавляет Server-Timing с суммарным временем спанов по именам и
+traceparent корневого спана. Обращения к хранилищам оборачиваются в
+
+    with tracing.span("postgres.courses") as s:
+        ...
+        s.set_attribute("rows", len(rows))
+
+Готовые спаны запроса передаются экспортёру в фоновом потоке. Экспортёр
+выбирается переменной TRACE_EXPORTER: none (по умолчанию), console (журнал),
+file (JSONL в TRACE_FILE) или "модуль:класс" — любой объект с методом
+export(spans). Заголовок Server-Timing выдаётся и без экспортёра.
+
+Модуль одинаков во всех сервисах (у каждого сервиса свой Docker-контекст).
+"""
+import contextvars
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+logger = logging.getLogger("tracing")
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+# Символы, недопустимые в имени метрики Server-Timing (token из RFC 7230)
+NON_TOKEN_RE = re.compile(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]")
+
+service_name = "service"
+_trace = contextvars.ContextVar("trace", default=None)
+_current = contextvars.ContextVar("current_span", default=None)
+
+# Функции, вызываемые для каждого завершённого спана (в том числе вне запросов)
+span_listeners = []
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "duration_ms", "error", "_t0")
+
+    def __init__(self, trace_id, parent_id, name, attributes):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration_ms = None
+        self.error = None
+        self._t0 = time.perf_counter()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+
+    def to_dict(self):
+        return {
+            "service": service_name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Trace:
+    """Спаны одного запроса и дополнительные записи Server-Timing (например, от upstream)."""
+
+    def __init__(self, trace_id, parent_id):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.spans = []
+        self.timings = []
+
+
+# ----- Экспорт -----
+
+class ConsoleExporter:
+    # Печать напрямую в stdout: уровень журнала uvicorn по умолчанию скрыл бы INFO
+    def export(self, spans):
+        for s in spans:
+            print(json.dumps(s.to_dict(), ensure_ascii=False, default=str), flush=True)
+
+
+class FileExporter:
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class NoopExporter:
+    def export(self, spans):
+        pass
+
+
+EXPORTERS = {
+    "console": ConsoleExporter,
+    "file": FileExporter,
+    "none": NoopExporter,
+}
+
+
+def load_exporter(name):
+    if ":" in name:
+        module, attr = name.split(":", 1)
+        return getattr(importlib.import_module(module), attr)()
+    return EXPORTERS[name]()
+
+
+exporter = load_exporter(TRACE_EXPORTER)
+export_queue = queue.Queue(maxsize=10000)
+
+
+def _export_loop():
+    while True:
+        spans = export_queue.get()
+        try:
+            exporter.export(spans)
+        except Exception as e:
+            logger.error(f"Trace export failed: {e}")
+
+
+threading.Thread(target=_export_loop, name="trace-export", daemon=True).start()
+
+
+# ----- Спаны -----
+
+@contextmanager
+def span(name, **attributes):
+    """Спан вокруг операции; вне запроса спан только передаётся span_listeners."""
+    trace = _trace.get()
+    parent = _current.get()
+    s = Span(trace.trace_id if trace else None,
+             parent.span_id if parent else (trace.parent_id if trace else None),
+             name, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.error = repr(e)
+        raise
+    finally:
+        s.finish()
+        _current.reset(token)
+        if trace is not None:
+            trace.spans.append(s)
+        for listener in span_listeners:
+            listener(s)
+
+
+def parse_traceparent(value):
+    match = TRACEPARENT_RE.match(value or "")
+    if not match or match.group(1) == "0" * 32:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def traceparent():
+    """Заголовок traceparent для исходящего запроса из текущего спана."""
+    trace = _trace.get()
+    current = _current.get()
+    if trace is None or current is None:
+        return None
+    return f"00-{trace.trace_id}-{current.span_id}-01"
+
+
+def add_server_timing(header, prefix):
+    """Добавляет к Server-Timing ответа записи чужого заголовка с префиксом (prefix.name)."""
+    trace = _trace.get()
+    if trace is None or not header:
+        return
+    for entry in header.split(","):
+        entry = entry.strip()
+        if entry and not entry.startswith("total;"):
+            trace.timings.append(f"{prefix}.{entry}")
+
+
+def server_timing(trace, root):
+    totals = {}
+    for s in trace.spans:
+        if s is root:
+            continue
+        total, calls = totals.get(s.name, (0.0, 0))
+        totals[s.name] = (total + s.duration_ms, calls + 1)
+    entries = []
+    for name, (total, calls) in totals.items():
+        desc = f';desc="{calls} calls"' if calls > 1 else ""
+        entries.append(f"{NON_TOKEN_RE.sub('_', name)}{desc};dur={total:.1f}")
+    entries.extend(trace.timings)
+    entries.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(entries)
+
+
+async def middleware(request, call_next):
+    trace_id, parent_id = parse_traceparent(request.headers.get("traceparent"))
+    trace = Trace(trace_id or secrets.token_hex(16), parent_id)
+    token = _trace.set(trace)
+    try:
+        with span(f"{request.method} {request.url.path}", service=service_name) as root:
+            response = await call_next(request)
+            root.set_attribute("status", response.status_code)
+    finally:
+        _trace.reset(token)
+    response.headers["Server-Timing"] = server_timing(trace, root)
+    response.headers["traceparent"] = f"00-{trace.trace_id}-{root.span_id}-01"
+    if isinstance(exporter, NoopExporter):
+        return response
+    try:
+        export_queue.put_nowait(trace.spans)
+    except queue.Full:
+        # Экспорт не должен тормозить запросы: при отставании экспортёра трасса теряется
+        pass
+    return response
+
+
+def install(app, service):
+    global service_name
+    service_name = service
+    app.middleware("http")(middleware)
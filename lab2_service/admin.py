@@ -0,0 +1,25 @@
+"""Доступ к служебным маршрутам /admin/*.
+
+Запрос должен нести заголовок X-Admin-Token, совпадающий с переменной
+ADMIN_TOKEN. Если ADMIN_TOKEN не задан, служебные маршруты отключены (404).
+
+Модуль одинаков во всех lab-сервисах (у каждого сервиса свой Docker-контекст).
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
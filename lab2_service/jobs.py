@@ -0,0 +1,224 @@
+"""Асинхронные задания для долгих выгрузок отчётов.
+
+    POST /jobs/<отчёт>        параметры отчёта в теле -> 202 и состояние задания
+    GET  /jobs/{id}           состояние и прогресс
+    GET  /jobs/{id}/events    то же потоком Server-Sent Events до завершения задания
+    GET  /jobs/{id}/result    готовый отчёт (JSON-файл)
+
+Задания выполняются в собственном пуле из REPORT_JOB_WORKERS потоков, а не в
+пуле обработчиков запросов, поэтому выгрузки не занимают интерактивные отчёты.
+Сверх работающих в очереди ждут не больше REPORT_JOB_MAX_QUEUED заданий,
+дальше — 503 с Retry-After. Id задания — хэш отчёта, параметров и текущих
+версий данных отчёта (dataversion): повторная отправка тех же параметров
+возвращает уже существующее задание, пока оно ждёт, выполняется или его
+результат не устарел по TTL; упавшее задание запускается заново. После
+изменения данных отчёта те же параметры запускают новое задание.
+
+Результат пишется в REPORT_JOB_DIR и хранится REPORT_JOB_TTL_S секунд после
+завершения. Состояние заданий живёт в памяти процесса: задание видно только
+в своей реплике, а при перезапуске сервиса старые результаты удаляются.
+
+Модуль одинаков в lab1 и lab2 (у каждого сервиса свой Docker-контекст).
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
+
+import dataversion
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", 2))
+REPORT_JOB_MAX_QUEUED = int(os.getenv("REPORT_JOB_MAX_QUEUED", 16))
+REPORT_JOB_TTL_S = int(os.getenv("REPORT_JOB_TTL_S", 3600))
+REPORT_JOB_DIR = os.getenv("REPORT_JOB_DIR", "/tmp/report-jobs")
+# Как часто поток событий проверяет состояние задания
+EVENTS_INTERVAL = 0.5
+FINISHED = ("done", "failed")
+
+JOBS = metrics.Counter("report_jobs_total",
+                       "Задания отчётов: result=submitted|deduplicated|rejected|done|failed",
+                       ("report", "result"))
+JOBS_ACTIVE = metrics.Gauge("report_jobs", "Задания отчётов по состоянию", ("state",))
+
+_jobs = {}
+_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix="report-job")
+_current = contextvars.ContextVar("report_job", default=None)
+
+
+class Job:
+    def __init__(self, job_id, report, params):
+        self.id = job_id
+        self.report = report
+        self.params = params
+        self.state = "queued"
+        self.done = 0
+        self.total = None
+        self.rows = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def path(self):
+        return os.path.join(REPORT_JOB_DIR, f"{self.id}.json")
+
+    def expired(self, now):
+        return self.finished is not None and now - self.finished > REPORT_JOB_TTL_S
+
+    def status(self):
+        status = {
+            "id": self.id,
+            "report": self.report,
+            "params": self.params,
+            "state": self.state,
+            "progress": {"done": self.done, "total": self.total},
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if self.state == "done":
+            status["rows"] = self.rows
+            status["result"] = f"/jobs/{self.id}/result"
+            status["expires"] = self.finished + REPORT_JOB_TTL_S
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+def progress(done, total=None):
+    """Прогресс текущего задания (строки, страницы, ...); вне задания ничего не делает."""
+    job = _current.get()
+    if job is not None:
+        job.done = done
+        if total is not None:
+            job.total = total
+
+
+def _run(job, fn):
+    token = _current.set(job)
+    job.state = "running"
+    try:
+        with tracing.span(f"job.{job.report}"):
+            result = jsonable_encoder(fn(**job.params))
+        # Файл появляется целиком: скачивание не увидит недописанный отчёт
+        with open(f"{job.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(f"{job.path}.tmp", job.path)
+        job.rows = len(result) if isinstance(result, list) else None
+        if job.total is not None:
+            job.done = job.total
+        # status() читает задание без блокировки: время завершения ставится раньше состояния
+        job.finished = time.time()
+        job.state = "done"
+    except Exception as e:
+        # HTTPException отчёта (404, 500) сохраняет своё описание
+        job.error = str(getattr(e, "detail", None) or e)
+        job.finished = time.time()
+        job.state = "failed"
+        logger.error(f"Report job {job.id} ({job.report}) failed: {job.error}")
+    finally:
+        _current.reset(token)
+        JOBS.inc((job.report, job.state))
+
+
+def _prune(now):
+    """Удаляет устаревшие задания и их файлы; вызывается под _lock."""
+    for job in [job for job in _jobs.values() if job.expired(now)]:
+        del _jobs[job.id]
+        if os.path.exists(job.path):
+            os.remove(job.path)
+
+
+def submit(report, fn, scopes, **params):
+    """Ставит fn(**params) в очередь или возвращает такое же задание над теми же версиями scopes."""
+    versions = dataversion.current(scopes)
+    job_id = hashlib.sha1(json.dumps([report, params, versions], sort_keys=True, default=str).encode()).hexdigest()[:16]
+    with _lock:
+        _prune(time.time())
+        job = _jobs.get(job_id)
+        if job is not None and job.state != "failed":
+            JOBS.inc((report, "deduplicated"))
+            return job
+        pending = sum(1 for j in _jobs.values() if j.state not in FINISHED)
+        if pending >= REPORT_JOB_WORKERS + REPORT_JOB_MAX_QUEUED:
+            JOBS.inc((report, "rejected"))
+            raise HTTPException(status_code=503, detail="Report job queue is full", headers={"Retry-After": "30"})
+        job = _jobs[job_id] = Job(job_id, report, params)
+    _pool.submit(_run, job, fn)
+    JOBS.inc((report, "submitted"))
+    return job
+
+
+def get_job(job_id):
+    with _lock:
+        _prune(time.time())
+        job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def collect():
+    with _lock:
+        states = [job.state for job in _jobs.values()]
+    for state in ("queued", "running") + FINISHED:
+        JOBS_ACTIVE.set((state,), states.count(state))
+
+
+metrics.collectors.append(collect)
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).status()
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = get_job(job_id)
+
+    async def stream():
+        last = None
+        while True:
+            status = job.status()
+            if status != last:
+                yield f"event: {status['state']}\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+                last = status
+            # Решение по снимку, который уже отправлен: последнее событие — итоговое
+            if status["state"] in FINISHED:
+                return
+            await asyncio.sleep(EVENTS_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if job.state == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.state != "done":
+        raise HTTPException(status_code=409, detail="Job is not finished yet")
+    return FileResponse(job.path, media_type="application/json", filename=f"{job.report}-{job.id}.json")
+
+
+# Состояние прежнего процесса потеряно, его результаты уже не найти
+os.makedirs(REPORT_JOB_DIR, exist_ok=True)
+for name in os.listdir(REPORT_JOB_DIR):
+    if name.endswith((".json", ".json.tmp")):
+        os.remove(os.path.join(REPORT_JOB_DIR, name))
@@ -1,12 +1,21 @@
 import datetime
 import logging
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from typing import List, Dict, Any
-import psycopg2
+from pydantic import BaseModel, Field
 from neo4j import GraphDatabase
 from pymongo import MongoClient
 import os
 
+import dataversion
+import jobs
+import metrics
+import profiler
+import querylog
+import resultcache
+import singleflight
+import tracing
+
 # Настройка логгера
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -18,9 +27,15 @@ logging.basicConfig(
 
 # Init FastAPI
 app = FastAPI()
+tracing.install(app, "lab2")
+metrics.install(app)
+profiler.install(app)
+app.include_router(querylog.router)
+app.include_router(resultcache.router)
+app.include_router(jobs.router)
 
 # Подключение к PostgreSQL
-pg_conn = psycopg2.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
+pg_conn = querylog.connect(host="postgres", port="5432", database="university_db", user="user", password="password")
 pg_conn.autocommit = True
 
 # Подключение к Neo4j
@@ -28,15 +43,83 @@ pg_conn.autocommit = True
 neo4j_driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "password"))
 
 # Подключение к MongoDB
-mongo_client = MongoClient(f"mongodb://mongo:27017/")
+mongo_client = MongoClient(f"mongodb://mongo:27017/", event_listeners=[metrics.MongoPoolListener()])
 mongo_db = mongo_client['university']
 
 
 @app.get("/auditorium-requirements", response_model=List[Dict[str, Any]])
 async def get_auditorium_requirements(
+        request: Request,
+        outgoing: Response,
         year: int = Query(..., description="Год обучения"),
-        semester: int = Query(..., description="Семестр (1 или 2)")
+        # Другие номера посчитались бы как весенний семестр под областью версий, которую никто не сдвигает
+        semester: int = Query(..., ge=1, le=2, description="Семестр (1 или 2)")
 ) -> List[Dict[str, Any]]:
+    # Отчёт меняется только вместе с версиями его данных, 304 отдаётся без запросов к хранилищам
+    tag = dataversion.etag(["epoch", "catalog", f"semester:{year}:{semester}"])
+    cached = dataversion.not_modified(request, tag)
+    if cached is not None:
+        return cached
+    dataversion.set_headers(outgoing, tag)
+    # Одинаковые одновременные запросы семестра считаются один раз, в пуле потоков
+    return await singleflight.flights.do(singleflight.key("auditorium-requirements", tag, year=year, semester=semester),
+                                         build_auditorium_requirements, year, semester)
+
+
+class AuditoriumRequirementsJob(BaseModel):
+    year: int = Field(..., description="Год обучения")
+    semester: int = Field(..., ge=1, le=2, description="Семестр (1 или 2)")
+
+
+@app.post("/jobs/auditorium-requirements", status_code=202)
+def submit_auditorium_requirements(params: AuditoriumRequirementsJob) -> Dict[str, Any]:
+    # Весь семестр университета может считаться дольше таймаутов прокси и клиента:
+    # отчёт считается в пуле заданий, клиент следит за /jobs/{id} и забирает результат
+    return jobs.submit("auditorium-requirements", build_auditorium_requirements,
+                       ["epoch", "catalog", f"semester:{params.year}:{params.semester}"],
+                       year=params.year, semester=params.semester).status()
+
+
+# Число студентов и оргструктура меняются только вместе с каталогом и общие для
+# всех семестров и реплик (resultcache)
+@resultcache.cached("lecture_students", lambda lecture_id: ["epoch", "catalog"])
+def count_students(lecture_id: int) -> int:
+    """Число студентов групп, у которых есть занятия лекции, по графу Neo4j."""
+    with tracing.span("neo4j.student_count") as s, neo4j_driver.session() as session:
+        student_count = session.run("""
+            MATCH (l:Lecture {id: $lecture_id})<-[:HAS_SCHEDULE]-(g:Group)
+            MATCH (s:Student)-[:BELONGS_TO]->(g)
+            RETURN count(DISTINCT s) as student_count
+        """, lecture_id=lecture_id).single()["student_count"]
+        s.set_attribute("rows", 1)
+    return student_count
+
+
+@resultcache.cached("department_institute", lambda department_id: ["epoch", "catalog"])
+def get_org_info(department_id: int) -> Dict[str, str]:
+    """Институт и университет кафедры из MongoDB."""
+    with tracing.span("mongo.university") as s:
+        org_info = mongo_db.university.find_one(
+            {"institutes.departments.id": department_id},
+            {"name": 1, "institutes.name": 1, "institutes.departments": 1}
+        )
+        s.set_attribute("rows", 1 if org_info else 0)
+
+    institute_name = ""
+    university_name = ""
+    if org_info:
+        university_name = org_info.get("name", "")
+        for inst in org_info.get("institutes", []):
+            for dept in inst.get("departments", []):
+                if dept.get("id") == department_id:
+                    institute_name = inst.get("name", "")
+                    break
+            if institute_name:
+                break
+    return {"institute": institute_name, "university": university_name}
+
+
+def build_auditorium_requirements(year: int, semester: int) -> List[Dict[str, Any]]:
     try:
         # Определяем период семестра
         if semester == 1:
@@ -46,8 +129,13 @@ async def get_auditorium_requirements(
             start_date = datetime.date(year, 2, 1)  # Весенний семестр
             end_date = datetime.date(year, 6, 30)
 
+        # Границы по week_start отсекают лишние недельные партиции attendance,
+        # а диапазон по attendance_date без приведения типа использует BRIN-индекс
+        first_week = start_date - datetime.timedelta(days=start_date.weekday())
+        end_exclusive = end_date + datetime.timedelta(days=1)
+
         # 1. Получаем базовую информацию о курсах и лекциях из PostgreSQL
-        with pg_conn.cursor() as cur:
+        with tracing.span("postgres.lectures") as s, pg_conn.cursor() as cur:
             cur.execute("""
                         SELECT DISTINCT lc.id  AS course_id,
                                         lc.name  AS course_name,
@@ -65,46 +153,29 @@ async def get_auditorium_requirements(
                                  JOIN departments d ON lc.department_id = d.id
                                  JOIN schedule s ON s.lecture_id = l.id
                                  JOIN attendance a ON a.schedule_id = s.id
-                        WHERE a.attendance_date::date BETWEEN %s AND %s
+                        WHERE a.week_start BETWEEN %s AND %s
+                          AND a.attendance_date >= %s AND a.attendance_date < %s
                           AND l.tech_requirements IS NOT NULL
                         GROUP BY lc.id, lc.name, l.id, l.topic,
                                  l.tech_requirements, l.is_special, d.id, d.name,
                                  s.auditorium, s.capacity
                         ORDER BY MIN(a.attendance_date)::date
-                        """, (start_date, end_date))
+                        """, (first_week, end_date, start_date, end_exclusive))
 
             lectures_data = cur.fetchall()
+            s.set_attribute("rows", len(lectures_data))
 
         result = []
         for (course_id, course_name, lecture_id, topic, tech_requirements,
              is_special, lecture_date, department_id, department_name,
              auditorium, capacity) in lectures_data:
+            jobs.progress(len(result), len(lectures_data))
 
             # 2. Получаем количество студентов из Neo4j
-            with neo4j_driver.session() as session:
-                student_count = session.run("""
-                    MATCH (l:Lecture {id: $lecture_id})<-[:HAS_SCHEDULE]-(g:Group)
-                    MATCH (s:Student)-[:BELONGS_TO]->(g)
-                    RETURN count(DISTINCT s) as student_count
-                """, lecture_id=lecture_id).single()["student_count"]
+            student_count = count_students(lecture_id)
 
             # 3. Получаем информацию об университете из MongoDB
-            org_info = mongo_db.university.find_one(
-                {"institutes.departments.id": department_id},
-                {"name": 1, "institutes.name": 1, "institutes.departments": 1}
-            )
-
-            institute_name = ""
-            university_name = ""
-            if org_info:
-                university_name = org_info.get("name", "")
-                for inst in org_info.get("institutes", []):
-                    for dept in inst.get("departments", []):
-                        if dept.get("id") == department_id:
-                            institute_name = inst.get("name", "")
-                            break
-                    if institute_name:
-                        break
+            org_info = get_org_info(department_id)
 
             # Рассчитываем требуемую вместимость с запасом 10%
             required_capacity = int(student_count * 1.1)
@@ -114,8 +185,8 @@ async def get_auditorium_requirements(
                     "course_id": course_id,
                     "course_name": course_name,
                     "department": department_name,
-                    "institute": institute_name,
-                    "university": university_name
+                    "institute": org_info["institute"],
+                    "university": org_info["university"]
                 },
                 "lecture_info": {
                     "lecture_id": lecture_id,
@@ -136,5 +207,5 @@ async def get_auditorium_requirements(
         return result
 
     except Exception as e:
-        logger.error(f"Error in get_auditorium_requirements: {str(e)}")
+        logger.error(f"Error in build_auditorium_requirements: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""Версии данных отчётов и ETag (If-None-Match -> 304).
+
+Генератор и sync_worker (generate_data) после применения изменений ко всем
+хранилищам сдвигают версии в хэше Redis data:versions и публикуют их в канал
+data:versions. Области версий:
+
+    epoch                  полная загрузка или восстановление снимка
+    catalog                любые таблицы, кроме attendance
+    attendance             любые отметки посещаемости
+    reports                пересчёт сводки посещаемости (отчёт lab1)
+    group:<имя>            отметки посещаемости группы (отчёт lab3)
+    semester:<год>:<1|2>   отметки посещаемости семестра (отчёт lab2)
+
+Фоновый поток держит копию хэша в памяти: подписывается на канал, затем
+читает хэш целиком и дальше применяет опубликованные изменения. Поэтому
+ETag считается без обращения к хранилищам, и ответ 304 не стоит ни одного
+запроса. Пока копия не загружена (Redis недоступен), ETag не выдаётся.
+
+Модуль одинаков в lab1, lab2 и lab3 (у каждого сервиса свой Docker-контекст).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import redis
+from fastapi import Request, Response
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSIONS_KEY = "data:versions"
+DATA_VERSIONS_SEQ_KEY = "data:versions:seq"
+DATA_VERSIONS_CHANNEL = "data:versions"
+RECONNECT_DELAY = 1
+# Тот же скрипт, что generate_data/main.py DATA_VERSION_SCRIPT
+DATA_VERSION_SCRIPT = """
+local now = redis.call('TIME')
+local floor = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local seq = redis.call('INCR', KEYS[2])
+if seq < floor then
+    seq = floor
+    redis.call('SET', KEYS[2], seq)
+end
+local changed = {}
+for _, scope in ipairs(ARGV) do
+    redis.call('HSET', KEYS[1], scope, seq)
+    changed[scope] = seq
+end
+redis.call('PUBLISH', KEYS[3], cjson.encode(changed))
+return seq
+"""
+
+redis_conn = redis.Redis(host="redis", port=6379, db=0, decode_responses=True)
+
+versions = {}
+_ready = threading.Event()
+
+
+def _listen():
+    while True:
+        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        try:
+            # Подписка раньше чтения хэша: сдвиг между ними не потеряется
+            pubsub.subscribe(DATA_VERSIONS_CHANNEL)
+            versions.clear()
+            versions.update(redis_conn.hgetall(DATA_VERSIONS_KEY))
+            _ready.set()
+            for message in pubsub.listen():
+                changed = json.loads(message["data"])
+                versions.update({scope: str(seq) for scope, seq in changed.items()})
+        except redis.RedisError as e:
+            _ready.clear()
+            logger.warning(f"Версии данных недоступны: {e}")
+            time.sleep(RECONNECT_DELAY)
+        finally:
+            pubsub.close()
+
+
+def current(scopes: List[str]) -> Optional[Dict[str, str]]:
+    """Текущие версии scopes; None, пока версии не загружены."""
+    if not _ready.is_set():
+        return None
+    return {scope: versions.get(scope, "0") for scope in scopes}
+
+
+def etag(scopes: List[str]) -> Optional[str]:
+    """Слабый ETag ответа, зависящего от scopes; None, пока версии не загружены."""
+    state = current(scopes)
+    if state is None:
+        return None
+    state = "|".join(f"{scope}={version}" for scope, version in state.items())
+    return f'W/"{hashlib.sha1(state.encode()).hexdigest()[:16]}"'
+
+
+def not_modified(request: Request, tag: Optional[str]) -> Optional[Response]:
+    """Ответ 304, если If-None-Match совпадает с tag, иначе None."""
+    if tag is None:
+        return None
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    # Слабое сравнение (RFC 9110): префикс W/ не учитывается
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    if "*" in candidates or tag.removeprefix("W/") in candidates:
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+    return None
+
+
+def set_headers(response: Response, tag: Optional[str]):
+    if tag is not None:
+        response.headers["ETag"] = tag
+        # Клиент может хранить ответ, но каждый раз перепроверяет его по ETag
+        response.headers["Cache-Control"] = "no-cache"
+
+
+def bump(scopes) -> Optional[int]:
+    """Сдвигает версии scopes (для изменений, применяемых самим сервисом); возвращает новый номер."""
+    scopes = sorted(scopes)
+    if scopes:
+        return redis_conn.eval(DATA_VERSION_SCRIPT, 3, DATA_VERSIONS_KEY, DATA_VERSIONS_SEQ_KEY,
+                        DATA_VERSIONS_CHANNEL, *scopes)
+    return None
+
+
+def semester_scope(day) -> Optional[str]:
+    """Область отчёта lab2 по дню: осенний семестр — сентябрь–декабрь, весенний — февраль–июнь."""
+    if day.month >= 9:
+        return f"semester:{day.year}:1"
+    if 2 <= day.month <= 6:
+        return f"semester:{day.year}:2"
+    return None
+
+
+threading.Thread(target=_listen, name="data-versions", daemon=True).start()
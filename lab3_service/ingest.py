@@ -0,0 +1,313 @@
+"""Пакетный приём отметок посещаемости.
+
+POST /attendance/batch записывает пачку отметок в attendance одним COPY
+(PostgreSQL сам раскладывает строки по недельным партициям, строки вне
+созданных недель попадают в attendance_default) и кладёт пачку в поток
+Redis attendance:ingest. Производные обновления — узлы занятий Schedule в Neo4j,
+даты лекций в документах материалов Elasticsearch и счётчики отметок
+студентов в Redis — выполняет фоновый потребитель,
+поэтому время ответа не зависит от самого медленного хранилища. После
+применения пачки потребитель сдвигает версии групп и семестров её отметок
+(dataversion), не дожидаясь sync_worker.
+
+COPY пишет отметки в sync_outbox в той же транзакции, поэтому поток — только
+быстрый путь: Neo4j, Elasticsearch, сводку отчёта lab1 и версии данных
+sync_worker доводит по журналу и тогда, когда пачка не попала в поток (Redis
+недоступен после COMMIT) или ушла в очередь недоставленных. Повторное
+применение идемпотентно. Счётчики студентов ведёт только поток, поэтому они
+приблизительные: при повторной доставке отметка считается дважды, при
+потерянной пачке — ни разу.
+
+Потребитель читает поток через группу потребителей пачками и подтверждает
+(XACK) записи только после применения, поэтому после сбоя необработанные
+пачки применяются повторно (доставка «хотя бы один раз»). Если пачка не
+применилась, её записи применяются по одной; запись, которая не применилась
+FANOUT_MAX_DELIVERIES раз подряд, переносится с текстом ошибки в поток
+attendance:ingest:dead и подтверждается, чтобы не задерживать остальные.
+"""
+import io
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Literal
+
+import msgpack
+import psycopg2
+import psycopg2.pool
+import redis
+from elasticsearch import Elasticsearch
+from fastapi import APIRouter, HTTPException
+from neo4j import GraphDatabase
+from pydantic import BaseModel
+
+import dataversion
+import querylog
+import tracing
+
+INGEST_STREAM = "attendance:ingest"
+INGEST_GROUP = "fanout"
+INGEST_CONSUMER = socket.gethostname()
+INGEST_DEAD_STREAM = "attendance:ingest:dead"
+# Наибольшее число отметок в одном запросе
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", 10000))
+# Приблизительная длина потока; старые записи обрезаются при XADD
+INGEST_STREAM_MAXLEN = int(os.getenv("INGEST_STREAM_MAXLEN", 100000))
+# Число записей потока (пачек отметок), которые потребитель применяет за раз
+FANOUT_BATCH = int(os.getenv("FANOUT_BATCH", 50))
+FANOUT_BLOCK_MS = 1000
+# Сколько раз запись потока выдаётся потребителю, прежде чем уйти в INGEST_DEAD_STREAM
+FANOUT_MAX_DELIVERIES = int(os.getenv("FANOUT_MAX_DELIVERIES", 5))
+# Подключения для COPY: столько запросов приёма пишут в attendance одновременно
+INGEST_POOL_MIN = int(os.getenv("INGEST_POOL_MIN", 1))
+INGEST_POOL_MAX = int(os.getenv("INGEST_POOL_MAX", 8))
+
+logger = logging.getLogger(__name__)
+
+
+# Журнал sync_outbox не отключается: по нему sync_worker доводит то, что не разнёс поток
+PG_PARAMS = dict(dbname="university_db", user="user", password="password", host="postgres")
+
+
+def pg_connect():
+    return querylog.connect(**PG_PARAMS)
+
+
+# Отдельные подключения для COPY: отчёты lab3 используют общее подключение main.py.
+# Каждый запрос берёт своё подключение из пула, поэтому медленный COPY не держит
+# остальные, а оборвавшееся подключение закрывается и заменяется новым
+ingest_pool = psycopg2.pool.ThreadedConnectionPool(INGEST_POOL_MIN, INGEST_POOL_MAX,
+                                                   cursor_factory=querylog.LoggedCursor, **PG_PARAMS)
+# Пул не ждёт свободного подключения, а бросает PoolError; запросы сверх
+# INGEST_POOL_MAX ждут здесь своей очереди
+ingest_slots = threading.BoundedSemaphore(INGEST_POOL_MAX)
+
+redis_conn = redis.Redis(host="redis", port=6379, db=0)
+neo_driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "password"))
+es = Elasticsearch("http://elasticsearch:9200")
+ES_INDEX = "lecture_materials"
+
+# Добавляет в scheduled_dates материала новые дни его лекции из params.dates
+ES_ADD_DATES_SCRIPT = """
+    def added = params.dates[String.valueOf(ctx._source.lecture_id)];
+    if (ctx._source.scheduled_dates == null) { ctx._source.scheduled_dates = new ArrayList(); }
+    boolean changed = false;
+    for (d in added) {
+        if (!ctx._source.scheduled_dates.contains(d)) { ctx._source.scheduled_dates.add(d); changed = true; }
+    }
+    if (!changed) { ctx.op = 'noop'; }
+"""
+
+router = APIRouter()
+
+
+class AttendanceRecord(BaseModel):
+    student_id: int
+    schedule_id: int
+    attendance_date: datetime
+    status: Literal["presence", "absence", "late"]
+
+
+def week_monday(moment: datetime) -> str:
+    return (moment.date() - timedelta(days=moment.weekday())).isoformat()
+
+
+#Приём пачки отметок; обычная (не async) функция выполняется FastAPI в пуле потоков
+@router.post("/attendance/batch")
+def ingest_attendance(records: List[AttendanceRecord]):
+    if not records:
+        return {"accepted": 0}
+    if len(records) > INGEST_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Не больше {INGEST_MAX_BATCH} отметок в запросе")
+
+    buf = io.StringIO()
+    for r in records:
+        buf.write(f"{r.student_id}\t{r.schedule_id}\t{r.attendance_date.isoformat()}\t"
+                  f"{week_monday(r.attendance_date)}\t{r.status}\n")
+    buf.seek(0)
+
+    with ingest_slots:
+        conn = ingest_pool.getconn()
+        try:
+            with tracing.span("postgres.copy_attendance", rows=len(records)), conn.cursor() as cur:
+                cur.copy_expert(
+                    "COPY attendance (student_id, schedule_id, attendance_date, week_start, status) FROM STDIN",
+                    buf)
+            conn.commit()
+        except psycopg2.IntegrityError as e:
+            # Пачка принимается целиком или не принимается: неизвестный студент или занятие
+            conn.rollback()
+            raise HTTPException(status_code=422, detail=str(e).strip())
+        except psycopg2.Error:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+            raise
+        finally:
+            # Закрытое подключение пул отбрасывает; следующий getconn откроет новое
+            ingest_pool.putconn(conn, close=bool(conn.closed))
+
+    payload = msgpack.packb([[r.student_id, r.schedule_id, r.attendance_date.isoformat(), r.status]
+                             for r in records])
+    try:
+        with tracing.span("redis.xadd", rows=len(records)):
+            redis_conn.xadd(INGEST_STREAM, {"records": payload}, maxlen=INGEST_STREAM_MAXLEN, approximate=True)
+    except redis.RedisError as e:
+        # Отметки уже записаны; хранилища догонит sync_worker по sync_outbox
+        logger.warning(f"Пачка из {len(records)} отметок не попала в поток {INGEST_STREAM}: {e}")
+        return {"accepted": len(records), "fanout": "deferred"}
+    return {"accepted": len(records)}
+
+
+def apply_fanout(conn, records):
+    """Применяет производные обновления для отметок [student_id, schedule_id, дата, статус]."""
+    # Счётчики отметок студента по статусам
+    with tracing.span("redis.counters", rows=len(records)):
+        pipe = redis_conn.pipeline(transaction=False)
+        for student_id, _, _, status in records:
+            pipe.hincrby(f"attendance:student:{student_id}", status, 1)
+        pipe.execute()
+
+    # Каждый новый день занятия — узел Schedule (см. NEO4J_OCCURRENCES_CYPHER генератора)
+    with tracing.span("postgres.schedules") as s, conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.id, s.group_id, s.lecture_id, g.name
+            FROM schedule s JOIN groups g ON g.id = s.group_id
+            WHERE s.id = ANY(%s)
+        """, (list({r[1] for r in records}),))
+        schedules = {row[0]: row for row in cur.fetchall()}
+        s.set_attribute("rows", len(schedules))
+    conn.rollback()
+
+    occurrences = {}
+    scopes = {"attendance"}
+    for _, schedule_id, attendance_date, _ in records:
+        if schedule_id not in schedules:
+            continue
+        _, group_id, lecture_id, group_name = schedules[schedule_id]
+        day = datetime.fromisoformat(attendance_date).date()
+        scopes.add(f"group:{group_name}")
+        scopes.add(dataversion.semester_scope(day))
+        occurrences[(schedule_id, day)] = {
+            "schedule_id": schedule_id,
+            "group_id": group_id,
+            "lecture_id": lecture_id,
+            "date": day
+        }
+    if occurrences:
+        with tracing.span("neo4j.occurrences", rows=len(occurrences)), neo_driver.session() as session:
+            session.execute_write(lambda tx: tx.run("""
+                UNWIND $rows AS row
+                MATCH (gr:Group {id: row.group_id})
+                MATCH (lec:Lecture {id: row.lecture_id})
+                MERGE (o:Schedule {schedule_id: row.schedule_id, date: row.date})
+                SET o.group_id = row.group_id,
+                    o.lecture_id = row.lecture_id
+                MERGE (gr)-[:HAS_OCCURRENCE]->(o)
+                MERGE (o)-[:OF_LECTURE]->(lec)
+            """, rows=list(occurrences.values())).consume())
+
+        lecture_dates = {}
+        for row in occurrences.values():
+            lecture_dates.setdefault(str(row["lecture_id"]), set()).add(row["date"].isoformat())
+        with tracing.span("elasticsearch.add_dates", rows=len(lecture_dates)):
+            es.update_by_query(
+                index=ES_INDEX,
+                query={"terms": {"lecture_id": [int(lecture_id) for lecture_id in lecture_dates]}},
+                script={"source": ES_ADD_DATES_SCRIPT, "lang": "painless",
+                        "params": {"dates": {k: sorted(v) for k, v in lecture_dates.items()}}},
+                conflicts="proceed"
+            )
+
+    # Отчёты по затронутым группам и семестрам получают новый ETag
+    scopes.discard(None)
+    dataversion.bump(scopes)
+
+
+def reset_conn(conn):
+    """Подключение, пригодное для следующей пачки: откатывает или открывает заново."""
+    try:
+        if conn.closed:
+            return pg_connect()
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    return conn
+
+
+def deliveries(entry_id):
+    """Сколько раз запись потока выдавалась группе потребителей."""
+    pending = redis_conn.xpending_range(INGEST_STREAM, INGEST_GROUP, min=entry_id, max=entry_id, count=1)
+    return pending[0]["times_delivered"] if pending else 0
+
+
+def apply_entries(conn, entries):
+    """Применяет записи потока; возвращает подключение и признак, что подтверждены все."""
+    try:
+        records = []
+        for _, fields in entries:
+            records.extend(msgpack.unpackb(fields[b"records"], raw=False))
+        apply_fanout(conn, records)
+        redis_conn.xack(INGEST_STREAM, INGEST_GROUP, *[entry_id for entry_id, _ in entries])
+        return conn, True
+    except redis.RedisError:
+        raise
+    except Exception:
+        logger.exception(f"Ошибка обработки пачки потока {INGEST_STREAM}")
+        conn = reset_conn(conn)
+
+    # По одной: запись, которая не применяется, не держит остальные
+    acked = True
+    for entry_id, fields in entries:
+        try:
+            apply_fanout(conn, msgpack.unpackb(fields[b"records"], raw=False))
+        except redis.RedisError:
+            raise
+        except Exception as e:
+            conn = reset_conn(conn)
+            if deliveries(entry_id) < FANOUT_MAX_DELIVERIES:
+                # Останется неподтверждённой и будет выдана снова
+                acked = False
+                continue
+            redis_conn.xadd(INGEST_DEAD_STREAM, {**fields, b"source_id": entry_id, b"error": str(e)},
+                            maxlen=INGEST_STREAM_MAXLEN, approximate=True)
+            logger.warning(f"Запись {entry_id!r} потока {INGEST_STREAM} перенесена в {INGEST_DEAD_STREAM}: {e}")
+        redis_conn.xack(INGEST_STREAM, INGEST_GROUP, entry_id)
+    return conn, acked
+
+
+def consume():
+    conn = pg_connect()
+    try:
+        redis_conn.xgroup_create(INGEST_STREAM, INGEST_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    # Сначала дочитываются записи, выданные этому потребителю, но не подтверждённые
+    cursor = "0"
+    while True:
+        try:
+            response = redis_conn.xreadgroup(INGEST_GROUP, INGEST_CONSUMER, {INGEST_STREAM: cursor},
+                                             count=FANOUT_BATCH, block=FANOUT_BLOCK_MS)
+            entries = response[0][1] if response else []
+            if not entries:
+                cursor = ">"
+                continue
+            conn, acked = apply_entries(conn, entries)
+            if not acked:
+                # Повторное чтение с "0" выдаёт неподтверждённые записи и увеличивает их счётчик доставок
+                cursor = "0"
+                time.sleep(1)
+        except Exception:
+            logger.exception(f"Ошибка обработки потока {INGEST_STREAM}")
+            cursor = "0"
+            time.sleep(1)
+            conn = reset_conn(conn)
+
+
+def start_consumer():
+    threading.Thread(target=consume, name="attendance-fanout", daemon=True).start()
@@ -1,58 +1,92 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from typing import List, Dict, Any
 
 # Database clients initialization
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from neo4j import GraphDatabase
 import redis
 from pymongo import MongoClient
 import json
+import msgpack
+
+import dataversion
+import ingest
+import metrics
+import profiler
+import querylog
+import resultcache
+import singleflight
+import tracing
 
 # Create persistent connections
-pg_conn = psycopg2.connect(dbname="university_db", user="user", password="password", host="postgres")
-pg_cur = pg_conn.cursor(cursor_factory=RealDictCursor)
+pg_conn = querylog.connect(dbname="university_db", user="user", password="password", host="postgres")
+# Отчёты считаются параллельно в пуле потоков: без общей транзакции на подключение,
+# у каждого вызова свой курсор
+pg_conn.autocommit = True
+
+
+def dict_cursor():
+    return pg_conn.cursor(cursor_factory=querylog.LoggedRealDictCursor)
+
 
 neo_driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "password"))
 
 redis_conn = redis.Redis(host="redis", port=6379, db=0)
 
-mongo_conn = MongoClient("mongodb://mongo:27017/")
+mongo_conn = MongoClient("mongodb://mongo:27017/", event_listeners=[metrics.MongoPoolListener()])
 
 app = FastAPI()
+tracing.install(app, "lab3")
+metrics.install(app)
+profiler.install(app)
+app.include_router(ingest.router)
+app.include_router(querylog.router)
+app.include_router(resultcache.router)
+
+
+@app.on_event("startup")
+def start_ingest_consumer():
+    ingest.start_consumer()
 
 #Получаем id группы и кафедры
 def get_group_info(name: str) -> Dict[str, Any]:
-    pg_cur.execute(
-        """
-        SELECT id AS grp_id, department_id
-        FROM groups
-        WHERE name = %s
-        """,
-        (name,)
-    )
-    return pg_cur.fetchone() or {}
+    with tracing.span("postgres.group") as s, dict_cursor() as pg_cur:
+        pg_cur.execute(
+            """
+            SELECT id AS grp_id, department_id
+            FROM groups
+            WHERE name = %s
+            """,
+            (name,)
+        )
+        row = pg_cur.fetchone()
+        s.set_attribute("rows", 1 if row else 0)
+    return row or {}
 
 #Получаем список специальных курсов для указанной группы
+@resultcache.cached("group_courses", lambda group_name: ["epoch", "catalog"])
 def get_courses(group_name: str) -> List[Dict[str, Any]]:
 
-    pg_cur.execute(
-        """
-        SELECT lc.id AS course_id,
-               lc.name AS course_name,
-               lc.planned_hours,
-               l.id AS lecture_id
-        FROM lecture_course lc
-        JOIN lectures l ON lc.id = l.course_id
-        JOIN schedule s ON l.id = s.lecture_id
-        JOIN groups g ON g.id = s.group_id
-        WHERE l.is_special = TRUE AND g.name = %s
-        """,
-        (group_name,)
-    )
-    return pg_cur.fetchall()
+    with tracing.span("postgres.courses") as s, dict_cursor() as pg_cur:
+        pg_cur.execute(
+            """
+            SELECT lc.id AS course_id,
+                   lc.name AS course_name,
+                   lc.planned_hours,
+                   l.id AS lecture_id
+            FROM lecture_course lc
+            JOIN lectures l ON lc.id = l.course_id
+            JOIN schedule s ON l.id = s.lecture_id
+            JOIN groups g ON g.id = s.group_id
+            WHERE l.is_special = TRUE AND g.name = %s
+            """,
+            (group_name,)
+        )
+        rows = pg_cur.fetchall()
+        s.set_attribute("rows", len(rows))
+    return rows
 
 #Получаем расписание из Neo4j для группы и списка лекций, инфу о студенте
+@resultcache.cached("group_schedules", lambda group_name, lec_ids: ["epoch", "catalog"])
 def get_schedules(group_name: str, lec_ids: List[int]) -> List[tuple]:
     query = (
         """
@@ -63,38 +97,64 @@ def get_schedules(group_name: str, lec_ids: List[int]) -> List[tuple]:
         RETURN s.id AS student_id, l.id AS lecture_id, sch.schedule_id AS sched_id
         """
     )
-    with neo_driver.session() as session:
+    with tracing.span("neo4j.schedules") as s, neo_driver.session() as session:
         res = session.run(query, grp=group_name, lec_ids=lec_ids)
-        return [(r['student_id'], r['lecture_id'], r['sched_id']) for r in res]
+        rows = [(r['student_id'], r['lecture_id'], r['sched_id']) for r in res]
+        s.set_attribute("rows", len(rows))
+        return rows
 
 #Подсчёт посещаемости
 def count_presence(student_id: int, sched_id: int) -> int:
-    pg_cur.execute(
-        """
-        SELECT COUNT(*) * 2 AS attended
-        FROM attendance
-        WHERE student_id = %s AND schedule_id = %s
-          AND status IN ('presence','late')
-        """,
-        (student_id, sched_id)
-    )
-    return pg_cur.fetchone().get('attended', 0)
+    with tracing.span("postgres.presence") as s, dict_cursor() as pg_cur:
+        pg_cur.execute(
+            """
+            SELECT COUNT(*) * 2 AS attended
+            FROM attendance
+            WHERE student_id = %s AND schedule_id = %s
+              AND status IN ('presence','late')
+            """,
+            (student_id, sched_id)
+        )
+        s.set_attribute("rows", 1)
+        return pg_cur.fetchone().get('attended', 0)
+
+#Посещаемость студентов группы по лекциям: [student_id, lecture_id, часы]
+@resultcache.cached("group_presence", lambda group_name, lec_ids: ["epoch", "catalog", f"group:{group_name}"])
+def get_presence(group_name: str, lec_ids: List[int]) -> List[List[int]]:
+    return [[sid, lid, count_presence(sid, sched_id)]
+            for sid, lid, sched_id in get_schedules(group_name, lec_ids)]
+
+STUDENT_FIELDS = ("id", "full_name", "student_record", "group_id")
+
+#Декодируем student:{id}: JSON (версия 1) или msgpack-массив (версия 2)
+def decode_student(raw: bytes) -> Dict[str, Any]:
+    if raw[:1] == b"{":
+        return json.loads(raw)
+    version, *values = msgpack.unpackb(raw, raw=False)
+    if version != 2:
+        raise ValueError(f"Unsupported student schema version: {version}")
+    return dict(zip(STUDENT_FIELDS, values))
 
 #Получаем инфу о студентах
 def get_students(sids: List[int]) -> Dict[int, Any]:
     students = {}
-    for sid in sids:
-        data = redis_conn.get(f"student:{sid}")
-        if data:
-            students[sid] = json.loads(data)
+    with tracing.span("redis.students") as s:
+        for sid in sids:
+            data = redis_conn.get(f"student:{sid}")
+            if data:
+                students[sid] = decode_student(data)
+        s.set_attribute("rows", len(students))
     return students
 
 #Получаем организационную структуру университетов
+@resultcache.cached("department_org", lambda dept_id: ["epoch", "catalog"])
 def get_org_structure(dept_id: int) -> Dict[str, Any]:
-    rec = mongo_conn['university'].university.find_one(
-        {"institutes.departments.id": dept_id},
-        {"institutes": 1, "name": 1}
-    ) or {}
+    with tracing.span("mongo.university") as s:
+        rec = mongo_conn['university'].university.find_one(
+            {"institutes.departments.id": dept_id},
+            {"institutes": 1, "name": 1}
+        ) or {}
+        s.set_attribute("rows", 1 if rec else 0)
     for inst in rec.get('institutes', []):
         for dept in inst.get('departments', []):
             if dept['id'] == dept_id:
@@ -107,7 +167,20 @@ def get_org_structure(dept_id: int) -> Dict[str, Any]:
 
 # --- Endpoint ---
 @app.get("/group-attendance", response_model=List)
-async def attendance_report(group_name: str = Query(..., description="Название группы, например SRSE-767")) -> List[Dict[str, Any]]:
+async def attendance_report(request: Request, outgoing: Response,
+                            group_name: str = Query(..., description="Название группы, например SRSE-767")) -> List[Dict[str, Any]]:
+    # Отчёт меняется только вместе с версиями его данных, 304 отдаётся без запросов к хранилищам
+    tag = dataversion.etag(["epoch", "catalog", f"group:{group_name}"])
+    cached = dataversion.not_modified(request, tag)
+    if cached is not None:
+        return cached
+    dataversion.set_headers(outgoing, tag)
+    # Одинаковые одновременные запросы группы считаются один раз, в пуле потоков
+    return await singleflight.flights.do(singleflight.key("group-attendance", tag, group_name=group_name),
+                                         build_attendance_report, group_name)
+
+
+def build_attendance_report(group_name: str) -> List[Dict[str, Any]]:
     grp = get_group_info(group_name)
     if not grp:
         raise HTTPException(status_code=404, detail="Группа не найдена")
@@ -116,10 +189,8 @@ async def attendance_report(group_name: str = Query(..., description="Назва
     if not courses:
         raise HTTPException(status_code=404, detail="Курсы не найдены для группы")
 
-    schedules = get_schedules(group_name, [c['lecture_id'] for c in courses])
     attendance_map: Dict[int, Dict[int, int]] = {}
-    for sid, lid, sched_id in schedules:
-        attended = count_presence(sid, sched_id)
+    for sid, lid, attended in get_presence(group_name, [c['lecture_id'] for c in courses]):
         attendance_map.setdefault(sid, {})[lid] = attended
 
     students = get_students(list(attendance_map.keys()))
@@ -0,0 +1,201 @@
+"""Профилирование отдельного запроса по требованию администратора.
+
+Запрос с заголовком X-Profile (или параметром ?profile=) и верным
+X-Admin-Token выполняется под профилировщиком:
+
+  * cprofile — детерминированный cProfile, файл .prof (pstats, snakeviz);
+  * collapsed — выборка стека каждые PROFILE_INTERVAL_MS, файл .collapsed
+    в формате «кадр;кадр;кадр число» для flamegraph.pl и speedscope.
+
+Профиль сохраняется в PROFILE_DIR (хранятся последние PROFILE_MAX_FILES
+файлов), а ответ получает заголовки X-Profile-Id и X-Profile-Url; файл
+скачивается через GET /admin/profiles/{name}.
+
+Профилируются только вызовы, выполненные через run() в пуле потоков
+(вычисления отчётов, см. singleflight): поток цикла событий общий для всех
+запросов, и в его профиль попали бы одновременные запросы. Одновременно
+профилируется не больше одного запроса (иначе 409).
+
+Модуль одинаков в lab2 и lab3 (у каждого сервиса свой Docker-контекст).
+"""
+import cProfile
+import contextvars
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
+
+import admin
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 20))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+PROFILE_NAME_RE = re.compile(r"^[0-9A-Za-z-]+\.(prof|collapsed)$")
+
+_profile_lock = threading.Lock()
+_active = contextvars.ContextVar("profile", default=None)
+
+
+class DeterministicProfile:
+    extension = "prof"
+
+    def __init__(self):
+        # Профили потоков пула: один объект cProfile нельзя включить в двух потоках
+        self.thread_profiles = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def run_in_thread(self, fn, *args):
+        profile = cProfile.Profile()
+        self.thread_profiles.append(profile)
+        return profile.runcall(fn, *args)
+
+    def save(self, path):
+        stats = pstats.Stats()
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+
+class SamplingProfile:
+    extension = "collapsed"
+
+    def __init__(self):
+        # Потоки пула, выполняющие run() этого запроса
+        self.thread_ids = set()
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run_in_thread(self, fn, *args):
+        thread_id = threading.get_ident()
+        self.thread_ids.add(thread_id)
+        try:
+            return fn(*args)
+        finally:
+            self.thread_ids.discard(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL_MS / 1000):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.counts[";".join(reversed(stack))] += 1
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+MODES = {
+    "cprofile": DeterministicProfile,
+    "collapsed": SamplingProfile,
+}
+
+
+def active():
+    return _active.get() is not None
+
+
+def run(fn, *args):
+    """Выполняет fn в текущем потоке (пула) под профилем запроса, если запрос профилируется."""
+    profile = _active.get()
+    if profile is None:
+        return fn(*args)
+    return profile.run_in_thread(fn, *args)
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = [e for e in os.scandir(PROFILE_DIR) if PROFILE_NAME_RE.match(e.name)]
+    return sorted(entries, key=lambda e: e.stat().st_mtime, reverse=True)
+
+
+def save_profile(profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(4)}.{profile.extension}"
+    profile.save(os.path.join(PROFILE_DIR, name))
+    # Каталог ограничен: удаляются самые старые профили сверх PROFILE_MAX_FILES
+    for entry in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return name
+
+
+async def middleware(request, call_next):
+    mode = request.headers.get("x-profile") or request.query_params.get("profile")
+    if not mode:
+        return await call_next(request)
+    if mode not in MODES:
+        return JSONResponse({"detail": f"Unknown profile mode, expected one of: {', '.join(MODES)}"},
+                            status_code=400)
+    if not admin.is_admin(request.headers.get("x-admin-token")):
+        return JSONResponse({"detail": "Admin token required"}, status_code=403)
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse({"detail": "Another request is being profiled"}, status_code=409)
+
+    try:
+        profile = MODES[mode]()
+        token = _active.set(profile)
+        profile.start()
+        try:
+            response = await call_next(request)
+        finally:
+            profile.stop()
+            _active.reset(token)
+        name = save_profile(profile)
+    finally:
+        _profile_lock.release()
+    response.headers["X-Profile-Id"] = name
+    response.headers["X-Profile-Url"] = f"/admin/profiles/{name}"
+    return response
+
+
+router = APIRouter(dependencies=[Depends(admin.require_admin)])
+
+
+@router.get("/admin/profiles")
+def get_profiles():
+    return [{"name": e.name, "size": e.stat().st_size, "created": e.stat().st_mtime} for e in list_profiles()]
+
+
+@router.get("/admin/profiles/{name}")
+def download_profile(name: str):
+    path = os.path.join(PROFILE_DIR, name)
+    if not PROFILE_NAME_RE.match(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+
+def install(app):
+    app.include_router(router)
+    app.middleware("http")(middleware)
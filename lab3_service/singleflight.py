@@ -0,0 +1,132 @@
+"""Объединение одинаковых одновременных вычислений отчёта (singleflight).
+
+    flights.do(key("group-attendance", tag, group_name=name), build_report, name)
+
+Ключ включает ETag ответа (версии данных, под которыми он выдаётся): запрос,
+получивший ETag после сдвига версий, не присоединится к вычислению, начатому
+до сдвига, и не получит старое тело под новым ETag.
+
+Первый запрос с ключом запускает вычисление в пуле потоков; запросы с тем же
+ключом, пришедшие до его окончания, ждут тот же результат (или ту же ошибку),
+не обращаясь к хранилищам. Отмена одного ожидающего запроса вычисление не
+прерывает. Профилируемый запрос (profiler) всегда считается отдельно.
+
+При SINGLEFLIGHT_REDIS=true объединение работает и между репликами: ведущий
+берёт в Redis блокировку singleflight:lock:<ключ> и кладёт готовый результат
+в singleflight:result:<ключ> на SINGLEFLIGHT_RESULT_TTL_MS; остальные реплики
+ждут этот результат, пока блокировка жива, и считают сами, если ведущий
+завершился ошибкой. Это же не даёт всем репликам разом пересчитывать отчёт
+после инвалидации кэша.
+
+Модуль одинаков в lab2 и lab3 (у каждого сервиса свой Docker-контекст).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from urllib.parse import urlencode
+
+import redis
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+import profiler
+import tracing
+
+SINGLEFLIGHT_REDIS = os.getenv("SINGLEFLIGHT_REDIS", "false").lower() == "true"
+# Блокировка живёт дольше самого медленного отчёта; по истечении её может взять другая реплика
+SINGLEFLIGHT_LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", 30000))
+SINGLEFLIGHT_RESULT_TTL_MS = int(os.getenv("SINGLEFLIGHT_RESULT_TTL_MS", 2000))
+SINGLEFLIGHT_POLL_MS = 50
+
+# Снимает блокировку, только если она всё ещё принадлежит этому ведущему
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+FLIGHTS = metrics.Counter("singleflight_requests_total",
+                          "Запросы отчётов: result=leader|shared|remote (чей результат получен)",
+                          ("endpoint", "result"))
+
+redis_conn = redis.Redis(host="redis", port=6379, db=0) if SINGLEFLIGHT_REDIS else None
+
+
+def key(endpoint, version, **params):
+    """Ключ вычисления: эндпоинт, ETag ответа (None, пока версии не загружены) и параметры в порядке имён."""
+    params = sorted(params.items())
+    if version is not None:
+        params.append(("version", version))
+    return f"{endpoint}?{urlencode(params)}"
+
+
+def _redis_key(kind, flight_key):
+    return f"singleflight:{kind}:{hashlib.sha1(flight_key.encode()).hexdigest()}"
+
+
+def _compute_shared(flight_key, endpoint, fn, args):
+    """Вычисление под блокировкой Redis; выполняется в пуле потоков."""
+    lock_key = _redis_key("lock", flight_key)
+    result_key = _redis_key("result", flight_key)
+    token = secrets.token_hex(8)
+    deadline = time.monotonic() + SINGLEFLIGHT_LOCK_TTL_MS / 1000
+    while True:
+        if redis_conn.set(lock_key, token, nx=True, px=SINGLEFLIGHT_LOCK_TTL_MS):
+            break
+        cached = redis_conn.get(result_key)
+        if cached is not None:
+            FLIGHTS.inc((endpoint, "remote"))
+            return json.loads(cached)
+        # Ведущий другой реплики завершился без результата или завис — считаем сами
+        if not redis_conn.exists(lock_key) or time.monotonic() > deadline:
+            return _compute_local(endpoint, fn, args)
+        time.sleep(SINGLEFLIGHT_POLL_MS / 1000)
+
+    try:
+        result = jsonable_encoder(fn(*args))
+        redis_conn.set(result_key, json.dumps(result, ensure_ascii=False), px=SINGLEFLIGHT_RESULT_TTL_MS)
+        FLIGHTS.inc((endpoint, "leader"))
+        return result
+    finally:
+        redis_conn.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def _compute_local(endpoint, fn, args):
+    result = fn(*args)
+    FLIGHTS.inc((endpoint, "leader"))
+    return result
+
+
+class Group:
+    def __init__(self):
+        # Словарь меняется только в потоке цикла событий, блокировка не нужна
+        self._flights = {}
+
+    async def do(self, flight_key, fn, *args):
+        endpoint = flight_key.split("?", 1)[0]
+        if profiler.active():
+            # В профиль должно попасть само вычисление, а не ожидание чужого
+            return await run_in_threadpool(profiler.run, fn, *args)
+
+        task = self._flights.get(flight_key)
+        if task is not None:
+            FLIGHTS.inc((endpoint, "shared"))
+            with tracing.span("singleflight.shared"):
+                return await asyncio.shield(task)
+
+        if redis_conn is not None:
+            call = run_in_threadpool(_compute_shared, flight_key, endpoint, fn, args)
+        else:
+            call = run_in_threadpool(_compute_local, endpoint, fn, args)
+        task = asyncio.ensure_future(call)
+        self._flights[flight_key] = task
+        task.add_done_callback(lambda _: self._flights.pop(flight_key, None))
+        return await asyncio.shield(task)
+
+
+flights = Group()